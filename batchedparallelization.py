@@ -1,5 +1,4 @@
 import streamlit as st
-import requests
 import json
 from io import BytesIO
 import logging
@@ -8,19 +7,17 @@ import fitz
 import re
 import uuid
 import redis
-from openai import AzureOpenAI
+from llm_client import get_async_client, get_client
+from llm_cache import achat_completion, chat_completion
+from llm_engine import map_bounded
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
-import tiktoken
 from pydantic import BaseModel, Field, ValidationError
 from typing import List, Dict, Union
+from page_store import extract_dual_views
+from chunk_packer import fill_report, pack_records, page_ranges_from_summary
 
-llm_api_key = ""
-azure_llm_endpoint = ""
-llm_model = ""
-llm_api_version = ""
-
-llm_headers = {"Content-Type": "application/json", "api-key": llm_api_key}
+llm_model = os.getenv("AZURE_LLM_MODEL", "gpt-4o-mini")
 
 def preprocess_text(text: str) -> str:
     text = re.sub(r'\s+', ' ', text).strip()
@@ -28,10 +25,6 @@ def preprocess_text(text: str) -> str:
     text = re.sub(r'[\u2013\u2014]', '-', text)
     return text
 
-def count_tokens(text):
-    encoding = tiktoken.encoding_for_model(llm_model)
-    return len(encoding.encode(text))
-
 if "documents" not in st.session_state:
     st.session_state.documents = {}
 if "removed_documents" not in st.session_state:
@@ -77,23 +70,13 @@ if uploaded_files:
     for new_file in new_files:
             st.success(f"File Selected: {new_file.name}")
             pdf_bytes = new_file.read()
-            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-            page = doc[0]
-            rect = page.rect
-            height = 50
-            clip = fitz.Rect(0, height, rect.width, rect.height-height)
-            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+            # One block-level decode per page gives both the full text and the header/footer-free text
+            full_pages, extracted_pages2 = extract_dual_views(pdf_bytes)
             extracted_pages = []
             page_numbers = []
-            extracted_pages2 = []
             flag = False
-            
-            for page_num, page in enumerate(doc, start=1):
-                text = page.get_text(clip=clip)
-                extracted_pages2.append(text)
 
-            for page_num, page in enumerate(doc, start=1):
-                text = page.get_text()
+            for page_num, text in enumerate(full_pages, start=1):
                 if "USPTO Summary Page" in text:
                     flag = True
                 elif "ANALYST REVIEW −USPTO REPORT" in text:
@@ -156,28 +139,16 @@ if uploaded_files:
                     "temperature": 0.0,
                 }
 
-                url = f"{azure_llm_endpoint}/openai/deployments/{llm_model}/chat/completions?api-version={llm_api_version}"
-                llm_response = requests.post(
-                    url, headers=llm_headers, json=data, timeout=60
-                )
-                response = (
-                    llm_response.json()
-                    .get("choices", [{}])[0]
-                    .get("message", {})
-                    .get("content", "")
-                    .strip()
-                )
+                # Through the shared client, so the page-map call is pooled, cached and rate-limited like the rest
+                llm_response = chat_completion(get_client(), stage="extraction", **data)
+                response = (llm_response.choices[0].message.content or "").strip()
 
                 st_response = str(response)[7:-3]
                 record = json.loads(st_response)
 
                 async def extract_trademark_details_code1(document_chunk: str):
                     try:
-                        client = AzureOpenAI(
-                            azure_endpoint=azure_llm_endpoint,
-                            api_key=llm_api_key,
-                            api_version="2024-10-01-preview",
-                        )
+                        client = get_async_client()
 
                         messages = [
                             {"role": "system", "content": "You are a data extraction specialist proficient in parsing trademark documents."},
@@ -207,14 +178,11 @@ if uploaded_files:
                             }
                         ]
 
-                        loop = asyncio.get_event_loop()
-                        response = await loop.run_in_executor(
-                            None,
-                            lambda: client.chat.completions.create(
-                                model="gpt-4o-mini",
-                                messages=messages,
-                                temperature=0
-                            )
+                        response = await achat_completion(client,
+                            stage="extraction",
+                            model="gpt-4o-mini",
+                            messages=messages,
+                            temperature=0
                         )
                         extracted_text = response.choices[0].message.content
 
@@ -284,17 +252,11 @@ if uploaded_files:
                         logging.error(f"Error extracting trademark details: {e}")
                         return {"error": f"Error extracting trademark details: {str(e)}"}
                     
-                #Batch parallel execution    
+                #Batch parallel execution, at most LLM_CONCURRENCY chunks in flight, results in chunk order
                 async def parallel_extraction():
-                    tasks = []
-                    document_chunk = ""
-                    for i in range(len(record) - 1):
-                        start_page = int(record[i]["page-start"])-1
-                        end_page = int(record[i + 1]["page-start"])
-                        document_chunk = document_chunk + "\n".join(extracted_pages2[start_page: end_page])
-                        if count_tokens(document_chunk)>1000:
-                            tasks.append(extract_trademark_details_code1(document_chunk))
-                            document_chunk = ""
-                    await asyncio.gather(*tasks)
+                    # Whole records from the summary page map, packed up to the token budget without splitting any
+                    chunks = pack_records(page_ranges_from_summary(record, len(extracted_pages2)), lambda page_num: extracted_pages2[page_num])
+                    st.write(fill_report(chunks))
+                    return await map_bounded(extract_trademark_details_code1, [chunk.text for chunk in chunks])
 
                 asyncio.run(parallel_extraction())
@@ -0,0 +1,167 @@
+""" Queue depth and throughput of the grading tasks under Celery's default settings and under celery_app's
+named queues and worker settings, against a local fake LLM endpoint
+
+Usage: python benchmark_celery_queues.py [same-class tasks] [cross-class tasks]
+
+Both runs start two in-process workers on the in-memory broker and send the same shuffled batch of grading
+tasks: same-class tasks grade MARKS_PER_TASK marks each (one LLM call per mark), cross-class tasks one mark.
+The default run puts everything on one queue with Celery's prefetch (4 per slot) and early acks; the tuned
+run is create_app(): routed queues, one task reserved per slot, late acks.
+
+The memory broker polls queues round robin; a Redis broker with celery_app's queue_order_strategy drains the
+same-class queue strictly first, so the same-class wait measured here is an upper bound for the tuned run.
+"""
+
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from celery import Celery, group
+from celery.contrib.testing.worker import start_worker
+from kombu.transport import memory
+from openai import AzureOpenAI
+
+from celery_app import QUEUES, create_app
+
+FAKE_LATENCY = 0.2
+MARKS_PER_TASK = 4
+WORKERS = 2
+WORKER_CONCURRENCY = 4
+SAMPLE_SECONDS = 0.25
+
+# Start time of every task, by task id; the workers run in this process
+timings = {}
+timings_lock = threading.Lock()
+
+
+class PromptAckTransport(memory.Transport):
+    """ The memory transport, handing control back to the worker after every empty poll
+
+    The in-process workers run Celery's blocking loop, which sends acknowledgements only between drains, and
+    a drain waits up to two seconds while the worker's prefetch window is full. With one task reserved per slot
+    that stalls every slot; a prefork worker on Redis acknowledges from its event loop as each task finishes.
+    """
+
+    polling_interval = 0.01
+
+    def drain_events(self, connection, timeout=None):
+        return super().drain_events(connection, timeout=self.polling_interval)
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        params = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(FAKE_LATENCY)
+        payload = json.dumps({
+            "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": params["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "Conflict Grade: Low"}}],
+            "usage": {"prompt_tokens": 1700, "completion_tokens": 5, "total_tokens": 1705},
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def register_tasks(app: Celery, endpoint: str):
+    """ Stand-ins for the grading tasks, under the real task names so that the app's routes apply """
+    client = AzureOpenAI(azure_endpoint=endpoint, api_key="fake", api_version="2024-10-01-preview", max_retries=0)
+
+    def grade(mark: str) -> str:
+        response = client.chat.completions.create(model="gpt-4o-mini", messages=[{"role": "user", "content": mark}], max_tokens=50)
+        return response.choices[0].message.content
+
+    def timed(task_id: str, marks):
+        with timings_lock:
+            timings[task_id] = time.perf_counter()
+        return [grade(mark) for mark in marks]
+
+    @app.task(bind=True, name="celery_loaded.compare_trademarks")
+    def compare_trademarks(self, marks):
+        return timed(self.request.id, marks)
+
+    @app.task(bind=True, name="celery_loaded.compare_trademarks2")
+    def compare_trademarks2(self, mark):
+        return timed(self.request.id, [mark])
+
+    return compare_trademarks, compare_trademarks2
+
+
+def broker_depth(app: Celery, queues) -> int:
+    with app.connection_for_read() as connection:
+        channel = connection.default_channel
+        return sum(channel.queue_declare(queue=queue, passive=True).message_count for queue in queues)
+
+
+def run(mode: str, app: Celery, endpoint: str, same_class_tasks: int, cross_class_tasks: int, worker_queues):
+    app.loader.import_module("celery.contrib.testing.tasks")
+    compare_trademarks, compare_trademarks2 = register_tasks(app, endpoint)
+    kinds = ["same_class"] * same_class_tasks + ["cross_class"] * cross_class_tasks
+    random.Random(0).shuffle(kinds)
+    signatures = [
+        compare_trademarks.s([f"mark {i}.{j}" for j in range(MARKS_PER_TASK)]) if kind == "same_class" else compare_trademarks2.s(f"mark {i}")
+        for i, kind in enumerate(kinds)
+    ]
+    timings.clear()
+    workers = [start_worker(app, pool="threads", concurrency=WORKER_CONCURRENCY, perform_ping_check=False, queues=worker_queues) for _ in range(WORKERS)]
+    for worker in workers:
+        worker.__enter__()
+    try:
+        start = time.perf_counter()
+        group_result = group(signatures).apply_async()
+        samples = []
+        while not group_result.ready():
+            with timings_lock:
+                started = len(timings)
+            waiting = broker_depth(app, worker_queues)
+            # Sent but neither started nor in the broker: prefetched by a worker whose slots are all busy
+            samples.append((time.perf_counter() - start, waiting, max(0, len(kinds) - started - waiting)))
+            time.sleep(SAMPLE_SECONDS)
+        elapsed = time.perf_counter() - start
+        group_result.get(timeout=60)
+    finally:
+        for worker in reversed(workers):
+            worker.__exit__(None, None, None)
+
+    waits = {"same_class": [], "cross_class": []}
+    for kind, result in zip(kinds, group_result.results):
+        waits[kind].append(timings[result.id] - start)
+    calls = same_class_tasks * MARKS_PER_TASK + cross_class_tasks
+    print(f"{mode:>8} {len(kinds):>6} {elapsed:>8.2f} {len(kinds) / elapsed:>8.1f} {calls / elapsed:>8.1f} "
+          f"{max(sample[1] for sample in samples):>10} {max(sample[2] for sample in samples):>9} "
+          f"{sum(waits['same_class']) / len(waits['same_class']):>10.2f} {sum(waits['cross_class']) / len(waits['cross_class']):>10.2f}")
+    return samples
+
+
+def main(same_class_tasks: int, cross_class_tasks: int):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeLLMHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+
+    default_app = Celery("benchmark_default", backend="cache+memory://")
+    tuned_app = create_app("benchmark_tuned", broker=None, backend="cache+memory://")
+    for app in (default_app, tuned_app):
+        app.conf.broker_transport = PromptAckTransport
+
+    print(f"{WORKERS} workers x {WORKER_CONCURRENCY} threads, {FAKE_LATENCY}s per LLM call, {MARKS_PER_TASK} marks per same-class task")
+    print(f"{'mode':>8} {'tasks':>6} {'seconds':>8} {'tasks/s':>8} {'calls/s':>8} {'max queued':>10} {'max held':>9} {'same wait':>10} {'cross wait':>10}")
+    timelines = {
+        "default": run("default", default_app, endpoint, same_class_tasks, cross_class_tasks, ["celery"]),
+        "tuned": run("tuned", tuned_app, endpoint, same_class_tasks, cross_class_tasks, QUEUES),
+    }
+    print("\nqueued in broker / held by workers, every second")
+    for mode, samples in timelines.items():
+        step = max(1, round(1 / SAMPLE_SECONDS))
+        print(f"{mode:>8}: " + " ".join(f"{waiting}/{held}" for _, waiting, held in samples[::step]))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if sys.argv[1:] else 24, int(sys.argv[2]) if sys.argv[2:] else 72)
@@ -0,0 +1,104 @@
+""" Speed and field-level agreement of each text extraction backend on code1 and code2 reports
+
+Usage: python benchmark_extractors.py [report.pdf ...]
+
+Without arguments, synthetic USPTO (code1) and global "Nice Classes" (code2) reports are generated.
+Every backend is compared with the default "blocks" backend: pages/second for the page decode, the
+share of record fields that come out the same through parse_trademark_details (the extraction LLM
+call is stubbed as in benchmark_parse), and whether extract_trademark_details_code2 is identical on
+every page. The last line names the backend the pipeline's "auto" mode would prefer.
+"""
+
+import sys
+import tempfile
+import time
+
+import fitz  # PyMuPDF
+
+import celery_loaded
+from benchmark_parse import make_report, stub_llm
+from page_store import PageTextStore
+from text_extractor import DEFAULT_EXTRACTOR, EXTRACTORS, DiskCachedExtractor
+
+
+def make_code2_report(mark_count: int) -> fitz.Document:
+    pdf_document = fitz.open()
+    for i in range(mark_count):
+        page = pdf_document.new_page()
+        page.insert_text((72, 40), f"Global Search Report    {i + 1} / {mark_count}", fontsize=8)
+        page.insert_text((72, 96), "\n".join([
+            f"{i + 1} / {mark_count}",
+            f"GLOBAL MARK {i}",
+            "Status",
+            "Registered",
+            "Holder",
+            f"HOLDER {i} GMBH",
+            "Register",
+            "EUIPO",
+            "Nice Classes",
+            f"{i % 45 + 1}, 35",
+            f"Application# {20000000 + i}",
+            f"Registration# {30000000 + i}",
+            "Goods & Services",
+            f"CLOTHING, FOOTWEAR AND HEADGEAR FOR MARK {i}; RETAIL SERVICES",
+            "G&S translation",
+        ]), fontsize=9)
+    return pdf_document
+
+
+def decode_all(pdf_document: fitz.Document, extractor) -> PageTextStore:
+    page_store = PageTextStore(pdf_document, max_pages=pdf_document.page_count, extractor=extractor)
+    for page_num in range(pdf_document.page_count):
+        page_store.text(page_num)
+    return page_store
+
+
+def field_agreement(records, reference_records) -> float:
+    fields = matches = 0
+    for record, reference in zip(records, reference_records):
+        for name, value in reference.items():
+            fields += 1
+            matches += record.get(name) == value
+    # Records missing on either side count as wholly disagreeing
+    fields += abs(len(records) - len(reference_records)) * len(celery_loaded.TrademarkDetails.model_fields)
+    return matches / fields if fields else 1.0
+
+
+def main(reports):
+    stub_llm()
+    celery_loaded.print = lambda *args, **kwargs: None  # keep per-record logging out of the timings
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        disk_extractor = DiskCachedExtractor(DEFAULT_EXTRACTOR, cache_dir=cache_dir)
+        backends = [(name, extractor) for name, extractor in EXTRACTORS.items()]
+        backends += [(f"{disk_extractor.name} (cold)", disk_extractor), (f"{disk_extractor.name} (warm)", disk_extractor)]
+
+        print(f"{'report':>16} {'backend':>20} {'pages/s':>10} {'fields agree':>13} {'code2 identical':>16}")
+        totals = {name: [0.0, True] for name, extractor in backends}
+        for label, pdf_document in reports:
+            reference_store = decode_all(pdf_document, DEFAULT_EXTRACTOR)
+            reference_records = celery_loaded.parse_trademark_details(pdf_document, reference_store)
+            reference_code2 = [celery_loaded.extract_trademark_details_code2(reference_store.text(page_num)) for page_num in range(pdf_document.page_count)]
+
+            for name, extractor in backends:
+                start = time.perf_counter()
+                page_store = decode_all(pdf_document, extractor)
+                elapsed = time.perf_counter() - start
+                records = celery_loaded.parse_trademark_details(pdf_document, page_store)
+                code2 = [celery_loaded.extract_trademark_details_code2(page_store.text(page_num)) for page_num in range(pdf_document.page_count)]
+
+                identical = code2 == reference_code2
+                totals[name][0] += elapsed
+                totals[name][1] = totals[name][1] and identical
+                print(f"{label:>16} {name:>20} {pdf_document.page_count / elapsed:>10.0f} {field_agreement(records, reference_records):>13.3f} {str(identical):>16}")
+
+    # The warm disk cache only reflects repeat runs of the same report, so it is not a candidate for a first run
+    candidates = [(elapsed, name) for name, (elapsed, identical) in totals.items() if identical and not name.endswith("(warm)")]
+    print(f"Fastest backend with identical code2 results: {min(candidates)[1]}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:]:
+        main([(path.rsplit("/", 1)[-1][-16:], fitz.open(path)) for path in sys.argv[1:]])
+    else:
+        main([("code1 x 300", make_report(300)), ("code2 x 300", make_code2_report(300))])
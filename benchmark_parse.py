@@ -0,0 +1,105 @@
+""" Per-record cost of parse_trademark_details at 50, 500 and 2000 marks
+
+Usage: python benchmark_parse.py [mark counts...]
+
+Builds synthetic one-page-per-mark USPTO (code1) reports and swaps the extraction LLM call for a
+deterministic stub, so the numbers measure the parser itself. The legacy column replays the old
+behaviour of rebuilding the whole trademark list on every matching page.
+"""
+
+import sys
+import time
+
+import fitz  # PyMuPDF
+
+import celery_loaded
+from page_store import PageTextStore
+from report_index import ReportIndex
+
+
+def make_report(mark_count: int) -> fitz.Document:
+    pdf_document = fitz.open()
+    for i in range(mark_count):
+        page = pdf_document.new_page()
+        page.insert_text((72, 72), "\n".join([
+            f"MARK {i}",
+            "Status: REGISTERED",
+            "Goods/Services:",
+            f"International Class {i % 45 + 1}: GOODS FOR MARK {i}",
+            "Last Reported Owner:",
+            f"OWNER {i} INC",
+            "Chronology:",
+            f"Serial Number: 87-{i // 1000 % 1000:03d},{i % 1000:03d}",
+            f"Registration Number: {1000000 + i:,}",
+            "Design Phrase: WORD MARK",
+            "Filing Correspondent:",
+        ]), fontsize=9)
+    return pdf_document
+
+
+def fake_extract_trademark_details_code1(document_chunk: str) -> dict:
+    mark = document_chunk.split(" Status:", 1)[0].strip()
+    owner = document_chunk.split("Last Reported Owner: ", 1)[1].split(" Chronology:", 1)[0]
+    return {"trademark_name": mark, "status": "REGISTERED", "serial_number": "00-000,000", "owner": owner}
+
+
+async def fake_aextract_trademark_details_code1(document_chunk: str) -> dict:
+    return fake_extract_trademark_details_code1(document_chunk)
+
+
+async def fake_aextract_code1_records(pages) -> dict:
+    return {page_number: fake_extract_trademark_details_code1(document_chunk) for page_number, document_chunk in pages}
+
+
+async def fake_aextract_code1_fields(item) -> dict:
+    document_chunk, fields = item
+    details = fake_extract_trademark_details_code1(document_chunk)
+    return {field: details.get(field, "") for field in fields}
+
+
+def stub_llm():
+    """ Swap every code1 extraction call for the deterministic stub """
+    celery_loaded.extract_trademark_details_code1 = fake_extract_trademark_details_code1
+    celery_loaded.aextract_trademark_details_code1 = fake_aextract_trademark_details_code1
+    celery_loaded.aextract_code1_records = fake_aextract_code1_records
+    celery_loaded.aextract_code1_fields = fake_aextract_code1_fields
+
+
+def legacy_parse(pdf_document: fitz.Document, page_store: PageTextStore) -> int:
+    """ Replay of the pre-incremental loop: every matching page re-validates all earlier records """
+    report_index = ReportIndex(page_store)
+    all_extracted_data = []
+    validations = 0
+    for page_num in report_index.record_starts:
+        extracted_data = celery_loaded.extract_code1_page(page_store.text(page_num), page_num, page_store, report_index)
+        all_extracted_data.append(extracted_data)
+        for data in all_extracted_data:
+            celery_loaded.to_trademark_info(celery_loaded.build_code1_trademark(data))
+            validations += 1
+    return validations
+
+
+def main(mark_counts):
+    stub_llm()
+    celery_loaded.print = lambda *args, **kwargs: None  # keep per-record logging out of the timings
+
+    print(f"{'marks':>6} {'incremental s':>14} {'us/record':>10} {'legacy s':>10} {'us/record':>10} {'legacy validations':>19}")
+    for mark_count in mark_counts:
+        pdf_document = make_report(mark_count)
+
+        page_store = PageTextStore(pdf_document, max_pages=mark_count)
+        page_store.preload(min_pages=0)
+        start = time.perf_counter()
+        trademarks = celery_loaded.parse_trademark_details(pdf_document, page_store)
+        incremental = time.perf_counter() - start
+        assert len(trademarks) == mark_count
+
+        start = time.perf_counter()
+        validations = legacy_parse(pdf_document, page_store)
+        legacy = time.perf_counter() - start
+
+        print(f"{mark_count:>6} {incremental:>14.3f} {incremental / mark_count * 1e6:>10.1f} {legacy:>10.3f} {legacy / mark_count * 1e6:>10.1f} {validations:>19}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [50, 500, 2000])
@@ -0,0 +1,119 @@
+""" Throughput of the rate-limit scheduler against a local fake Azure OpenAI endpoint that injects 429s
+
+Usage: python benchmark_rate_limit.py [requests]
+
+The fake endpoint enforces its own per-second request and token quotas and answers anything over
+them with 429 and Retry-After-ms, like an Azure deployment at its TPM / RPM ceiling. The same batch
+of requests is sent twice: once at a fixed concurrency that only backs off per request, and once
+through RateLimitScheduler configured with the endpoint's quota.
+"""
+
+import asyncio
+import json
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openai import AsyncAzureOpenAI, RateLimitError
+
+from llm_engine import map_bounded
+from rate_limiter import RateLimitScheduler, estimate_tokens, retry_after_seconds
+
+# Fake deployment quota, per second (Azure enforces its per-minute quota over short windows too)
+FAKE_RPS = 20
+FAKE_TPS = 4000
+FAKE_LATENCY = 0.05
+CONCURRENCY = 32
+
+
+class FakeAzureHandler(BaseHTTPRequestHandler):
+    window = deque()  # (timestamp, tokens) admitted in the last second
+    lock = threading.Lock()
+    throttled = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: dict, headers: dict = None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        params = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        tokens = estimate_tokens(params)
+        cls = type(self)
+        with cls.lock:
+            now = time.monotonic()
+            while cls.window and now - cls.window[0][0] >= 1:
+                cls.window.popleft()
+            if len(cls.window) + 1 > FAKE_RPS or sum(t for _, t in cls.window) + tokens > FAKE_TPS:
+                cls.throttled += 1
+                retry_after = 1 - (now - cls.window[0][0]) if cls.window else 1
+                self._send(429, {"error": {"code": "429", "message": "Rate limit is exceeded."}}, {"retry-after-ms": str(int(retry_after * 1000))})
+                return
+            cls.window.append((now, tokens))
+        time.sleep(FAKE_LATENCY)
+        self._send(200, {
+            "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": params["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "ok"}}],
+            "usage": {"prompt_tokens": tokens, "completion_tokens": 1, "total_tokens": tokens + 1},
+        })
+
+
+def make_params(i: int) -> dict:
+    return {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": f"request {i} " + "word " * 300}], "max_tokens": 50, "temperature": 0}
+
+
+async def run_fixed(client: AsyncAzureOpenAI, count: int):
+    async def request(params):
+        for attempt in range(20):
+            try:
+                return await client.chat.completions.create(**params)
+            except RateLimitError as e:
+                await asyncio.sleep(retry_after_seconds(e))
+        raise RuntimeError("gave up")
+    return await map_bounded(request, [make_params(i) for i in range(count)], concurrency=CONCURRENCY, timeout=600)
+
+
+async def run_scheduled(client: AsyncAzureOpenAI, scheduler: RateLimitScheduler, count: int):
+    async def request(params):
+        return await scheduler.acall(lambda: client.chat.completions.create(**params), estimate_tokens(params))
+    return await map_bounded(request, [make_params(i) for i in range(count)], concurrency=CONCURRENCY, timeout=600)
+
+
+def main(count: int):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeAzureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+
+    print(f"{'mode':>10} {'requests':>9} {'seconds':>8} {'req/s':>7} {'429s':>6} {'failed':>7}  scheduler")
+    for mode in ["fixed", "scheduled"]:
+        FakeAzureHandler.throttled = 0
+        FakeAzureHandler.window.clear()
+        time.sleep(1)
+        scheduler = RateLimitScheduler(tpm=FAKE_TPS * 60, rpm=FAKE_RPS * 60, max_concurrency=CONCURRENCY, burst_seconds=1)
+
+        async def run():
+            client = AsyncAzureOpenAI(azure_endpoint=endpoint, api_key="fake", api_version="2024-10-01-preview", max_retries=0)
+            if mode == "fixed":
+                return await run_fixed(client, count)
+            return await run_scheduled(client, scheduler, count)
+
+        start = time.perf_counter()
+        results = asyncio.run(run())
+        elapsed = time.perf_counter() - start
+        failed = sum(isinstance(result, Exception) for result in results)
+        print(f"{mode:>10} {count:>9} {elapsed:>8.2f} {count / elapsed:>7.1f} {FakeAzureHandler.throttled:>6} {failed:>7}  {scheduler.stats() if mode == 'scheduled' else ''}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if sys.argv[1:] else 200)
@@ -0,0 +1,63 @@
+import os
+
+from celery import Celery
+from kombu import Queue
+
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis_host")
+CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis_host")
+
+# Grading tasks wait on the LLM for most of their run, so a worker runs many more of them than it has cores
+CELERY_WORKER_CONCURRENCY = int(os.getenv("CELERY_WORKER_CONCURRENCY", 16))
+
+# A task past the soft limit gets SoftTimeLimitExceeded and stops cleanly; past the hard limit its process is killed
+CELERY_SOFT_TIME_LIMIT = int(os.getenv("CELERY_SOFT_TIME_LIMIT", 600))
+CELERY_TIME_LIMIT = int(os.getenv("CELERY_TIME_LIMIT", 660))
+CELERY_RESULT_EXPIRES = int(os.getenv("CELERY_RESULT_EXPIRES", 24 * 3600))
+
+SAME_CLASS_QUEUE = "grading.same_class"
+CROSS_CLASS_QUEUE = "grading.cross_class"
+
+# Declaration order is consumption order: a worker on several queues takes same-class grading first. Only grading
+# is queued: extraction streams records out of the app's shared page store, and the report is assembled from them
+# in the app, so neither has work a worker could take without the whole PDF
+QUEUES = [SAME_CLASS_QUEUE, CROSS_CLASS_QUEUE]
+
+TASK_ROUTES = {
+    "celery_loaded.compare_trademarks": {"queue": SAME_CLASS_QUEUE},
+    "celery_loaded.compare_trademarks2": {"queue": CROSS_CLASS_QUEUE},
+}
+
+
+def create_app(name: str = "trademark_comparator", broker: str = CELERY_BROKER_URL, backend: str = CELERY_RESULT_BACKEND) -> Celery:
+    """ The Celery app of the comparator: one named queue per kind of grading task, with worker settings for long LLM-bound tasks
+
+    Start workers with `celery -A celery_loaded worker`, which consumes every queue in QUEUES order; add
+    `-Q grading.same_class` for a worker that only grades same-class marks. Keep the default prefork pool: the
+    time limits need it, and the threads pool only acknowledges late-acked tasks between blocking broker polls.
+    """
+    app = Celery(name, broker=broker, backend=backend)
+    app.conf.update(
+        task_queues=[Queue(queue) for queue in QUEUES],
+        task_default_queue=SAME_CLASS_QUEUE,
+        task_routes=TASK_ROUTES,
+        # Reserve one task per slot: a slow grading task must not hold prefetched tasks that an idle worker could run
+        worker_prefetch_multiplier=1,
+        worker_concurrency=CELERY_WORKER_CONCURRENCY,
+        # Acknowledge after the task ran, so a task on a worker that dies is delivered again; its graded marks
+        # are served from their work-item checkpoints
+        task_acks_late=True,
+        task_reject_on_worker_lost=True,
+        task_soft_time_limit=CELERY_SOFT_TIME_LIMIT,
+        task_time_limit=CELERY_TIME_LIMIT,
+        result_expires=CELERY_RESULT_EXPIRES,
+        broker_transport_options={
+            # Redis: poll the queues in declared order rather than round robin, so same-class work goes first
+            "queue_order_strategy": "priority",
+            # An unacknowledged task is handed to another worker after this long; it must outlast the hard limit
+            "visibility_timeout": CELERY_TIME_LIMIT + 300,
+        },
+    )
+    return app
+
+
+app = create_app()
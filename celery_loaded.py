@@ -1,27 +1,58 @@
 # Version - 6.1  (Code Updated of Checking for Non-matching Class number == GPT 4o mini)
 
 from fileinput import filename
-import time, os
+import time, os, sys
 import streamlit as st 
 import pandas as pd
 import fitz  # PyMuPDF
 from pydantic import BaseModel, Field, ValidationError
-from typing import List, Dict, Union
+from typing import List, Dict, Union, Iterator, Tuple
 import base64
 from docx import Document  
 from docx.shared import Pt
 from io import BytesIO
-import re, ast
+import re, ast, json
 from dotenv import load_dotenv
-from celery import Celery
+from celery import group
+from celery.exceptions import SoftTimeLimitExceeded
 from typing import List, Dict, Union
 import openai
-from openai import AzureOpenAI
 import redis
 import time
+from page_store import LOOKAHEAD_PAGES, PageTextStore, extract_page_texts, peak_rss_mb
+from report_index import ReportIndex, CODE1, CODE2
+from parse_cache import ParseCache
+from llm_client import get_async_client, get_client
+from llm_cache import achat_completion, chat_completion, llm_cache
+from prompt_templates import BATCH_TRADEMARK_ENTRY, get_prompt, prompt_cache_stats
+from rate_limiter import text_tokens
+from name_screen import name_screen_stats, screen_names, screened_reasoning
+from goods_similarity import GOODS_SIMILARITY, GOODS_SIMILARITY_PRUNE, embedding_cache, pruned_reasoning, score_goods_services
+from llm_usage import charged_to, usage_ledger
+from llm_engine import map_bounded_sync
+from code1_parser import code1_parse_stats, confident_fields, parse_code1_fields
+from chunk_packer import count_tokens
+from text_extractor import TextExtractor, get_extractor, select_extractor
+from work_items import WorkItemFailed, arun_work_item, current_report, report_id_for, run_work_item, work_item_store
+from celery_app import app
 
 load_dotenv()  
 
+# Text backend for report pages: a name from text_extractor.EXTRACTORS, or "auto" to benchmark the backends on
+# the first report a process parses and keep the fastest for every later one
+PDF_TEXT_EXTRACTOR = os.getenv("PDF_TEXT_EXTRACTOR", "blocks")
+
+# Records whose code1 pages are sent to the extraction engine together; large enough to keep every slot busy,
+# small enough that records keep streaming out of the parser
+LLM_EXTRACT_BATCH = int(os.getenv("LLM_EXTRACT_BATCH", 64))
+
+# "structured" packs several code1 records into one JSON-schema request; "text" sends one page per free-text request
+CODE1_EXTRACTION_MODE = os.getenv("CODE1_EXTRACTION_MODE", "structured")
+CODE1_RECORDS_PER_REQUEST = int(os.getenv("CODE1_RECORDS_PER_REQUEST", 4))
+
+# Parse name, status, serial number and owner from the page first; the LLM only fills what the parser cannot
+CODE1_REGEX_FIRST = os.getenv("CODE1_REGEX_FIRST", "1") == "1"
+
 
 
 class TrademarkDetails(BaseModel):
@@ -34,6 +65,34 @@ class TrademarkDetails(BaseModel):
     page_number: int = Field(description="The page number where the trademark details are found in the document", example=3)
     registration_number: Union[str, None] = Field(description="The Registration number of the trademark from Chronology section", example="5,809,957")
     design_phrase: str = Field(description="The design phrase of the trademark", example="THE MARK CONSISTS OF THE STYLIZED WORD 'MINI' FOLLOWED BY 'BY MOTHERHOOD.'", default="")
+
+
+class TrademarkRecords(BaseModel):
+    records: List[TrademarkDetails] = Field(description="One entry per trademark record in the document chunk")
+
+
+def strict_json_schema(schema, in_properties: bool = False):
+    """ Pydantic JSON schema reshaped for strict structured output: every property required, no extra keys or examples """
+    if isinstance(schema, list):
+        return [strict_json_schema(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    if in_properties:
+        # Keys here are field names, not schema keywords
+        return {name: strict_json_schema(value) for name, value in schema.items()}
+    strict = {key: strict_json_schema(value, key in ("properties", "$defs")) for key, value in schema.items() if key not in ("example", "default", "title")}
+    if strict.get("type") == "object" and "properties" in strict:
+        strict["required"] = list(strict["properties"])
+        strict["additionalProperties"] = False
+    return strict
+
+
+TRADEMARK_RECORDS_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "trademark_records", "strict": True, "schema": strict_json_schema(TrademarkRecords.model_json_schema())},
+}
+
+TRADEMARK_FIELD_SCHEMAS = strict_json_schema(TrademarkDetails.model_json_schema())["properties"]
     
 
 def preprocess_text(text: str) -> str:
@@ -49,58 +108,47 @@ def is_correct_format_code2(page_text: str) -> bool:
     required_fields = ["Register", "Nice Classes", "Goods & Services"]
     return all(field in page_text for field in required_fields)
 
-def extract_trademark_details_code1(document_chunk: str) -> Dict[str, Union[str, List[int]]]:
-    try:
-        from openai import AzureOpenAI
-        azure_endpoint =   
-        api_key =   
-          
-        client = AzureOpenAI(  
-            azure_endpoint=azure_endpoint,  
-            api_key=api_key,   
-            api_version="2024-10-01-preview",
-        )  
-         
-        # messages = [  
-        #     {  
-        #         "role": "system",  
-        #         "content": """You are a highly skilled data extraction specialist with expertise in parsing complex trademark research reports. Your primary goal is to accurately extract specified information from provided documents and present it in a structured format, strictly adhering to the given instructions and formatting requirements.  
-                
-        #         Please read the **Trademark Research Report** provided below and extract the following details for **each trademark** listed in the report. Return the results as a formatted string for each trademark, containing the following properties:  
-        
-        #         - **Trademark Name**: The name of the trademark.  
-        #         - **Status**: The status of the trademark (e.g., "Registered", "Pending", "Abandoned") as indicated in the report.  
-        #         - **Serial Number**: The serial number of the trademark.  
-        #         - **International Class Number**: A list of integers representing the International Class numbers associated with the trademark.  
-        #         - **Owner**: The owner of the trademark.  
-        #         - **Goods & Services**: The description of the goods/services associated with the trademark.  
-        #         - **Filed Date**: The filing date of the trademark in the format "MMM DD, YYYY".  
-        #         - **Registration Number**: The registration number of the trademark, if available. If not available, state "Not available in the document."  
-                
-        #         **Instructions:**  
-        #         - **Iterate through each trademark entry** in the report, starting from the **USPTO Summary** section.  
-        #         - Extract the required details for each trademark, referring to both the summary and the detailed entries that follow.  
-        #         - Use the exact property names provided above in your output.  
-        #         - For fields that are missing or not available, state "Not available in the document."  
-        #         - Ensure that:  
-        #         - Dates are formatted as "MMM DD, YYYY". If the date is spelled out (e.g., "November 27, 2024"), convert it accordingly to "Nov 27, 2024".  
-        #         - Numbers are represented appropriately (e.g., integers for class numbers and registration numbers).  
-        #         - **International Class Number** is a single integer or list of integers.  
-        #         - For owners with multiple parties, list all parties in a single string separated by semicolons.  
-        
-        #         **Example Output:**  
-        #         ```  
-        #         Trademark Name: SLIK Global Filings Status: PENDING FILED AS USE APPLICATION Serial Number: 98-602,112 International Class Number: 3 Owner: SLIK DE VENEZUELA C.A. VENEZUELA CORPORATION Goods & Services: Cosmetics; hair gel; hair wax; hair styling gel; non-medicated cosmetics Filed Date: JUN 14, 2024 Registration Number: Not available in the document.  
-        #         ```  
-        #         """  
-        #     },  
-        #     {  
-        #         "role": "user",  
-        #         "content": f"""  **Document:** {document_chunk}"""  
-        #     }  
-        # ]  
-        
-        messages=[  
+def code1_extraction_messages(document_chunk: str) -> List[Dict[str, str]]:
+    # messages = [  
+    #     {  
+    #         "role": "system",  
+    #         "content": """You are a highly skilled data extraction specialist with expertise in parsing complex trademark research reports. Your primary goal is to accurately extract specified information from provided documents and present it in a structured format, strictly adhering to the given instructions and formatting requirements.  
+            
+    #         Please read the **Trademark Research Report** provided below and extract the following details for **each trademark** listed in the report. Return the results as a formatted string for each trademark, containing the following properties:  
+    
+    #         - **Trademark Name**: The name of the trademark.  
+    #         - **Status**: The status of the trademark (e.g., "Registered", "Pending", "Abandoned") as indicated in the report.  
+    #         - **Serial Number**: The serial number of the trademark.  
+    #         - **International Class Number**: A list of integers representing the International Class numbers associated with the trademark.  
+    #         - **Owner**: The owner of the trademark.  
+    #         - **Goods & Services**: The description of the goods/services associated with the trademark.  
+    #         - **Filed Date**: The filing date of the trademark in the format "MMM DD, YYYY".  
+    #         - **Registration Number**: The registration number of the trademark, if available. If not available, state "Not available in the document."  
+            
+    #         **Instructions:**  
+    #         - **Iterate through each trademark entry** in the report, starting from the **USPTO Summary** section.  
+    #         - Extract the required details for each trademark, referring to both the summary and the detailed entries that follow.  
+    #         - Use the exact property names provided above in your output.  
+    #         - For fields that are missing or not available, state "Not available in the document."  
+    #         - Ensure that:  
+    #         - Dates are formatted as "MMM DD, YYYY". If the date is spelled out (e.g., "November 27, 2024"), convert it accordingly to "Nov 27, 2024".  
+    #         - Numbers are represented appropriately (e.g., integers for class numbers and registration numbers).  
+    #         - **International Class Number** is a single integer or list of integers.  
+    #         - For owners with multiple parties, list all parties in a single string separated by semicolons.  
+    
+    #         **Example Output:**  
+    #         ```  
+    #         Trademark Name: SLIK Global Filings Status: PENDING FILED AS USE APPLICATION Serial Number: 98-602,112 International Class Number: 3 Owner: SLIK DE VENEZUELA C.A. VENEZUELA CORPORATION Goods & Services: Cosmetics; hair gel; hair wax; hair styling gel; non-medicated cosmetics Filed Date: JUN 14, 2024 Registration Number: Not available in the document.  
+    #         ```  
+    #         """  
+    #     },  
+    #     {  
+    #         "role": "user",  
+    #         "content": f"""  **Document:** {document_chunk}"""  
+    #     }  
+    # ]  
+    
+    messages=[  
                     {"role": "system", "content": "You are a data extraction specialist proficient in parsing trademark documents."},  
                     {"role": "user", "content": f"""  
                         Extract the following details from the provided trademark document and present them in the exact format specified:  
@@ -123,27 +171,189 @@ def extract_trademark_details_code1(document_chunk: str) -> Dict[str, Union[str,
                         {document_chunk}  
                         """}  
                         ]  
-        
-        response = client.chat.completions.create(  
-                model="gpt-4o-mini",  
-                messages=messages,  
-                temperature=0,  
-                max_tokens=4000,  
-        )  
-        extracted_text = response.choices[0].message.content
-        
-        # if extracted_text and extracted_text != "[]":
-        #     st.write(extracted_text)
-            
-        details = {}
-        for line in extracted_text.split("\n"):
-            if ":" in line:
-                key, value = line.split(":", 1)
-                details[key.strip().lower().replace(" ", "_")] = value.strip()
-        return details
+    return messages
+
+
+def parse_code1_response(extracted_text: str) -> Dict[str, str]:
+    """ Turn the "Field: value" lines of an extraction response into a dict keyed by snake_case field name """
+    details = {}
+    for line in extracted_text.split("\n"):
+        if ":" in line:
+            key, value = line.split(":", 1)
+            details[key.strip().lower().replace(" ", "_")] = value.strip()
+    return details
+
+
+def extract_trademark_details_code1(document_chunk: str) -> Dict[str, Union[str, List[int]]]:
+    """ Extract one code1 record with a free-text request; errors are raised so the work item can retry them """
+    client = get_client()
+    response = chat_completion(client,
+            stage="extraction",
+            model="gpt-4o-mini",  
+            messages=code1_extraction_messages(document_chunk),  
+            temperature=0,  
+            max_tokens=4000,  
+    )  
+    extracted_text = response.choices[0].message.content
     
-    except Exception as e:
-        print(f"An error occurred: {e}")
+    # if extracted_text and extracted_text != "[]":
+    #     st.write(extracted_text)
+        
+    return parse_code1_response(extracted_text)
+
+
+async def aextract_trademark_details_code1(document_chunk: str) -> Dict[str, Union[str, List[int]]]:
+    """ Async counterpart of extract_trademark_details_code1 for the extraction engine; errors are left to the caller """
+    client = get_async_client()
+    response = await achat_completion(client,
+        stage="extraction",
+        model="gpt-4o-mini",
+        messages=code1_extraction_messages(document_chunk),
+        temperature=0,
+        max_tokens=4000,
+    )
+    return parse_code1_response(response.choices[0].message.content)
+
+
+def code1_records_messages(pages: List[Tuple[int, str]]) -> List[Dict[str, str]]:
+    """ One request covering several code1 records, each introduced by its page number """
+    document = "\n\n".join(f"=== Page {page_number} ===\n{document_chunk}" for page_number, document_chunk in pages)
+    return [
+        {"role": "system", "content": "You are a data extraction specialist proficient in parsing trademark documents."},
+        {"role": "user", "content": f"""
+            Each section below, introduced by "=== Page N ===", is one trademark record from a trademark research report.
+            Extract one record per section, with page_number set to the N of its section header.
+
+            **Instructions:**
+            - Serial Number and Registration Number come from the Chronology section; use null for a missing registration number.
+            - International Class Number is the list of integer classes from the Goods/Services section.
+            - Goods & Services is the full description, each class followed by its goods and services.
+            - Copy values as written in the document, without explanations.
+
+            **Document to extract from:**
+            {document}
+            """},
+    ]
+
+
+def parse_code1_records(content: str, page_numbers: List[int]) -> Dict[int, Dict[str, Union[str, List[int]]]]:
+    """ Validated records of a structured response keyed by page number; records for pages not asked about are dropped """
+    records = {}
+    for record in json.loads(content).get("records", []):
+        try:
+            trademark_details = TrademarkDetails(**record)
+        except ValidationError as e:
+            print(f"Validation error for structured record {record.get('page_number')}: {e}")
+            continue
+        if trademark_details.page_number in page_numbers:
+            records[trademark_details.page_number] = trademark_details.model_dump()
+    return records
+
+
+async def aextract_code1_records(pages: List[Tuple[int, str]]) -> Dict[int, Dict[str, Union[str, List[int]]]]:
+    """ Extract several code1 records in one structured-output request, keyed by page number """
+    client = get_async_client()
+    response = await achat_completion(client,
+        stage="extraction",
+        model="gpt-4o-mini",
+        messages=code1_records_messages(pages),
+        temperature=0,
+        max_tokens=4000,
+        response_format=TRADEMARK_RECORDS_FORMAT,
+    )
+    return parse_code1_records(response.choices[0].message.content, [page_number for page_number, document_chunk in pages])
+
+
+def code1_fields_messages(document_chunk: str, fields: List[str]) -> List[Dict[str, str]]:
+    """ Extraction prompt narrowed to the fields the deterministic parser could not fill """
+    field_list = "\n".join(f"- {field}: {TRADEMARK_FIELD_SCHEMAS[field]['description']}" for field in fields)
+    return [
+        {"role": "system", "content": "You are a data extraction specialist proficient in parsing trademark documents."},
+        {"role": "user", "content": f"""
+            Extract only the following fields of the trademark record below, copying values as written in the document:
+
+            {field_list}
+
+            **Document to extract from:**
+            {document_chunk}
+            """},
+    ]
+
+
+async def aextract_code1_fields(item: Tuple[str, List[str]]) -> Dict[str, str]:
+    """ Fill the given fields of one code1 page with a structured-output request covering only those fields """
+    document_chunk, fields = item
+    schema = strict_json_schema({"type": "object", "properties": {field: TRADEMARK_FIELD_SCHEMAS[field] for field in fields}})
+    client = get_async_client()
+    response = await achat_completion(client,
+        stage="extraction",
+        model="gpt-4o-mini",
+        messages=code1_fields_messages(document_chunk, fields),
+        temperature=0,
+        max_tokens=500,
+        response_format={"type": "json_schema", "json_schema": {"name": "code1_fields", "strict": True, "schema": schema}},
+    )
+    values = json.loads(response.choices[0].message.content)
+    return {field: str(values.get(field) or "") for field in fields}
+
+
+def extract_code1_details_concurrently(pages: List[Tuple[int, str]]) -> Dict[int, Union[Dict[str, Union[str, List[int]]], None]]:
+    """ Details of each (page number, page text) keyed by page number, with LLM work run through the bounded async engine
+
+    Every request is a work item, so pages extracted by an earlier run of the report come from their checkpoints.
+    Pages whose last fallback failed too are None and on the dead-letter list.
+    """
+    details = {}
+    if CODE1_REGEX_FIRST:
+        partial = []
+        for page_number, page_text in pages:
+            values, missing = confident_fields(parse_code1_fields(page_text))
+            code1_parse_stats.record(missing, current_report.get())
+            if missing:
+                partial.append((page_number, page_text, values, missing))
+            else:
+                details[page_number] = values
+
+        async def fields_item(item: Tuple[int, str, List[str]]) -> Dict[str, str]:
+            page_number, document_chunk, missing = item
+            return await arun_work_item("code1_fields", [document_chunk, missing], lambda: aextract_code1_fields((document_chunk, missing)), label=f"page {page_number}", dead_letter=False)
+
+        results = map_bounded_sync(fields_item, [(page_number, preprocess_text(page_text), missing) for page_number, page_text, values, missing in partial])
+        pages = []
+        for (page_number, page_text, values, missing), result in zip(partial, results):
+            if isinstance(result, Exception):
+                print(f"An error occurred: {result!r}")
+                pages.append((page_number, page_text))
+            else:
+                details[page_number] = {**values, **result}
+
+    pages = [(page_number, preprocess_text(page_text)) for page_number, page_text in pages]
+    if CODE1_EXTRACTION_MODE == "structured":
+        packs = [pages[i:i + CODE1_RECORDS_PER_REQUEST] for i in range(0, len(pages), CODE1_RECORDS_PER_REQUEST)]
+        async def records_item(pack: List[Tuple[int, str]]) -> Dict[int, Dict[str, Union[str, List[int]]]]:
+            records = await arun_work_item("code1_records", pack, lambda: aextract_code1_records(pack), label=f"pages {pack[0][0]}-{pack[-1][0]}", dead_letter=False)
+            # JSON checkpoints turn the page-number keys into strings
+            return {int(page_number): record for page_number, record in records.items()}
+
+        for pack, result in zip(packs, map_bounded_sync(records_item, packs)):
+            if isinstance(result, Exception):
+                print(f"An error occurred: {result!r}")
+            else:
+                details.update(result)
+        # Pages the structured response missed or got wrong fall back to one free-text request each
+        pages = [(page_number, document_chunk) for page_number, document_chunk in pages if page_number not in details]
+
+    async def page_item(page: Tuple[int, str]) -> Dict[str, Union[str, List[int]]]:
+        page_number, document_chunk = page
+        return await arun_work_item("code1_page", document_chunk, lambda: aextract_trademark_details_code1(document_chunk), label=f"page {page_number}")
+
+    results = map_bounded_sync(page_item, pages)
+    for (page_number, document_chunk), result in zip(pages, results):
+        if isinstance(result, Exception):
+            print(f"An error occurred: {result!r}")
+            result = None
+        details[page_number] = result
+    return details
 
     
 def extract_registration_number(document: str) -> str:
@@ -201,31 +411,19 @@ def extract_trademark_details_code2(page_text: str) -> Dict[str, Union[str, List
 
     return details
 
-def read_pdf(file_path: str, exclude_header_footer: bool = True) -> str:
-    document_text = ""
-    with fitz.open(file_path) as pdf_document:
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document.load_page(page_num)
-            if exclude_header_footer:
-                rect = page.rect
-                x0 = rect.x0
-                y0 = rect.y0 + rect.height * 0.1
-                x1 = rect.x1
-                y1 = rect.y1 - rect.height * 0.1
-                page_text = page.get_text("text", clip=(x0, y0, x1, y1))
-            else:
-                page_text = page.get_text()
-            document_text += page_text
-    return document_text
+def read_pdf(file_path: str, exclude_header_footer: bool = True, workers: int = None) -> str:
+    return "".join(extract_page_texts(file_path, exclude_header_footer=exclude_header_footer, workers=workers))
 
 def split_text(text: str, max_tokens: int = 1500) -> List[str]:
+    """ Split text at line boundaries into chunks of at most max_tokens model tokens (a longer single line stays whole) """
     chunks = []
     current_chunk = []
     current_length = 0
 
     for line in text.split('\n'):
-        line_length = len(line.split())
-        if current_length + line_length > max_tokens:
+        # Each line is encoded once; the +1 is the newline joining it to the chunk
+        line_length = count_tokens(line) + 1
+        if current_chunk and current_length + line_length > max_tokens:
             chunks.append('\n'.join(current_chunk))
             current_chunk = [line]
             current_length = line_length
@@ -257,18 +455,15 @@ def parse_international_class_numbers(class_numbers: str) -> List[int]:
 #         "goods_services": "\n".join(goods_services)
 #     }
 
-def extract_international_class_numbers_and_goods_services(document: str, start_page: int, pdf_document: fitz.Document) -> Dict[str, Union[List[int], str]]:
+def extract_international_class_numbers_and_goods_services(document: str, start_page: int, page_store: PageTextStore, report_index: ReportIndex = None) -> Dict[str, Union[List[int], str]]:
     """ Extract the International Class Numbers and Goods/Services from the document over a range of pages """
     class_numbers = []
     goods_services = []
-    combined_text = ""
-
-    for i in range(start_page, min(start_page + 6, pdf_document.page_count)):
-        page = pdf_document.load_page(i)
-        page_text = page.get_text()
-        combined_text += page_text
-        if "Last Reported Owner:" in page_text:
-            break
+    if report_index is not None:
+        end_page = report_index.window_end(start_page, 6, "last_reported_owner")
+        combined_text = page_store.text_range(start_page, end_page - start_page)
+    else:
+        combined_text = page_store.text_range(start_page, 6, stop_marker="Last Reported Owner:")
 
     pattern = r'International Class (\d+): (.*?)(?=\nInternational Class \d+:|\n[A-Z][a-z]+:|\nLast Reported Owner:|Disclaimers:|\Z)'
     matches = re.findall(pattern, combined_text, re.DOTALL)
@@ -285,18 +480,16 @@ def extract_international_class_numbers_and_goods_services(document: str, start_
         "goods_services": "\n".join(goods_services)
     }
 
-def extract_design_phrase(document: str, start_page: int, pdf_document: fitz.Document) -> Dict[str, Union[List[int], str]]:
-    """ Extract the design phrase from the document """
-    combined_texts = ""
-    for i in range(start_page, min(start_page + 8, pdf_document.page_count)):
-        page = pdf_document.load_page(i)
-        page_text = page.get_text()
-        combined_texts += page_text
-        if "Filing Correspondent:" in page_text:
-            break
+def extract_design_phrase(start_page: int, page_store: PageTextStore, report_index: ReportIndex = None) -> str:
+    """ Extract the design phrase of the record starting on start_page from its lookahead pages in the store """
+    if report_index is not None:
+        end_page = report_index.window_end(start_page, 8, "filing_correspondent")
+        combined_texts = page_store.text_range(start_page, end_page - start_page)
+    else:
+        combined_texts = page_store.text_range(start_page, 8, stop_marker="Filing Correspondent:")
         
     pattern = r'Design Phrase:\s*(.*?)(?=Other U\.S\. Registrations:|Filing Correspondent:|Group:|USPTO Page:|$)'
-    match = re.search(pattern, document, re.DOTALL) 
+    match = re.search(pattern, combined_texts, re.DOTALL)
     if match:
         design_phrase = match.group(1).strip()
         # Remove any newline characters within the design phrase
@@ -305,329 +498,395 @@ def extract_design_phrase(document: str, start_page: int, pdf_document: fitz.Doc
     return "No Design phrase presented in document"
 
     
-def parse_trademark_details(document_path: str) -> List[Dict[str, Union[str, List[int]]]]:
-    with fitz.open(document_path) as pdf_document:
-        all_extracted_data = []
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document.load_page(page_num)
-            page_text = page.get_text()
-            
-            if is_correct_format_code1(page_text):
-                preprocessed_chunk = preprocess_text(page_text)
-                extracted_data = extract_trademark_details_code1(preprocessed_chunk)
-                additional_data = extract_international_class_numbers_and_goods_services(page_text, page_num, pdf_document)
-                registration_number = extract_registration_number(page_text)
-                design_phrase = extract_design_phrase(page_text, page_num, pdf_document)
-                
-                if extracted_data:
-                    extracted_data["page_number"] = page_num + 1
-                    extracted_data.update(additional_data)
-                    extracted_data["design_phrase"] = design_phrase
-                    all_extracted_data.append(extracted_data)
-                    extracted_data["registration_number"] = registration_number
-                    
-                trademark_list = []
-                for i, data in enumerate(all_extracted_data, start=1):
-                    try:
-                        trademark_name = data.get("trademark_name", "").split(',')[0].strip()
-                        if "Global Filings" in trademark_name:
-                            trademark_name = trademark_name.split("Global Filings")[0].strip()
-                        owner = data.get("owner", "").split(',')[0].strip()
-                        status = data.get("status", "").split(',')[0].strip()
-                        serial_number = data.get("serial_number", "")
-                        international_class_number = data.get("international_class_numbers", [])
-                        goods_services = data.get("goods_services", "")
-                        page_number = data.get("page_number", "")
-                        registration_number = data.get("registration_number", "No registration number presented in document")
-                        design_phrase = data.get("design_phrase", "No Design phrase presented in document")
-
-                        # If crucial fields are missing, attempt to re-extract the values
-                        if not trademark_name or not owner or not status or not international_class_number:
-                            preprocessed_chunk = preprocess_text(data.get("raw_text", ""))
-                            extracted_data = extract_trademark_details_code1(preprocessed_chunk)
-                            trademark_name = extracted_data.get("trademark_name", trademark_name).split(',')[0].strip()
-                            if "Global Filings" in trademark_name:
-                                trademark_name = trademark_name.split("Global Filings")[0].strip()
-                            owner = extracted_data.get("owner", owner).split(',')[0].strip()
-                            status = extracted_data.get("status", status).split(',')[0].strip()
-                            international_class_number = parse_international_class_numbers(extracted_data.get("international_class_number", "")) or international_class_number
-                            registration_number = extracted_data.get("registration_number", registration_number).split(',')[0].strip()
-
-                        trademark_details = TrademarkDetails(
-                            trademark_name=trademark_name,
-                            owner=owner,
-                            status=status,
-                            serial_number=serial_number,
-                            international_class_number=international_class_number,
-                            goods_services=goods_services,
-                            page_number=page_number,
-                            registration_number=registration_number,
-                            design_phrase=design_phrase
-                        )                        
-                        trademark_info = {
-                            "trademark_name": trademark_details.trademark_name,
-                            "owner": trademark_details.owner,
-                            "status": trademark_details.status,
-                            "serial_number": trademark_details.serial_number,
-                            "international_class_number": trademark_details.international_class_number,
-                            "goods_services": trademark_details.goods_services,
-                            "page_number": trademark_details.page_number,
-                            "registration_number":trademark_details.registration_number,
-                            "design_phrase": trademark_details.design_phrase
-                        }
-                        print(trademark_info)
-                        print("_____________________________________________________________________________________________________________________________")
-                        trademark_list.append(trademark_info)
-                    except ValidationError as e:
-                        print(f"Validation error for trademark {i}: {e}")
-                                    
-            else :
-                if not is_correct_format_code2(page_text):
-                    continue
-
-                extracted_data = extract_trademark_details_code2(page_text)
-                if extracted_data:
-                    extracted_data["page_number"] = page_num + 1
-                    all_extracted_data.append(extracted_data)
-
-                trademark_list = []
-                for i, data in enumerate(all_extracted_data, start=1):
-                    try:
-                        trademark_details = TrademarkDetails(
-                            trademark_name=data.get("trademark_name", ""),
-                            owner=data.get("owner", ""),
-                            status=data.get("status", ""),
-                            serial_number=data.get("serial_number", ""),
-                            international_class_number=data.get("international_class_number", []),
-                            goods_services=data.get("goods_services", ""),
-                            page_number=data.get("page_number", 0),
-                            registration_number=data.get("registration_number", ""),
-                            design_phrase=data.get("design_phrase", "")
-                        )
-                        if (trademark_details.trademark_name != "" and trademark_details.owner != "" and trademark_details.status != "" and trademark_details.goods_services != ""):
-                                trademark_info = {
-                                    "trademark_name": trademark_details.trademark_name,
-                                    "owner": trademark_details.owner,
-                                    "status": trademark_details.status,
-                                    "serial_number": trademark_details.serial_number,
-                                    "international_class_number": trademark_details.international_class_number,
-                                    "goods_services": trademark_details.goods_services,
-                                    "page_number": trademark_details.page_number,
-                                    "registration_number":trademark_details.registration_number,
-                                    "design_phrase":trademark_details.design_phrase,
-                                }
-                                
-                                trademark_list.append(trademark_info)
-                    except ValidationError as e:
-                        print(f"Validation error for trademark {i}: {e}")
-
-        return trademark_list
-
-from azure.core.exceptions import HttpResponseError 
-
-# total_tokens_per_trademark = prompt_tokens_per_trademark + response_tokens_per_trademark  
-# max_batch_size = (max_token_limit - buffer_tokens) // total_tokens_per_trademark  
-# If len(existing_trademarks) is less than max_batch_size, set batch_size to len(existing_trademarks).
-# If len(existing_trademarks) is larger, use max_batch_size
-
-app = Celery('trademark_comparator', broker="redis_host")
-app.conf.result_backend = "redis_host"
+def to_trademark_info(trademark_details: TrademarkDetails) -> Dict[str, Union[str, List[int]]]:
+    return {
+        "trademark_name": trademark_details.trademark_name,
+        "owner": sys.intern(trademark_details.owner),
+        "status": trademark_details.status,
+        "serial_number": trademark_details.serial_number,
+        "international_class_number": trademark_details.international_class_number,
+        # Families of marks repeat the same owner and goods/services text; share one copy across records
+        "goods_services": sys.intern(trademark_details.goods_services),
+        "page_number": trademark_details.page_number,
+        "registration_number": trademark_details.registration_number,
+        "design_phrase": trademark_details.design_phrase
+    }
 
-# Function to be converted to Celery task
-@app.task
-def compare_trademarks(existing_trademarks: List[Dict[str, Union[str, List[int]]]], proposed_name: str, proposed_class: str, proposed_goods_services: str) -> List[Dict[str, int]]:
-    proposed_classes = [int(c.strip()) for c in proposed_class.split(',')]
-    results = []    
-    
-    
-# def compare_trademarks(existing_trademark: List[Dict[str, Union[str, List[int]]]], proposed_name: str, proposed_class: str, proposed_goods_services: str) -> List[Dict[str, int]]:
-#     proposed_classes = [int(c.strip()) for c in proposed_class.split(',')]
-#     results = []  
+def extract_code1_page(page_text: str, page_num: int, page_store: PageTextStore, report_index: ReportIndex = None, extracted_data: Dict[str, Union[str, List[int]]] = None) -> Dict[str, Union[str, List[int]]]:
+    """ Run the code1 extractors for the record starting on page_num, reading its lookahead pages from the store
 
-    # Set the batch size based on token limits  
-    batch_size = 5  # Adjust this number as needed
-    
-    for i in range(0, len(existing_trademarks), batch_size):  
-        batch = existing_trademarks[i:i + batch_size] 
-        messages=[
-                {"role": "system", "content": """You are an experienced Trademark Attorney specializing in trademark law and intellectual property rights. You hold a Juris Doctor (J.D.) degree and have over 10 years of experience in conducting comprehensive trademark searches, analyzing potential conflicts, and advising clients on trademark strategies. Your expertise includes assessing the likelihood of confusion between trademarks, understanding trademark classifications, and providing detailed legal opinions.
-                                                Role: As a Trademark Attorney, your task is to analyze existing trademark and proposed trademark.
-
-                                                Condition 1: Trademark Name Comparison
-                                                - Condition 1A: Are the existing trademark name and the proposed trademark name in conflict with respect to Distinctiveness, Strength of the Marks, and Similarity in Appearance, Sound, and Meaning?
-
-                                                If the existing trademark in the user-provided input satisfies:
-                                                - Special Case: If the existing trademark status is "Cancelled" or "Abandoned," it will automatically be considered a conflict grade of "Low," but you should still provide reasoning for any potential conflicts.
-                                                - If the existing trademark satisfies Condition 1A, then the conflict grade should be "Name-Match."
-                                                - If the existing trademark does not satisfy Condition 1A, then the conflict grade should be "Low."
-
-                                                Format of the Response:
-                                                Reasoning for Conflict: Provide reasoning for the conflict in bullet points. In your reasoning, if the goods, services, and industries are exactly the same, list the overlaps. You should determine whether the goods/services overlap, including classes (whether they are the same as the proposed trademark or not). Consider whether the trademark names are identical (character-for-character matches), phonetic equivalents, if the name is in the primary position (first word in the phrase), or if it is not in the primary position of the existing trademark. If it is not in the primary position, it is not conflicting. Also, consider standard plural forms for subject goods and whether the goods may be related or not. Reasoning should be based on the provided information. Do not provide any hypothetical reasoning.
-                                                Note: Also mention if the existing trademark and the proposed trademark are not in the same Class number in the Reasoning for Conflict.
-                                                
-                                                Step 0: Identifying Potential Conflicts
-                                                - What is the existing trademark?
-                                                - What is the status of the existing trademark? 
-                                                - What is the proposed trademark?
+    extracted_data is the LLM extraction of the page when it was already fetched concurrently.
+    """
+    if extracted_data is None:
+        preprocessed_chunk = preprocess_text(page_text)
+        try:
+            extracted_data = run_work_item("code1_page", preprocessed_chunk, lambda: extract_trademark_details_code1(preprocessed_chunk), label=f"page {page_num + 1}")
+        except WorkItemFailed as e:
+            print(e)
+            return None
+    additional_data = extract_international_class_numbers_and_goods_services(page_text, page_num, page_store, report_index)
+    registration_number = extract_registration_number(page_text)
+    design_phrase = extract_design_phrase(page_num, page_store, report_index)
+
+    if extracted_data:
+        extracted_data["page_number"] = page_num + 1
+        extracted_data.update(additional_data)
+        extracted_data["design_phrase"] = design_phrase
+        extracted_data["registration_number"] = registration_number
+    return extracted_data
+
+def build_code1_trademark(data: Dict[str, Union[str, List[int]]]) -> TrademarkDetails:
+    """ Normalise and validate one code1 record, re-extracting it once if crucial fields are missing """
+    trademark_name = data.get("trademark_name", "").split(',')[0].strip()
+    if "Global Filings" in trademark_name:
+        trademark_name = trademark_name.split("Global Filings")[0].strip()
+    owner = data.get("owner", "").split(',')[0].strip()
+    status = data.get("status", "").split(',')[0].strip()
+    serial_number = data.get("serial_number", "")
+    international_class_number = data.get("international_class_numbers", [])
+    goods_services = data.get("goods_services", "")
+    page_number = data.get("page_number", "")
+    registration_number = data.get("registration_number", "No registration number presented in document")
+    design_phrase = data.get("design_phrase", "No Design phrase presented in document")
+
+    # If crucial fields are missing, attempt to re-extract the values
+    if not trademark_name or not owner or not status or not international_class_number:
+        preprocessed_chunk = preprocess_text(data.get("raw_text", ""))
+        try:
+            extracted_data = run_work_item("code1_page", preprocessed_chunk, lambda: extract_trademark_details_code1(preprocessed_chunk), label=f"page {page_number}")
+        except WorkItemFailed as e:
+            # Keep what the first extraction found; the record is validated as it is
+            print(e)
+            extracted_data = {}
+        trademark_name = extracted_data.get("trademark_name", trademark_name).split(',')[0].strip()
+        if "Global Filings" in trademark_name:
+            trademark_name = trademark_name.split("Global Filings")[0].strip()
+        owner = extracted_data.get("owner", owner).split(',')[0].strip()
+        status = extracted_data.get("status", status).split(',')[0].strip()
+        international_class_number = parse_international_class_numbers(extracted_data.get("international_class_number", "")) or international_class_number
+        registration_number = extracted_data.get("registration_number", registration_number).split(',')[0].strip()
+
+    return TrademarkDetails(
+        trademark_name=trademark_name,
+        owner=owner,
+        status=status,
+        serial_number=serial_number,
+        international_class_number=international_class_number,
+        goods_services=goods_services,
+        page_number=page_number,
+        registration_number=registration_number,
+        design_phrase=design_phrase
+    )
+
+def build_code2_trademark(data: Dict[str, Union[str, List[int]]]) -> Union[TrademarkDetails, None]:
+    """ Validate one code2 record; records missing name, owner, status or goods/services are dropped """
+    trademark_details = TrademarkDetails(
+        trademark_name=data.get("trademark_name", ""),
+        owner=data.get("owner", ""),
+        status=data.get("status", ""),
+        serial_number=data.get("serial_number", ""),
+        international_class_number=data.get("international_class_number", []),
+        goods_services=data.get("goods_services", ""),
+        page_number=data.get("page_number", 0),
+        registration_number=data.get("registration_number", ""),
+        design_phrase=data.get("design_phrase", "")
+    )
+    if (trademark_details.trademark_name != "" and trademark_details.owner != "" and trademark_details.status != "" and trademark_details.goods_services != ""):
+        return trademark_details
+    return None
+
+def iter_trademark_details(pdf_document: fitz.Document, page_store: PageTextStore = None, report_index: ReportIndex = None) -> Iterator[TrademarkDetails]:
+    """ Yield each validated trademark as soon as its page and the lookahead pages it needs have been scanned """
+    if page_store is None:
+        page_store = PageTextStore(pdf_document)
+    if report_index is None:
+        # A bounded store indexes each window as it parses it, from the pages it decodes for the records
+        report_index = ReportIndex(page_store, lazy=page_store.bounded)
+
+    # A bounded store holds one span of record pages plus the lookahead of its last record, so no page is decoded twice
+    span = page_store.max_pages - LOOKAHEAD_PAGES if page_store.bounded else page_store.page_count
+    for span_start in range(0, page_store.page_count, max(1, span)):
+        if page_store.bounded:
+            # Every earlier record has been emitted and lookahead only reads forward, so those pages can go
+            page_store.release_before(span_start)
+        record_starts = report_index.records_between(span_start, span_start + span)
+        for batch_start in range(0, len(record_starts), LLM_EXTRACT_BATCH):
+            yield from _iter_batch_details(record_starts[batch_start:batch_start + LLM_EXTRACT_BATCH], page_store, report_index)
+
+
+def _iter_batch_details(batch: List[int], page_store: PageTextStore, report_index: ReportIndex) -> Iterator[TrademarkDetails]:
+    """ Validated trademarks of a batch of record start pages, in page order """
+    # The LLM extraction of every code1 page in the batch runs concurrently before the records are assembled in order
+    code1_details = extract_code1_details_concurrently([
+        (page_num + 1, page_store.text(page_num)) for page_num in batch if report_index.page_format(page_num) == CODE1
+    ])
+
+    for page_num in batch:
+        page_format = report_index.page_format(page_num)
+        page_text = page_store.text(page_num)
+
+        if page_format == CODE1:
+            if not code1_details[page_num + 1]:
+                continue
+            extracted_data = extract_code1_page(page_text, page_num, page_store, report_index, code1_details[page_num + 1])
+            try:
+                trademark_details = build_code1_trademark(extracted_data)
+            except ValidationError as e:
+                print(f"Validation error for trademark on page {page_num + 1}: {e}")
+                continue
+            print(to_trademark_info(trademark_details))
+            print("_____________________________________________________________________________________________________________________________")
+            yield trademark_details
+
+        elif page_format == CODE2:
+            extracted_data = extract_trademark_details_code2(page_text)
+            if not extracted_data:
+                continue
+            extracted_data["page_number"] = page_num + 1
+            try:
+                trademark_details = build_code2_trademark(extracted_data)
+            except ValidationError as e:
+                print(f"Validation error for trademark on page {page_num + 1}: {e}")
+                continue
+            if trademark_details is not None:
+                yield trademark_details
+
+def parse_trademark_details(pdf_document: fitz.Document, page_store: PageTextStore = None, report_index: ReportIndex = None) -> List[Dict[str, Union[str, List[int]]]]:
+    """ Parse every existing trademark in the report; each record is validated, and re-extracted if needed, exactly once """
+    if page_store is None:
+        page_store = PageTextStore(pdf_document)
+        page_store.preload()
+    return [to_trademark_info(trademark_details) for trademark_details in iter_trademark_details(pdf_document, page_store, report_index)]
+
+_auto_extractor = None
+
+def report_text_extractor(pdf_document: fitz.Document) -> TextExtractor:
+    """ The configured backend, or the fastest one that leaves extract_trademark_details_code2 results unchanged """
+    global _auto_extractor
+    if PDF_TEXT_EXTRACTOR != "auto":
+        return get_extractor(PDF_TEXT_EXTRACTOR)
+    if _auto_extractor is None:
+        # Selected once per process: the benchmark costs more extraction than one report's choice saves
+        _auto_extractor = select_extractor(pdf_document, extract_trademark_details_code2)
+        print(f"Text extraction backend: {_auto_extractor.name}")
+    return _auto_extractor
+
+
+def iter_existing_trademarks(pdf_document: fitz.Document, pdf_bytes: bytes, page_store: PageTextStore, parse_cache: ParseCache) -> Iterator[Dict[str, Union[str, List[int]]]]:
+    """ Yield the existing trademarks of a report, from the parse cache when the same PDF was parsed before """
+    cached_trademarks = parse_cache.get(pdf_bytes)
+    if cached_trademarks is not None:
+        yield from cached_trademarks
+        return
+
+    page_store.preload(pdf_bytes)
+    trademarks = []
+    for trademark_details in iter_trademark_details(pdf_document, page_store):
+        trademark_info = to_trademark_info(trademark_details)
+        trademarks.append(trademark_info)
+        yield trademark_info
+    # Only a fully consumed parse is cached, never a partial one, nor one with dead-lettered pages that a rerun should retry
+    if not any(entry["kind"].startswith("code1") for entry in work_item_store.dead_letters()):
+        parse_cache.set(pdf_bytes, trademarks)
+
+
+# "batched" grades several same-class marks in one request, "single" sends one request per mark
+SAME_CLASS_GRADING_MODE = os.getenv("SAME_CLASS_GRADING_MODE", "batched")
+
+# Token budget of one batched grading request: max_token_limit covers its prompt and response, buffer_tokens is
+# kept free of both, and a mark's grade and reasoning are budgeted at GRADING_RESPONSE_TOKENS
+GRADING_MAX_TOKEN_LIMIT = int(os.getenv("GRADING_MAX_TOKEN_LIMIT", 16000))
+GRADING_BUFFER_TOKENS = int(os.getenv("GRADING_BUFFER_TOKENS", 1000))
+GRADING_RESPONSE_TOKENS = int(os.getenv("GRADING_RESPONSE_TOKENS", 500))
+# More marks per request than this and the grading of the later ones gets sloppy, whatever the budget allows
+GRADING_MAX_BATCH = int(os.getenv("GRADING_MAX_BATCH", 10))
+
+
+class MarkGrade(BaseModel):
+    serial_number: str = Field(description="The serial number of the existing trademark, exactly as listed")
+    conflict_grade: str = Field(description="The conflict grade of the existing trademark, as it would follow 'Conflict Grade:'")
+    reasoning: str = Field(description="Reasoning for Conflict, in bullet points")
+
+
+class MarkGrades(BaseModel):
+    grades: List[MarkGrade] = Field(description="One entry per existing trademark, in the order listed")
+
+
+MARK_GRADES_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "mark_grades", "strict": True, "schema": strict_json_schema(MarkGrades.model_json_schema())},
+}
+
+
+def to_grade(existing_trademark: Dict[str, Union[str, List[int]]], conflict_grade: str, reasoning: str) -> Dict[str, Union[str, List[int]]]:
+    return {
+        'Trademark name': existing_trademark['trademark_name'],
+        'Trademark status': existing_trademark['status'],
+        'Trademark owner': existing_trademark['owner'],
+        'Trademark class Number': existing_trademark['international_class_number'],
+        'Trademark serial number' : existing_trademark['serial_number'],
+        'Trademark registration number' : existing_trademark['registration_number'],
+        'Trademark design phrase' : existing_trademark['design_phrase'],
+        'conflict_grade': conflict_grade,
+        'reasoning': reasoning
+    }
 
-                                                Step 1: Check the Status of the Existing Trademark:
-                                                - If the existing trademark is "Cancelled" or "Expired" or "Abandoned," assign the conflict grade as "Low." And skip other conditions.
 
-                                                Step 2: **Trademark Name Comparison:**
-                                                - Evaluate if there is a conflict between the existing trademark name and the proposed trademark name based on the following:
-                                                    - **Distinctiveness and Strength of the Marks:** Are the trademarks distinctive or similar in strength?
-                                                    - **Similarity in Appearance, Sound, and Meaning:** Do the names look, sound, or mean the same?
+def batch_keys(existing_trademarks: List[Dict[str, Union[str, List[int]]]]) -> List[str]:
+    """ Key of each mark in a batched request: its serial number, or its position when that is missing or repeated """
+    serial_numbers = [str(existing_trademark['serial_number'] or "").strip() for existing_trademark in existing_trademarks]
+    return [serial_number if serial_number and serial_numbers.count(serial_number) == 1 else f"mark {i + 1}" for i, serial_number in enumerate(serial_numbers)]
 
-                                                Step 3: **Consider Special Cases and Additional Factors:**
-                                                - Consider standard plural forms for the subject goods and whether goods may be related or not.
-                                                - If there is no similarity in name, class, or overlapping goods/services, assign the conflict grade "Low."
 
-                                                Format of the Response:
-                                                - **Reasoning for Conflict:** Provide reasoning in bullet points. Base your reasoning only on the provided information. Clearly mention if the existing and proposed trademarks are not in the same Class number.
+def grading_batch_size(existing_trademarks: List[Dict[str, Union[str, List[int]]]], proposed_name: str) -> int:
+    """ Marks per batched grading request, from the token budget:
 
-                                                Note:
-                                                - Do not provide any hypothetical reasoning. The conflict grade should be based solely on the facts given.
-                                                
-                                                Example Analysis Using the Steps : 
-                                                - Trademark Name: Unlock Brisk's Bold Flavors
-                                                - Trademark Status: REGISTERED
-                                                - Proposed Trademark: Unlock Hidden Flavors
+    total_tokens_per_trademark = prompt_tokens_per_trademark + response_tokens_per_trademark
+    max_batch_size = (max_token_limit - buffer_tokens) // total_tokens_per_trademark
+
+    buffer_tokens also holds the shared prefix and the proposed mark, and prompt_tokens_per_trademark is that
+    of the longest entry, so every batch fits. Fewer marks than max_batch_size all go in one request.
+    """
+    template = get_prompt("same_class_grade_batch")
+    fixed_tokens = text_tokens("".join(message["content"] for message in template.messages(existing_trademarks="", proposed_name=proposed_name)))
+    prompt_tokens_per_trademark = max(
+        text_tokens(BATCH_TRADEMARK_ENTRY.format(serial_number=key, existing_name=existing_trademark['trademark_name'], existing_status=existing_trademark['status']))
+        for key, existing_trademark in zip(batch_keys(existing_trademarks), existing_trademarks)
+    )
+    total_tokens_per_trademark = prompt_tokens_per_trademark + GRADING_RESPONSE_TOKENS
+    max_batch_size = max(1, (GRADING_MAX_TOKEN_LIMIT - GRADING_BUFFER_TOKENS - fixed_tokens) // total_tokens_per_trademark)
+    return min(len(existing_trademarks), max_batch_size, GRADING_MAX_BATCH)
 
-                                                Reasoning for Conflict:
-                                                Step 1: Status Check: 
-                                                - The existing trademark status is not "Cancelled" or "Expired" or "Abandoned,". Proceeding to name comparison.
 
-                                                Step 2: Trademark Name Comparison:
-                                                - Both trademarks share the distinctive word "Unlock" in the primary position, which creates a similarity in appearance, sound, and meaning.
-                                                - The phrase "Unlock Flavors" forms the core part of both trademarks, creating a strong conceptual similarity.
-                                                - While the words "Brisk's Bold" and "Hidden" differ, they serve as modifiers to the common term "Flavors." The similarity is substantial because the focus of both trademarks is on the concept of "Unlocking Flavors," which could confuse consumers regarding the source or affiliation of the products/services.
+def grade_same_class_batch(existing_trademarks: List[Dict[str, Union[str, List[int]]]], proposed_name: str, proposed_class: str, proposed_goods_services: str) -> List[Union[Dict[str, Union[str, List[int]]], None]]:
+    """ LLM conflict grades of several same-class trademarks from one request, in the order given
 
-                                                Step 3: No special cases apply (such as status being "Cancelled" or "Abandoned").
-                                                
-                                                Conflict Reason:
-                                                Reasoning for Conflict:
-                                                The shared use of the distinctive phrase "Unlock Flavors" as the primary conceptual focus in both trademarks creates a strong similarity in appearance, sound, and meaning. This overlap is significant enough to potentially confuse consumers about the source or affiliation of the goods or services, thereby assigning the conflict grade as "Name-Match."
-                                                
-                                                - Conflict Grade: Name-Match
-                                                """
-                                                },            
-                {"role": "user", "content": """Compare the following existing and proposed trademarks and determine the conflict grade.\n
-                                                Existing Trademark:\n
-                                                Name: SCOOPT'D\n
-                                                Status: Registered\n
-                                                                                            
-                                                Proposed Trademark:\n
-                                                Name: SCOOP-A-PALOOZA\n """
-                },
-                {"role": "assistant", "content":""" 
-    Reasoning for Conflict:
-    Step 1: Status Check:
-    - The existing trademark status is not "Cancelled," "Expired," or "Abandoned." Proceeding to name comparison.
-
-    Step 2: Trademark Name Comparison:
-    - Both trademarks share the distinctive word "SCOOP," which creates a similarity in appearance, sound, and meaning.
-    - The word "SCOOP" is the dominant and distinctive part of both trademarks, leading to a conceptual similarity.
-    - The existing trademark "SCOOPT'D" and the proposed trademark "SCOOP-A-PALOOZA" both emphasize the idea of "Scoop," likely related to ice cream or a similar product, which could confuse consumers regarding the source or affiliation.
-    - The additional elements ("T'D" and "A-PALOOZA") differ but serve as suffixes or modifiers to the common term "SCOOP."
-
-    Step 3: No special cases apply (such as status being "Cancelled" or "Abandoned").
-
-    Conflict Reason:
-    Reasoning for Conflict:
-    The shared use of the distinctive word "SCOOP" as the core focus in both trademarks creates a strong similarity in appearance, sound, and meaning. This overlap is significant enough to potentially confuse consumers about the source or affiliation of the goods or services, thereby assigning the conflict grade as "Name-Match."
-
-    - Conflict Grade: Name-Match
+    The response is a JSON array keyed by serial number; a mark it leaves out or grades without a grade is None.
+    A response that is not valid JSON raises, like any other error.
     """
-                },
-                {"role": "user", "content": f"""Compare the following existing and proposed trademarks and determine the conflict grade.\n
-                                                Existing Trademark:\n
-                                                Name: {existing_trademark['trademark_name']}\n
-                                                Status: {existing_trademark['status']}\n
-                                                
-                                                Proposed Trademark:\n
-                                                Name: {proposed_name}\n """
-                }
-            ]
-        
-        from openai import AzureOpenAI
-        azure_endpoint =   
-        api_key =   
-            
-        client = AzureOpenAI(  
-            azure_endpoint=azure_endpoint,  
-            api_key=api_key,   
-            api_version="2024-10-01-preview",
-        )
+    keys = batch_keys(existing_trademarks)
+    entries = "\n".join(
+        BATCH_TRADEMARK_ENTRY.format(serial_number=key, existing_name=existing_trademark['trademark_name'], existing_status=existing_trademark['status'])
+        for key, existing_trademark in zip(keys, existing_trademarks)
+    )
+    template = get_prompt("same_class_grade_batch")
+    messages = template.messages(existing_trademarks=entries, proposed_name=proposed_name)
+
+    client = get_client()
+
+    response = chat_completion(client,
+                stage="same_class_grading",
+                prompt=template.key,
+                model="gpt-4o-mini",
+                messages=messages,
+                temperature=0,
+                max_tokens=min(16384, GRADING_RESPONSE_TOKENS * len(existing_trademarks) + GRADING_BUFFER_TOKENS),
+                top_p = 1,
+                response_format=MARK_GRADES_FORMAT,
+                )
+
+    grades = {}
+    for grade in json.loads(response.choices[0].message.content).get("grades", []):
+        try:
+            mark_grade = MarkGrade(**grade)
+        except ValidationError as e:
+            print(f"Validation error for batched grade {grade.get('serial_number')}: {e}")
+            continue
+        if mark_grade.conflict_grade.strip():
+            grades[mark_grade.serial_number.strip()] = mark_grade
+    return [
+        to_grade(existing_trademark, grades[key].conflict_grade.strip(), grades[key].reasoning) if key in grades else None
+        for key, existing_trademark in zip(keys, existing_trademarks)
+    ]
+
+
+def grade_same_class(existing_trademark: Dict[str, Union[str, List[int]]], proposed_name: str, proposed_class: str, proposed_goods_services: str) -> Dict[str, Union[str, List[int]]]:
+    """ LLM conflict grade of one existing trademark that shares a class with the proposed one; errors are raised """
+    proposed_classes = [int(c.strip()) for c in proposed_class.split(',')]
+
+    template = get_prompt("same_class_grade")
+    messages = template.messages(existing_name=existing_trademark['trademark_name'], existing_status=existing_trademark['status'], proposed_name=proposed_name)
+
+    client = get_client()
+    
+    response_reasoning = chat_completion(client,
+                stage="same_class_grading",
+                prompt=template.key,
+                model="gpt-4o-mini",  
+                messages=messages,  
+                temperature=0,  
+                max_tokens=2000,   
+                top_p = 1
+                )
+
+    Treasoning = response_reasoning.choices[0].message.content
+    print(Treasoning)
+    print("_____________________________________________________________________________________________________________________________")
+    if Treasoning is not None:
+        # if ("Reasoning for Conflict:" in Treasoning or "Based on the analysis:" in Treasoning) and "Conflict Grade:" in Treasoning:
+        #     if "Reasoning for Conflict:" in Treasoning:
+        #         reasoning = Treasoning.split("Reasoning for Conflict:", 1)[1].strip()
+        #     else:
+        #         reasoning = Treasoning.split("Based on the analysis:", 1)[1].strip()
+
+        if "Conflict Grade:" in Treasoning:
+            reasoning = Treasoning
+            conflict_grade = Treasoning.split("Conflict Grade:", 1)[1].strip() 
         
-        try: 
-            response_reasoning = client.chat.completions.create(  
-                        model="gpt-4o-mini",  
-                        messages=messages,  
-                        temperature=0,  
-                        max_tokens=2000,   
-                        top_p = 1
-                        )
+            return to_grade(existing_trademark, conflict_grade, reasoning)
+        else:
+            # Runs in a Celery worker, away from the Streamlit page, so the response is only logged
+            print(f"Check Response - Trademark: {existing_trademark['trademark_name']}, \n Output from LLM: {Treasoning}")  
+            return to_grade(existing_trademark, "Not Defined", "Not Defined")
+    else:
+        print(f"Check Response - Trademark: {existing_trademark['trademark_name']}, \n Output from LLM: {Treasoning}")  
+        return to_grade(existing_trademark, "Not Defined", "Not Defined")
 
-            Treasoning = response_reasoning.choices[0].message.content
-            print(Treasoning)
-            print("_____________________________________________________________________________________________________________________________")
-            if Treasoning is not None:
-                # if ("Reasoning for Conflict:" in Treasoning or "Based on the analysis:" in Treasoning) and "Conflict Grade:" in Treasoning:
-                #     if "Reasoning for Conflict:" in Treasoning:
-                #         reasoning = Treasoning.split("Reasoning for Conflict:", 1)[1].strip()
-                #     else:
-                #         reasoning = Treasoning.split("Based on the analysis:", 1)[1].strip()
-
-                if "Conflict Grade:" in Treasoning:
-                    reasoning = Treasoning
-                    conflict_grade = Treasoning.split("Conflict Grade:", 1)[1].strip() 
-                    progress_bar.progress(60)
-                
-                    return {
-                        'Trademark name': existing_trademark['trademark_name'],
-                        'Trademark status': existing_trademark['status'],
-                        'Trademark owner': existing_trademark['owner'],
-                        'Trademark class Number': existing_trademark['international_class_number'],
-                        'Trademark serial number' : existing_trademark['serial_number'],
-                        'Trademark registration number' : existing_trademark['registration_number'],
-                        'Trademark design phrase' : existing_trademark['design_phrase'],
-                        'conflict_grade': conflict_grade,
-                        'reasoning': reasoning
-                    }
-                else:
-                    print("Check Response")  
-                    st.error(f"Trademark: {existing_trademark['trademark_name']}, \n Output from LLM: {Treasoning}")  
-                    return {
-                        'Trademark name': existing_trademark['trademark_name'],
-                        'Trademark status': existing_trademark['status'],
-                        'Trademark owner': existing_trademark['owner'],
-                        'Trademark class Number': existing_trademark['international_class_number'],
-                        'Trademark serial number' : existing_trademark['serial_number'],
-                        'Trademark registration number' : existing_trademark['registration_number'],
-                        'Trademark design phrase' : existing_trademark['design_phrase'],
-                        'conflict_grade': "Not Defined",
-                        'reasoning': "Not Defined"
-                    }
-            else:
-                print("Check Response")  
-                st.info(f"Trademark: {existing_trademark['trademark_name']}, \n Output from LLM: {Treasoning}")  
-                return {
-                    'Trademark name': existing_trademark['trademark_name'],
-                    'Trademark status': existing_trademark['status'],
-                    'Trademark owner': existing_trademark['owner'],
-                    'Trademark class Number': existing_trademark['international_class_number'],
-                    'Trademark serial number' : existing_trademark['serial_number'],
-                    'Trademark registration number' : existing_trademark['registration_number'],
-                    'Trademark design phrase' : existing_trademark['design_phrase'],
-                    'conflict_grade': "Not Defined",
-                    'reasoning': "Not Defined"
-                }
-        except HttpResponseError as e:  
-            print(f"HTTP error occurred: {e.message}")
-            st.warning(f"Trademark: {existing_trademark['trademark_name']}")  
-        except Exception as e:  
-            print(f"An unexpected error occurred: {str(e)}") 
-            st.warning(f"Trademark: {existing_trademark['trademark_name']}")  
+
+# Function to be converted to Celery task
+# Named explicitly: under `streamlit run` this module is __main__, and the name must match the worker's and the routes
+@app.task(name="celery_loaded.compare_trademarks")
+def compare_trademarks(existing_trademarks: List[Dict[str, Union[str, List[int]]]], proposed_name: str, proposed_class: str, proposed_goods_services: str, report_id: str = "") -> List[Dict[str, Union[str, List[int]]]]:
+    """ Grade each existing trademark as a work item, checkpointed once graded
+
+    In batched mode the marks go out grading_batch_size() at a time; marks a batch fails to grade fall back to
+    one request each. Raises WorkItemFailed after every trademark has been tried if any of them kept failing;
+    those are on the dead-letter list of the report and the rest are served from their checkpoints when the task
+    is retried. At the soft time limit the task stops where it is, keeping the checkpoints of the marks graded so far.
+    """
+    args = [proposed_name, proposed_class, proposed_goods_services]
+    batches = [[existing_trademark] for existing_trademark in existing_trademarks]
+    if SAME_CLASS_GRADING_MODE == "batched" and len(existing_trademarks) > 1:
+        batch_size = grading_batch_size(existing_trademarks, proposed_name)
+        batches = [existing_trademarks[i:i + batch_size] for i in range(0, len(existing_trademarks), batch_size)]
+
+    results = []
+    failure = None
+    for batch in batches:
+        grades = [None] * len(batch)
+        if len(batch) > 1:
+            try:
+                with charged_to(report_id):
+                    grades = run_work_item("same_class_grade_batch", [batch, *args], lambda: grade_same_class_batch(batch, *args),
+                                           label=f"{batch[0]['trademark_name']} and {len(batch) - 1} more", report_id=report_id,
+                                           dead_letter=False, abort_on=(SoftTimeLimitExceeded,))
+            except WorkItemFailed as e:
+                print(f"Batched grading failed, grading its marks one by one: {e}")
+        for existing_trademark, grade in zip(batch, grades):
+            if grade is not None:
+                results.append(grade)
+                continue
+            try:
+                with charged_to(report_id):
+                    results.append(run_work_item("same_class_grade", [existing_trademark, *args],
+                                                 lambda: grade_same_class(existing_trademark, *args),
+                                                 label=existing_trademark['trademark_name'], report_id=report_id, abort_on=(SoftTimeLimitExceeded,)))
+            except WorkItemFailed as e:
+                failure = e
+    print(f"Prompt cache: {prompt_cache_stats.stats()}")
+    if failure is not None:
+        raise failure
+    return results
 
 def replace_disallowed_words(text):
     disallowed_words = {
@@ -640,124 +899,17 @@ def replace_disallowed_words(text):
     text = " ".join(text.split())
     return text
 
-app2 = Celery('trademark_comparator', broker="redis_host")
-app2.conf.result_backend = "redis_host"
-
-# Celery Task
-@app2.task
-def compare_trademarks2(existing_trademark: List[Dict[str, Union[str, List[int]]]], proposed_name: str, proposed_class: str, proposed_goods_services: str) -> List[Dict[str, int]]:
+def grade_cross_class(existing_trademark: Dict[str, Union[str, List[int]]], proposed_name: str, proposed_class: str, proposed_goods_services: str) -> Dict[str, Union[str, List[int]]]:
+    """ LLM name-match grade of one existing trademark in none of the proposed classes; errors are raised """
     proposed_classes = [int(c.strip()) for c in proposed_class.split(',')]
-    messages=[
-            {"role": "system", "content": """You are a trademark attorney tasked with determining a conflict grade based on the given conditions. You should assign a conflict grade of "Name-Match" or "Low" to the existing trademark and respond with only "Name-Match", or "Low".
-                                            Conditions for Determining Conflict Grades:
-
-                                            Condition 1: Trademark Name Comparison
-                                            - Condition 1A: Are the existing trademark name and the proposed trademark name in conflict with respect to Distinctiveness, Strength of the Marks, and Similarity in Appearance, Sound, and Meaning?
+    template = get_prompt("cross_class_grade")
+    messages = template.messages(existing_name=existing_trademark['trademark_name'], existing_status=existing_trademark['status'], proposed_name=proposed_name)
 
-                                            If the existing trademark in the user-provided input satisfies:
-                                            - Special Case: If the existing trademark status is "Cancelled" or "Abandoned," it will automatically be considered a conflict grade of "Low," but you should still provide reasoning for any potential conflicts.
-                                            - If the existing trademark satisfies Condition 1A, then the conflict grade should be "Name-Match."
-                                            - If the existing trademark does not satisfy Condition 1A, then the conflict grade should be "Low."
-
-                                            Format of the Response:
-                                            Reasoning for Conflict: Provide reasoning for the conflict in bullet points. In your reasoning, if the goods, services, and industries are exactly the same, list the overlaps. You should determine whether the goods/services overlap, including classes (whether they are the same as the proposed trademark or not). Consider whether the trademark names are identical (character-for-character matches), phonetic equivalents, if the name is in the primary position (first word in the phrase), or if it is not in the primary position of the existing trademark. If it is not in the primary position, it is not conflicting. Also, consider standard plural forms for subject goods and whether the goods may be related or not. Reasoning should be based on the provided information. Do not provide any hypothetical reasoning.
-                                            Note: Also mention if the existing trademark and the proposed trademark are not in the same Class number in the Reasoning for Conflict.
-                                            
-                                            Step 0: Identifying Potential Conflicts
-                                            - What is the existing trademark?
-                                            - What is the status of the existing trademark? 
-                                            - What is the proposed trademark?
-
-                                            Step 1: Check the Status of the Existing Trademark:
-                                            - If the existing trademark is "Cancelled" or "Expired" or "Abandoned," assign the conflict grade as "Low." And skip other conditions.
-
-                                            Step 2: **Trademark Name Comparison:**
-                                            - Evaluate if there is a conflict between the existing trademark name and the proposed trademark name based on the following:
-                                                - **Distinctiveness and Strength of the Marks:** Are the trademarks distinctive or similar in strength?
-                                                - **Similarity in Appearance, Sound, and Meaning:** Do the names look, sound, or mean the same?
-
-                                            Step 3: **Consider Special Cases and Additional Factors:**
-                                            - Consider standard plural forms for the subject goods and whether goods may be related or not.
-                                            - If there is no similarity in name, class, or overlapping goods/services, assign the conflict grade "Low."
-
-                                            Format of the Response:
-                                            - **Reasoning for Conflict:** Provide reasoning in bullet points. Base your reasoning only on the provided information. Clearly mention if the existing and proposed trademarks are not in the same Class number.
-
-                                            Note:
-                                            - Do not provide any hypothetical reasoning. The conflict grade should be based solely on the facts given.
-                                            
-                                            Example Analysis Using the Steps : 
-                                            - Trademark Name: Unlock Brisk's Bold Flavors
-                                            - Trademark Status: REGISTERED
-                                            - Proposed Trademark: Unlock Hidden Flavors
-
-                                            Reasoning for Conflict:
-                                            Step 1: Status Check: 
-                                            - The existing trademark status is not "Cancelled" or "Expired" or "Abandoned,". Proceeding to name comparison.
-
-                                            Step 2: Trademark Name Comparison:
-                                            - Both trademarks share the distinctive word "Unlock" in the primary position, which creates a similarity in appearance, sound, and meaning.
-                                            - The phrase "Unlock Flavors" forms the core part of both trademarks, creating a strong conceptual similarity.
-                                            - While the words "Brisk's Bold" and "Hidden" differ, they serve as modifiers to the common term "Flavors." The similarity is substantial because the focus of both trademarks is on the concept of "Unlocking Flavors," which could confuse consumers regarding the source or affiliation of the products/services.
-
-                                            Step 3: No special cases apply (such as status being "Cancelled" or "Abandoned").
-                                            
-                                            Conflict Reason:
-                                            Reasoning for Conflict:
-                                            The shared use of the distinctive phrase "Unlock Flavors" as the primary conceptual focus in both trademarks creates a strong similarity in appearance, sound, and meaning. This overlap is significant enough to potentially confuse consumers about the source or affiliation of the goods or services, thereby assigning the conflict grade as "Name-Match."
-                                            
-                                            - Conflict Grade: Name-Match
-                                            """
-                                            },            
-            {"role": "user", "content": """Compare the following existing and proposed trademarks and determine the conflict grade.\n
-                                            Existing Trademark:\n
-                                            Name: SCOOPT'D\n
-                                            Status: Registered\n
-                                                                                        
-                                            Proposed Trademark:\n
-                                            Name: SCOOP-A-PALOOZA\n """
-            },
-            {"role": "assistant", "content":""" 
-Reasoning for Conflict:
-Step 1: Status Check:
-- The existing trademark status is not "Cancelled," "Expired," or "Abandoned." Proceeding to name comparison.
-
-Step 2: Trademark Name Comparison:
-- Both trademarks share the distinctive word "SCOOP," which creates a similarity in appearance, sound, and meaning.
-- The word "SCOOP" is the dominant and distinctive part of both trademarks, leading to a conceptual similarity.
-- The existing trademark "SCOOPT'D" and the proposed trademark "SCOOP-A-PALOOZA" both emphasize the idea of "Scoop," likely related to ice cream or a similar product, which could confuse consumers regarding the source or affiliation.
-- The additional elements ("T'D" and "A-PALOOZA") differ but serve as suffixes or modifiers to the common term "SCOOP."
-
-Step 3: No special cases apply (such as status being "Cancelled" or "Abandoned").
-
-Conflict Reason:
-Reasoning for Conflict:
-The shared use of the distinctive word "SCOOP" as the core focus in both trademarks creates a strong similarity in appearance, sound, and meaning. This overlap is significant enough to potentially confuse consumers about the source or affiliation of the goods or services, thereby assigning the conflict grade as "Name-Match."
-
-- Conflict Grade: Name-Match
-"""
-            },
-            {"role": "user", "content": f"""Compare the following existing and proposed trademarks and determine the conflict grade.\n
-                                            Existing Trademark:\n
-                                            Name: {existing_trademark['trademark_name']}\n
-                                            Status: {existing_trademark['status']}\n
-                                            
-                                            Proposed Trademark:\n
-                                            Name: {proposed_name}\n """
-            }
-        ]
-
-    from openai import AzureOpenAI
-    azure_endpoint =   
-    api_key =   
-        
-    client = AzureOpenAI(  
-        azure_endpoint=azure_endpoint,  
-        api_key=api_key,   
-        api_version="2024-10-01-preview",
-    )
+    client = get_client()
                 
-    response_reasoning = client.chat.completions.create(  
+    response_reasoning = chat_completion(client,
+                        stage="cross_class_grading",
+                        prompt=template.key,
                         model="gpt-4o-mini",  
                         messages=messages,  
                         temperature=0,  
@@ -770,28 +922,156 @@ The shared use of the distinctive word "SCOOP" as the core focus in both tradema
     print("_____________________________________________________________________________________________________________________________")
     reasoning = Treasoning.split("Reasoning for Conflict:", 1)[1].strip()
     conflict_grade = Treasoning.split("Conflict Grade:", 1)[1].strip() 
-    progress_bar.progress(70)
     
-    return {
-        'Trademark name': existing_trademark['trademark_name'],
-        'Trademark status': existing_trademark['status'],
-        'Trademark owner': existing_trademark['owner'],
-        'Trademark class Number': existing_trademark['international_class_number'],
-        'Trademark serial number' : existing_trademark['serial_number'],
-        'Trademark registration number' : existing_trademark['registration_number'],
-        'Trademark design phrase' : existing_trademark['design_phrase'],
-        'conflict_grade': conflict_grade,
-        'reasoning': reasoning
-    }
+    return to_grade(existing_trademark, conflict_grade, reasoning)
     
 
-def extract_proposed_trademark_details(file_path: str) -> Dict[str, Union[str, List[int]]]:
+# Celery Task
+@app.task(name="celery_loaded.compare_trademarks2")
+def compare_trademarks2(existing_trademark: Dict[str, Union[str, List[int]]], proposed_name: str, proposed_class: str, proposed_goods_services: str, report_id: str = "") -> Dict[str, Union[str, List[int]]]:
+    """ grade_cross_class as a work item; raises WorkItemFailed once the trademark is on the dead-letter list """
+    with charged_to(report_id):
+        return run_work_item("cross_class_grade", [existing_trademark, proposed_name, proposed_class, proposed_goods_services],
+                             lambda: grade_cross_class(existing_trademark, proposed_name, proposed_class, proposed_goods_services),
+                             label=existing_trademark['trademark_name'], report_id=report_id, abort_on=(SoftTimeLimitExceeded,))
+
+
+# Existing marks per same-class grading task, and grading tasks sent to the workers together as one group;
+# a batched task splits its marks into grading requests by token budget
+COMPARE_MARKS_PER_TASK = int(os.getenv("COMPARE_MARKS_PER_TASK", GRADING_MAX_BATCH if SAME_CLASS_GRADING_MODE == "batched" else 1))
+COMPARE_GROUP_SIZE = int(os.getenv("COMPARE_GROUP_SIZE", 16))
+COMPARE_POLL_SECONDS = float(os.getenv("COMPARE_POLL_SECONDS", 0.25))
+
+
+class ComparisonFanOut:
+    """ Sends grading tasks to the Celery workers in groups while existing marks are still being parsed, and hands
+    back each task's grades as soon as it finishes, without waiting on the others
+
+    Same-class marks go to compare_trademarks, COMPARE_MARKS_PER_TASK per task, unless their goods/services score
+    is below GOODS_SIMILARITY_PRUNE and they are graded Low on the spot. The rest are name-screened a group at a
+    time: clearly different names are graded Low on the spot, and the others go to compare_trademarks2.
+    Outcomes are (sequence, kind, grades): sequence is the order the task was queued in, kind is "same_class" or
+    "cross_class", and grades is the list of grade dicts of the task, or its exception when it failed.
+    """
+
+    def __init__(self, proposed_name: str, proposed_class: str, proposed_goods_services: str, report_id: str):
+        self.args = (proposed_name, proposed_class, proposed_goods_services)
+        self.report_id = report_id
+        self._same_class_marks = []
+        self._cross_class_marks = []
+        self._pending = {"same_class": [], "cross_class": []}
+        self._in_flight = []
+        self._screened = []
+        self._sequence = 0
+        self.dispatched = 0
+        self.completed = 0
+        self.collected = 0
+        self.cross_class_marks = 0
+        self.screened = 0
+        self.pruned = 0
+
+    def add(self, trademark_info: Dict[str, Union[str, List[int]]], same_class: bool):
+        if not same_class:
+            self._cross_class_marks.append((self._next_sequence(), trademark_info))
+            if len(self._cross_class_marks) >= COMPARE_GROUP_SIZE:
+                self._screen()
+            return
+        similarity = trademark_info.get("goods_services_similarity")
+        if similarity is not None and similarity < GOODS_SIMILARITY_PRUNE:
+            self._screened.append((self._next_sequence(), "same_class", [to_grade(trademark_info, "Low", pruned_reasoning(similarity))]))
+            self.pruned += 1
+            return
+        self._same_class_marks.append(trademark_info)
+        if len(self._same_class_marks) >= COMPARE_MARKS_PER_TASK:
+            self._queue("same_class", compare_trademarks.s(self._same_class_marks, *self.args, report_id=self.report_id), self._next_sequence())
+            self._same_class_marks = []
+
+    def _next_sequence(self) -> int:
+        self._sequence += 1
+        return self._sequence - 1
+
+    def _screen(self):
+        """ Score the buffered cross-class names against the proposed one in one pass; only unclear pairs reach the LLM """
+        marks = self._cross_class_marks
+        self._cross_class_marks = []
+        scores = screen_names(self.args[0], [trademark_info['trademark_name'] for sequence, trademark_info in marks])
+        for (sequence, trademark_info), score in zip(marks, scores):
+            if score["clear"]:
+                self._screened.append((sequence, "cross_class", [to_grade(trademark_info, "Low", screened_reasoning(score))]))
+            else:
+                self._queue("cross_class", compare_trademarks2.s(trademark_info, *self.args, report_id=self.report_id), sequence)
+        screened = sum(score["clear"] for score in scores)
+        self.cross_class_marks += len(marks)
+        self.screened += screened
+        name_screen_stats.record(len(marks), screened, self.report_id)
+
+    def _queue(self, kind: str, signature, sequence: int):
+        self._pending[kind].append((sequence, signature))
+        if len(self._pending[kind]) >= COMPARE_GROUP_SIZE:
+            self._send(kind)
+
+    def _send(self, kind: str):
+        pending = self._pending[kind]
+        if not pending:
+            return
+        group_result = group(signature for sequence, signature in pending).apply_async()
+        self._in_flight.extend((sequence, kind, result) for (sequence, signature), result in zip(pending, group_result.results))
+        self.dispatched += len(pending)
+        self._pending[kind] = []
+
+    def flush(self):
+        """ Send everything still queued, including a partly filled same-class task and the cross-class marks left to screen """
+        if self._same_class_marks:
+            self._queue("same_class", compare_trademarks.s(self._same_class_marks, *self.args, report_id=self.report_id), self._next_sequence())
+            self._same_class_marks = []
+        if self._cross_class_marks:
+            self._screen()
+        for kind in self._pending:
+            self._send(kind)
+
+    def poll(self) -> List[Tuple[int, str, Union[List[Dict[str, Union[str, List[int]]]], Exception]]]:
+        """ Outcomes of the tasks that finished since the last poll, and of the marks screened since; never blocks """
+        if not self._in_flight:
+            # The workers are idle, so a partly filled group is better sent now than when it fills up
+            self.flush()
+        outcomes = []
+        in_flight = []
+        for sequence, kind, result in self._in_flight:
+            if not result.ready():
+                in_flight.append((sequence, kind, result))
+                continue
+            grades = result.get(propagate=False)
+            if kind == "cross_class" and not isinstance(grades, Exception):
+                grades = [grades]
+            outcomes.append((sequence, kind, grades))
+        self._in_flight = in_flight
+        self.completed += len(outcomes)
+        outcomes.extend(self._screened)
+        self._screened = []
+        self.collected += len(outcomes)
+        return outcomes
+
+    @property
+    def queued(self) -> int:
+        """ Outcomes to expect for the marks added so far: one per task, and one per mark graded on the spot """
+        return self._sequence
+
+    def drain(self, poll_seconds: float = COMPARE_POLL_SECONDS) -> Iterator[Tuple[int, str, Union[List[Dict[str, Union[str, List[int]]]], Exception]]]:
+        """ Send what is left and yield every remaining outcome as its task finishes """
+        self.flush()
+        while self._in_flight or self._screened:
+            outcomes = self.poll()
+            yield from outcomes
+            if not outcomes:
+                time.sleep(poll_seconds)
+
+
+def extract_proposed_trademark_details(pdf_document: fitz.Document, page_store: PageTextStore = None) -> Dict[str, Union[str, List[int]]]:
     """ Extract proposed trademark details from the given input format """
     proposed_details = {}
-    with fitz.open(file_path) as pdf_document:
-        if pdf_document.page_count > 0:
-            page = pdf_document.load_page(0)
-            page_text = preprocess_text(page.get_text())
+    page_store = page_store or PageTextStore(pdf_document)
+    if page_store.page_count > 0:
+        page_text = preprocess_text(page_store.text(0))
             
     name_match = re.search(r'Mark Searched:\s*(.*?)(?=\s*Client Name:)', page_text, re.IGNORECASE | re.DOTALL)
     if name_match:
@@ -804,7 +1084,8 @@ def extract_proposed_trademark_details(file_path: str) -> Dict[str, Union[str, L
     # Use LLM to find the international class number based on goods & services
     if "proposed_goods_services" in proposed_details:
         goods_services = proposed_details["proposed_goods_services"]
-        class_numbers = find_class_numbers(goods_services)
+        # Raises WorkItemFailed when every attempt fails; there is no report without the proposed classes
+        class_numbers = run_work_item("class_inference", goods_services, lambda: find_class_numbers(goods_services), label="proposed goods & services")
         proposed_details["proposed_nice_classes_number"] = class_numbers
     
     return proposed_details
@@ -813,15 +1094,7 @@ def find_class_numbers(goods_services: str) -> List[int]:
     """ Use LLM to find the international class numbers based on goods & services """
         # Initialize AzureChatOpenAI
     
-    from openai import AzureOpenAI
-    azure_endpoint =   
-    api_key =   
-          
-    client = AzureOpenAI(  
-        azure_endpoint=azure_endpoint,  
-        api_key=api_key,   
-        api_version="2024-10-01-preview",
-    )
+    client = get_client()
 
     # messages = [  
     # {  
@@ -874,7 +1147,8 @@ def find_class_numbers(goods_services: str) -> List[int]:
                 }  
             ]  
     
-    response = client.chat.completions.create(  
+    response = chat_completion(client,
+                        stage="class_inference",
                         model="gpt-4o-mini",  
                         messages=messages,  
                         temperature=0,  
@@ -889,39 +1163,30 @@ def find_class_numbers(goods_services: str) -> List[int]:
     
     return class_numbers
 
-def extract_proposed_trademark_details2(file_path: str) -> Dict[str, Union[str, List[int]]]:
+def extract_proposed_trademark_details2(pdf_document: fitz.Document, page_store: PageTextStore = None) -> Dict[str, Union[str, List[int]]]:
     """ Extract proposed trademark details from the first page of the document """
     proposed_details = {}
-    with fitz.open(file_path) as pdf_document:
-        if pdf_document.page_count > 0:
-            page = pdf_document.load_page(0)
-            page_text = preprocess_text(page.get_text())
-            
-            name_match = re.search(r'Name:\s*(.*?)(?=\s*Nice Classes:)', page_text)
-            if name_match:
-                proposed_details["proposed_trademark_name"] = name_match.group(1).strip()
-                
-            nice_classes_match = re.search(r'Nice Classes:\s*(\d+(?:,\s*\d+)*)', page_text)
-            if nice_classes_match:
-                proposed_details["proposed_nice_classes_number"] = nice_classes_match.group(1).strip()
+    page_store = page_store or PageTextStore(pdf_document)
+    if page_store.page_count > 0:
+        page_text = preprocess_text(page_store.text(0))
+        
+        name_match = re.search(r'Name:\s*(.*?)(?=\s*Nice Classes:)', page_text)
+        if name_match:
+            proposed_details["proposed_trademark_name"] = name_match.group(1).strip()
             
-            goods_services_match = re.search(r'Goods & Services:\s*(.*?)(?=\s*Registers|$)', page_text, re.IGNORECASE | re.DOTALL)
-            if goods_services_match:
-                proposed_details["proposed_goods_services"] = goods_services_match.group(1).strip()
+        nice_classes_match = re.search(r'Nice Classes:\s*(\d+(?:,\s*\d+)*)', page_text)
+        if nice_classes_match:
+            proposed_details["proposed_nice_classes_number"] = nice_classes_match.group(1).strip()
+        
+        goods_services_match = re.search(r'Goods & Services:\s*(.*?)(?=\s*Registers|$)', page_text, re.IGNORECASE | re.DOTALL)
+        if goods_services_match:
+            proposed_details["proposed_goods_services"] = goods_services_match.group(1).strip()
     
     return proposed_details
 
 def list_conversion(proposed_class: str) -> List[int]:
     
-    from openai import AzureOpenAI
-    azure_endpoint =   
-    api_key =   
-        
-    client = AzureOpenAI(  
-        azure_endpoint=azure_endpoint,  
-        api_key=api_key,   
-        api_version="2024-10-01-preview",
-    )
+    client = get_client()
 
     messages = [  
                 {  
@@ -946,7 +1211,10 @@ def list_conversion(proposed_class: str) -> List[int]:
                 }  
             ]  
     
-    response = client.chat.completions.create(  
+    # Sampled at temperature 0.2, so the answer is not a deterministic function of the prompt
+    response = chat_completion(client,
+                        stage="class_inference",
+                        cache=False,
                         model="gpt-4o-mini",  
                         messages=messages,  
                         temperature=0.2,  
@@ -958,8 +1226,33 @@ def list_conversion(proposed_class: str) -> List[int]:
             
     return class_value
 
+def infer_class_list(proposed_class: str) -> Union[List[int], None]:
+    """ list_conversion as a work item, so a rerun of the report reuses the converted list; None once it is dead-lettered """
+    try:
+        return run_work_item("class_list", proposed_class, lambda: list_conversion(proposed_class), label="proposed classes")
+    except WorkItemFailed as e:
+        print(e)
+        return None
+
+def add_usage_appendix(document: Document, usage: Dict[str, Dict[str, float]]):
+    """ Appendix table of the LLM tokens, time and cost each stage of the report spent """
+    document.add_heading('Appendix: LLM Usage by Stage', level=2)
+    columns = ["Stage", "Calls", "Cached responses", "Prompt tokens", "Cached prompt tokens", "Completion tokens", "LLM seconds", "Cost (USD)"]
+    table = document.add_table(len(usage) + 1, len(columns))
+    table.style = 'TableGrid'
+    for i, column_name in enumerate(columns):
+        table.cell(0, i).text = column_name
+    for i, (stage, totals) in enumerate(usage.items()):
+        values = [stage, totals["calls"], totals["cached_responses"], totals["prompt_tokens"], totals["cached_tokens"], totals["completion_tokens"]]
+        for j, value in enumerate(values):
+            table.cell(i + 1, j).text = str(value) if j == 0 else f"{value:,.0f}"
+        table.cell(i + 1, 6).text = f"{totals['seconds']:.1f}"
+        table.cell(i + 1, 7).text = f"{totals['cost']:.4f}"
+
 # Streamlit App  
 st.title("Trademark Document Parser Version 6.2")  
+
+parse_cache = ParseCache()
   
 # File upload  
 uploaded_files = st.sidebar.file_uploader("Choose PDF files", type="pdf", accept_multiple_files=True)  
@@ -971,15 +1264,25 @@ if uploaded_files:
         # progress_label.text(f"Progress: 0%")  --- Needed to set
 
         for i, uploaded_file in enumerate(uploaded_files):  
-            # Save uploaded file to a temporary file path  
-            temp_file_path = f"temp_{uploaded_file.name}"  
-            with open(temp_file_path, "wb") as f:  
-                f.write(uploaded_file.read())  
+            # Open the upload in memory once; every stage shares this document handle  
+            pdf_bytes = uploaded_file.read()  
+            pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")  
+            page_store = PageTextStore(pdf_document, extractor=report_text_extractor(pdf_document))  
+            # Work items completed by an earlier run of this report are reused; only the failed ones run again
+            report_id = report_id_for(pdf_bytes)
+            work_item_store.begin_report(report_id)
+            usage_ledger.begin_report(report_id)
+            code1_parse_stats.begin_report(report_id)
+            name_screen_stats.begin_report(report_id)
                 
             start_time = time.time()
             
             sp = True
-            proposed_trademark_details = extract_proposed_trademark_details(temp_file_path)  
+            try:
+                proposed_trademark_details = extract_proposed_trademark_details(pdf_document, page_store)  
+            except WorkItemFailed as e:
+                st.error(f"Unable to classify the proposed goods & services for {uploaded_file.name}: {e}")
+                continue
                             
             if proposed_trademark_details:  
                 proposed_name = proposed_trademark_details.get('proposed_trademark_name', 'N')  
@@ -990,7 +1293,10 @@ if uploaded_files:
                             st.write(f"Proposed Trademark name: {proposed_name}")  
                             st.write(f"Proposed class-number: {proposed_class}")  
                             st.write(f"Proposed Goods & Services: {proposed_goods_services}") 
-                    class_list = list_conversion(proposed_class) 
+                    class_list = infer_class_list(proposed_class) 
+                    if class_list is None:
+                        st.error(f"Unable to convert the proposed classes of {uploaded_file.name}: {proposed_class}")
+                        sp = False
                 else :
                     st.write("______________________________________________________________________________________________________________________________")
                     st.write(f"Sorry, unable to generate report due to insufficient information about goods & services in the original trademark report : {uploaded_file.name}")
@@ -998,7 +1304,7 @@ if uploaded_files:
                     sp = False
             else:  
                 
-                proposed_trademark_details = extract_proposed_trademark_details2(temp_file_path)  
+                proposed_trademark_details = extract_proposed_trademark_details2(pdf_document, page_store)  
                 
                 if proposed_trademark_details:  
                     proposed_name = proposed_trademark_details.get('proposed_trademark_name', 'N')  
@@ -1009,7 +1315,10 @@ if uploaded_files:
                                 st.write(f"Proposed Trademark name: {proposed_name}")  
                                 st.write(f"Proposed class-number: {proposed_class}")  
                                 st.write(f"Proposed Goods & Services: {proposed_goods_services}") 
-                        class_list = list_conversion(proposed_class)  
+                        class_list = infer_class_list(proposed_class)  
+                        if class_list is None:
+                            st.error(f"Unable to convert the proposed classes of {uploaded_file.name}: {proposed_class}")
+                            sp = False
                     else :
                         st.write("______________________________________________________________________________________________________________________________")
                         st.write(f"Sorry, unable to generate report due to insufficient information about goods & services in the original trademark report : {uploaded_file.name}")
@@ -1029,521 +1338,261 @@ if uploaded_files:
                 
                 # s_time = time.time()
                 
-                existing_trademarks = parse_trademark_details(temp_file_path)
-                with fitz.open(temp_file_path) as pdf_document:
-                    all_extracted_data = []
-                    for page_num in range(pdf_document.page_count):
-                        page = pdf_document.load_page(page_num)
-                        page_text = page.get_text()
-                        
-                        if is_correct_format_code1(page_text):
-                            preprocessed_chunk = preprocess_text(page_text)
-                            extracted_data = extract_trademark_details_code1(preprocessed_chunk)
-                            additional_data = extract_international_class_numbers_and_goods_services(page_text, page_num, pdf_document)
-                            registration_number = extract_registration_number(page_text)
-                            design_phrase = extract_design_phrase(page_text, page_num, pdf_document)
-                            
-                            if extracted_data:
-                                extracted_data["page_number"] = page_num + 1
-                                extracted_data.update(additional_data)
-                                extracted_data["design_phrase"] = design_phrase
-                                all_extracted_data.append(extracted_data)
-                                extracted_data["registration_number"] = registration_number
-                                
-                            trademark_list = []
-                            for i, data in enumerate(all_extracted_data, start=1):
-                                try:
-                                    trademark_name = data.get("trademark_name", "").split(',')[0].strip()
-                                    if "Global Filings" in trademark_name:
-                                        trademark_name = trademark_name.split("Global Filings")[0].strip()
-                                    owner = data.get("owner", "").split(',')[0].strip()
-                                    status = data.get("status", "").split(',')[0].strip()
-                                    serial_number = data.get("serial_number", "")
-                                    international_class_number = data.get("international_class_numbers", [])
-                                    goods_services = data.get("goods_services", "")
-                                    page_number = data.get("page_number", "")
-                                    registration_number = data.get("registration_number", "No registration number presented in document")
-                                    design_phrase = data.get("design_phrase", "No Design phrase presented in document")
-
-                                    # If crucial fields are missing, attempt to re-extract the values
-                                    if not trademark_name or not owner or not status or not international_class_number:
-                                        preprocessed_chunk = preprocess_text(data.get("raw_text", ""))
-                                        extracted_data = extract_trademark_details_code1(preprocessed_chunk)
-                                        trademark_name = extracted_data.get("trademark_name", trademark_name).split(',')[0].strip()
-                                        if "Global Filings" in trademark_name:
-                                            trademark_name = trademark_name.split("Global Filings")[0].strip()
-                                        owner = extracted_data.get("owner", owner).split(',')[0].strip()
-                                        status = extracted_data.get("status", status).split(',')[0].strip()
-                                        international_class_number = parse_international_class_numbers(extracted_data.get("international_class_number", "")) or international_class_number
-                                        registration_number = extracted_data.get("registration_number", registration_number).split(',')[0].strip()
-
-                                    trademark_details = TrademarkDetails(
-                                        trademark_name=trademark_name,
-                                        owner=owner,
-                                        status=status,
-                                        serial_number=serial_number,
-                                        international_class_number=international_class_number,
-                                        goods_services=goods_services,
-                                        page_number=page_number,
-                                        registration_number=registration_number,
-                                        design_phrase=design_phrase
-                                    )                        
-                                    trademark_info = {
-                                        "trademark_name": trademark_details.trademark_name,
-                                        "owner": trademark_details.owner,
-                                        "status": trademark_details.status,
-                                        "serial_number": trademark_details.serial_number,
-                                        "international_class_number": trademark_details.international_class_number,
-                                        "goods_services": trademark_details.goods_services,
-                                        "page_number": trademark_details.page_number,
-                                        "registration_number":trademark_details.registration_number,
-                                        "design_phrase": trademark_details.design_phrase
-                                    }
-                                    print(trademark_info)
-                                    print("_____________________________________________________________________________________________________________________________")
-                                    trademark_list.append(trademark_info)
-                                    nfiltered_list = []
-                                    unsame_class_list = []
-                                    json_element = trademark_info
-                                    class_numbers = json_element["international_class_number"]  
-                                # Check if any of the class numbers are in class_list  
-                                    if any(number in class_list for number in class_numbers):  
-                                        nfiltered_list.append(json_element)
-                                    else:
-                                        unsame_class_list.append(json_element)
-                                    existing_trademarks = nfiltered_list  
-                                    existing_trademarks_unsame =  unsame_class_list
-                                        
-                                    high_conflicts = []
-                                    moderate_conflicts = []
-                                    low_conflicts = []
-                                    Name_Matchs = []
-                                    
-                                    lt = len(existing_trademarks)
-                                    
-                                    for existing_trademark in existing_trademarks:  
-                                        conflict = compare_trademarks.delay(existing_trademarks, proposed_name, proposed_class, proposed_goods_services)  
-                                        if conflict is not None:
-                                            if conflict['conflict_grade'] == "High":  
-                                                high_conflicts.append(conflict)  
-                                            elif conflict['conflict_grade'] == "Moderate":  
-                                                moderate_conflicts.append(conflict)  
-                                            else:  
-                                                low_conflicts.append(conflict)  
-                                            
-                                    for existing_trademarks in existing_trademarks_unsame:
-                                        conflict = compare_trademarks2.delay(existing_trademarks, proposed_name, proposed_class, proposed_goods_services)  
-                                        
-
-                                        if conflict['conflict_grade'] == "Name-Match":  
-                                            Name_Matchs.append(conflict)  
-                                        else:  
-                                            print("Low")
-                                            # low_conflicts.append(conflict) 
-                                            
-                                    st.sidebar.write("_________________________________________________")
-                                    st.sidebar.subheader("\n\nConflict Grades : \n")  
-                                    st.sidebar.markdown(f"File: {proposed_name}")  
-                                    st.sidebar.markdown(f"Total number of conflicts: {len(high_conflicts) + len(moderate_conflicts) + len(Name_Matchs) + len(low_conflicts)}")
-                                    st.sidebar.markdown(f"High Conflicts: {len(high_conflicts)}")  
-                                    st.sidebar.markdown(f"Moderate Conflicts: {len(moderate_conflicts)}")  
-                                    st.sidebar.markdown(f"Name Match's Conflicts: {len(Name_Matchs)}")  
-                                    st.sidebar.markdown(f"Low Conflicts: {len(low_conflicts)}")  
-                                    st.sidebar.write("_________________________________________________")
+                with pdf_document:
+                    high_conflicts = []
+                    moderate_conflicts = []
+                    low_conflicts = []
+                    Name_Matchs = []
+
+                    fanout = ComparisonFanOut(proposed_name, proposed_class, proposed_goods_services, report_id)
+                    grading_status = st.empty()
+                    grading_progress = 25
+
+                    def collect(outcomes):
+                        """ File the grades of finished tasks, tagged with their task order so the report keeps mark order
+
+                        Grading runs in the Celery workers, so the page's progress is reported from here, as outcomes arrive.
+                        """
+                        global grading_progress
+                        for sequence, kind, grades in outcomes:
+                            if isinstance(grades, Exception):
+                                # The worker dead-lettered the marks it could not grade; they are listed with the failed items
+                                print(f"Grading task failed: {grades!r}")
+                                continue
+                            for conflict in grades:
+                                if kind == "same_class":
+                                    if conflict['conflict_grade'] == "High":  
+                                        high_conflicts.append((sequence, conflict))  
+                                    elif conflict['conflict_grade'] == "Moderate":  
+                                        moderate_conflicts.append((sequence, conflict))  
+                                    else:  
+                                        low_conflicts.append((sequence, conflict))  
+                                elif conflict['conflict_grade'] == "Name-Match":  
+                                    Name_Matchs.append((sequence, conflict))  
+                                else:  
+                                    print("Low")
+                                    # low_conflicts.append(conflict) 
+                        grading_status.write(f"Graded {fanout.completed} of {fanout.dispatched} comparison tasks sent")
+                        # Grading fills 25-70%; more marks are still being parsed, so the bar never moves back
+                        grading_progress = max(grading_progress, 25 + 45 * fanout.collected // max(1, fanout.queued))
+                        progress_bar.progress(grading_progress)
+
+                    # Records stream out of the parser as soon as their pages are scanned, so grading starts before parsing ends
+                    existing_trademarks = iter_existing_trademarks(pdf_document, pdf_bytes, page_store, parse_cache)
+                    if GOODS_SIMILARITY:
+                        existing_trademarks = score_goods_services(existing_trademarks, proposed_goods_services)
+                    for trademark_info in existing_trademarks:
+                        class_numbers = trademark_info["international_class_number"]  
+                        # Check if any of the class numbers are in class_list  
+                        fanout.add(trademark_info, same_class=any(number in class_list for number in class_numbers))
+                        collect(fanout.poll())
+                    for outcome in fanout.drain():
+                        collect([outcome])
+
+                    high_conflicts = [conflict for sequence, conflict in sorted(high_conflicts, key=lambda item: item[0])]
+                    moderate_conflicts = [conflict for sequence, conflict in sorted(moderate_conflicts, key=lambda item: item[0])]
+                    low_conflicts = [conflict for sequence, conflict in sorted(low_conflicts, key=lambda item: item[0])]
+                    Name_Matchs = [conflict for sequence, conflict in sorted(Name_Matchs, key=lambda item: item[0])]
+
+                    st.sidebar.write("_________________________________________________")
+                    st.sidebar.subheader("\n\nConflict Grades : \n")  
+                    st.sidebar.markdown(f"File: {proposed_name}")  
+                    st.sidebar.markdown(f"Total number of conflicts: {len(high_conflicts) + len(moderate_conflicts) + len(Name_Matchs) + len(low_conflicts)}")
+                    st.sidebar.markdown(f"High Conflicts: {len(high_conflicts)}")  
+                    st.sidebar.markdown(f"Moderate Conflicts: {len(moderate_conflicts)}")  
+                    st.sidebar.markdown(f"Name Match's Conflicts: {len(Name_Matchs)}")  
+                    st.sidebar.markdown(f"Low Conflicts: {len(low_conflicts)}")  
+                    dead_letters = work_item_store.dead_letters(report_id)
+                    st.sidebar.markdown(f"Failed items: {len(dead_letters)}")
+                    st.sidebar.markdown(f"LLM calls avoided by the name pre-screen: {fanout.screened} of {fanout.cross_class_marks} cross-class marks")
+                    if GOODS_SIMILARITY_PRUNE:
+                        st.sidebar.markdown(f"Same-class marks pruned for unrelated goods/services: {fanout.pruned}")
+                    st.sidebar.write("_________________________________________________")
+                    if dead_letters:
+                        st.warning(f"{len(dead_letters)} items of {uploaded_file.name} failed every retry and are missing from the report; generating it again retries only these")
                         
-                                    document = Document()  
+                    document = Document()  
                                     
-                                    document.add_heading(f'Trademark Conflict List for {proposed_name} (VERSION - 6.2) :')            
-                                    document.add_paragraph(f"\n\nTotal number of conflicts: {len(high_conflicts) + len(moderate_conflicts) + len(Name_Matchs) + len(low_conflicts)}\n- High Conflicts: {len(high_conflicts)}\n- Moderate Conflicts: {len(moderate_conflicts)}\n- Name Match's Conflicts: {len(Name_Matchs)}\n- Low Conflicts: {len(low_conflicts)}\n")  
+                    document.add_heading(f'Trademark Conflict List for {proposed_name} (VERSION - 6.2) :')            
+                    document.add_paragraph(f"\n\nTotal number of conflicts: {len(high_conflicts) + len(moderate_conflicts) + len(Name_Matchs) + len(low_conflicts)}\n- High Conflicts: {len(high_conflicts)}\n- Moderate Conflicts: {len(moderate_conflicts)}\n- Name Match's Conflicts: {len(Name_Matchs)}\n- Low Conflicts: {len(low_conflicts)}\n")  
                                     
-                                    if len(high_conflicts) > 0:  
-                                                document.add_heading('Trademarks with High Conflicts:', level=2)  
-                                                # Create a pandas DataFrame from the JSON list    
-                                                df_high = pd.DataFrame(high_conflicts) 
-                                                df_high = df_high.drop(columns=['Trademark serial number','Trademark registration number','Trademark design phrase','reasoning'])  
-                                                # Create a table in the Word document    
-                                                table_high = document.add_table(df_high.shape[0] + 1, df_high.shape[1])
-                                                # Set a predefined table style (with borders)  
-                                                table_high.style = 'TableGrid'  # This is a built-in style that includes borders  
-                                                # Add the column names to the table    
-                                                for i, column_name in enumerate(df_high.columns):  
-                                                    table_high.cell(0, i).text = column_name  
-                                                # Add the data to the table    
-                                                for i, row in df_high.iterrows():  
-                                                    for j, value in enumerate(row):  
-                                                        table_high.cell(i + 1, j).text = str(value)
-
-                                    if len(moderate_conflicts) > 0:  
-                                                document.add_heading('Trademarks with Moderate Conflicts:', level=2)  
-                                                # Create a pandas DataFrame from the JSON list    
-                                                df_moderate = pd.DataFrame(moderate_conflicts)
-                                                df_moderate = df_moderate.drop(columns=['Trademark serial number','Trademark registration number','Trademark design phrase','reasoning'])  
-                                                # Create a table in the Word document    
-                                                table_moderate = document.add_table(df_moderate.shape[0] + 1, df_moderate.shape[1])
-                                                # Set a predefined table style (with borders)  
-                                                table_moderate.style = 'TableGrid'  # This is a built-in style that includes borders  
-                                                # Add the column names to the table    
-                                                for i, column_name in enumerate(df_moderate.columns):  
-                                                    table_moderate.cell(0, i).text = column_name  
-                                                # Add the data to the table    
-                                                for i, row in df_moderate.iterrows():  
-                                                    for j, value in enumerate(row):  
-                                                        table_moderate.cell(i + 1, j).text = str(value)
+                    if len(high_conflicts) > 0:  
+                                document.add_heading('Trademarks with High Conflicts:', level=2)  
+                                # Create a pandas DataFrame from the JSON list    
+                                df_high = pd.DataFrame(high_conflicts) 
+                                df_high = df_high.drop(columns=['Trademark serial number','Trademark registration number','Trademark design phrase','reasoning'])  
+                                # Create a table in the Word document    
+                                table_high = document.add_table(df_high.shape[0] + 1, df_high.shape[1])
+                                # Set a predefined table style (with borders)  
+                                table_high.style = 'TableGrid'  # This is a built-in style that includes borders  
+                                # Add the column names to the table    
+                                for i, column_name in enumerate(df_high.columns):  
+                                    table_high.cell(0, i).text = column_name  
+                                # Add the data to the table    
+                                for i, row in df_high.iterrows():  
+                                    for j, value in enumerate(row):  
+                                        table_high.cell(i + 1, j).text = str(value)
+
+                    if len(moderate_conflicts) > 0:  
+                                document.add_heading('Trademarks with Moderate Conflicts:', level=2)  
+                                # Create a pandas DataFrame from the JSON list    
+                                df_moderate = pd.DataFrame(moderate_conflicts)
+                                df_moderate = df_moderate.drop(columns=['Trademark serial number','Trademark registration number','Trademark design phrase','reasoning'])  
+                                # Create a table in the Word document    
+                                table_moderate = document.add_table(df_moderate.shape[0] + 1, df_moderate.shape[1])
+                                # Set a predefined table style (with borders)  
+                                table_moderate.style = 'TableGrid'  # This is a built-in style that includes borders  
+                                # Add the column names to the table    
+                                for i, column_name in enumerate(df_moderate.columns):  
+                                    table_moderate.cell(0, i).text = column_name  
+                                # Add the data to the table    
+                                for i, row in df_moderate.iterrows():  
+                                    for j, value in enumerate(row):  
+                                        table_moderate.cell(i + 1, j).text = str(value)
                                                         
-                                    if len(Name_Matchs) > 0:  
-                                                document.add_heading("Trademarks with Name Match's Conflicts:", level=2)  
-                                                # Create a pandas DataFrame from the JSON list    
-                                                df_Name_Matchs = pd.DataFrame(Name_Matchs)
-                                                df_Name_Matchs = df_Name_Matchs.drop(columns=['Trademark serial number','Trademark registration number','Trademark design phrase','reasoning'])  
-                                                # Create a table in the Word document    
-                                                table_Name_Matchs = document.add_table(df_Name_Matchs.shape[0] + 1, df_Name_Matchs.shape[1])
-                                                # Set a predefined table style (with borders)  
-                                                table_Name_Matchs.style = 'TableGrid'  # This is a built-in style that includes borders  
-                                                # Add the column names to the table    
-                                                for i, column_name in enumerate(df_Name_Matchs.columns):  
-                                                    table_Name_Matchs.cell(0, i).text = column_name  
-                                                # Add the data to the table    
-                                                for i, row in df_Name_Matchs.iterrows():  
-                                                    for j, value in enumerate(row):  
-                                                        table_Name_Matchs.cell(i + 1, j).text = str(value)
-
-                                    if len(low_conflicts) > 0:  
-                                                document.add_heading('Trademarks with Low Conflicts:', level=2)  
-                                                # Create a pandas DataFrame from the JSON list    
-                                                df_low = pd.DataFrame(low_conflicts)  
-                                                df_low = df_low.drop(columns=['Trademark serial number','Trademark registration number','Trademark design phrase','reasoning'])
-                                                # Create a table in the Word document    
-                                                table_low = document.add_table(df_low.shape[0] + 1, df_low.shape[1])
-                                                # Set a predefined table style (with borders)  
-                                                table_low.style = 'TableGrid'  # This is a built-in style that includes borders  
-                                                # Add the column names to the table    
-                                                for i, column_name in enumerate(df_low.columns):  
-                                                    table_low.cell(0, i).text = column_name  
-                                                # Add the data to the table    
-                                                for i, row in df_low.iterrows():  
-                                                    for j, value in enumerate(row):  
-                                                        table_low.cell(i + 1, j).text = str(value)
+                    if len(Name_Matchs) > 0:  
+                                document.add_heading("Trademarks with Name Match's Conflicts:", level=2)  
+                                # Create a pandas DataFrame from the JSON list    
+                                df_Name_Matchs = pd.DataFrame(Name_Matchs)
+                                df_Name_Matchs = df_Name_Matchs.drop(columns=['Trademark serial number','Trademark registration number','Trademark design phrase','reasoning'])  
+                                # Create a table in the Word document    
+                                table_Name_Matchs = document.add_table(df_Name_Matchs.shape[0] + 1, df_Name_Matchs.shape[1])
+                                # Set a predefined table style (with borders)  
+                                table_Name_Matchs.style = 'TableGrid'  # This is a built-in style that includes borders  
+                                # Add the column names to the table    
+                                for i, column_name in enumerate(df_Name_Matchs.columns):  
+                                    table_Name_Matchs.cell(0, i).text = column_name  
+                                # Add the data to the table    
+                                for i, row in df_Name_Matchs.iterrows():  
+                                    for j, value in enumerate(row):  
+                                        table_Name_Matchs.cell(i + 1, j).text = str(value)
+
+                    if len(low_conflicts) > 0:  
+                                document.add_heading('Trademarks with Low Conflicts:', level=2)  
+                                # Create a pandas DataFrame from the JSON list    
+                                df_low = pd.DataFrame(low_conflicts)  
+                                df_low = df_low.drop(columns=['Trademark serial number','Trademark registration number','Trademark design phrase','reasoning'])
+                                # Create a table in the Word document    
+                                table_low = document.add_table(df_low.shape[0] + 1, df_low.shape[1])
+                                # Set a predefined table style (with borders)  
+                                table_low.style = 'TableGrid'  # This is a built-in style that includes borders  
+                                # Add the column names to the table    
+                                for i, column_name in enumerate(df_low.columns):  
+                                    table_low.cell(0, i).text = column_name  
+                                # Add the data to the table    
+                                for i, row in df_low.iterrows():  
+                                    for j, value in enumerate(row):  
+                                        table_low.cell(i + 1, j).text = str(value)
                                                 
-                                    def add_conflict_paragraph(document, conflict):  
-                                        p = document.add_paragraph(f"Trademark Name : {conflict.get('Trademark name', 'N/A')}")  
-                                        p.paragraph_format.line_spacing = Pt(18)  
-                                        p.paragraph_format.space_after = Pt(0)
-                                        p = document.add_paragraph(f"Trademark Status : {conflict.get('Trademark status', 'N/A')}")  
-                                        p.paragraph_format.line_spacing = Pt(18)  
-                                        p.paragraph_format.space_after = Pt(0)
-                                        p = document.add_paragraph(f"Trademark Owner : {conflict.get('Trademark owner', 'N/A')}")  
-                                        p.paragraph_format.line_spacing = Pt(18)  
-                                        p.paragraph_format.space_after = Pt(0)
-                                        p = document.add_paragraph(f"Trademark Class Number : {conflict.get('Trademark class Number', 'N/A')}")  
-                                        p.paragraph_format.line_spacing = Pt(18)
-                                        p.paragraph_format.space_after = Pt(0)  
-                                        p = document.add_paragraph(f"Trademark serial number : {conflict.get('Trademark serial number', 'N/A')}")  
-                                        p.paragraph_format.line_spacing = Pt(18)  
-                                        p.paragraph_format.space_after = Pt(0)
-                                        p = document.add_paragraph(f"Trademark registration number : {conflict.get('Trademark registration number', 'N/A')}")  
-                                        p.paragraph_format.line_spacing = Pt(18)  
-                                        p.paragraph_format.space_after = Pt(0) 
-                                        p = document.add_paragraph(f"Trademark Design phrase : {conflict.get('Trademark design phrase', 'N/A')}")  
-                                        p.paragraph_format.line_spacing = Pt(18)  
-                                        p.paragraph_format.space_after = Pt(0)
-                                        p = document.add_paragraph(" ")  
-                                        p.paragraph_format.line_spacing = Pt(18)  
-                                        p.paragraph_format.space_after = Pt(0) 
-                                        p = document.add_paragraph(f"{conflict.get('reasoning','N/A')}\n")  
-                                        p.paragraph_format.line_spacing = Pt(18)  
-                                        p = document.add_paragraph(" ")  
-                                        p.paragraph_format.line_spacing = Pt(18)  
+                    def add_conflict_paragraph(document, conflict):  
+                        p = document.add_paragraph(f"Trademark Name : {conflict.get('Trademark name', 'N/A')}")  
+                        p.paragraph_format.line_spacing = Pt(18)  
+                        p.paragraph_format.space_after = Pt(0)
+                        p = document.add_paragraph(f"Trademark Status : {conflict.get('Trademark status', 'N/A')}")  
+                        p.paragraph_format.line_spacing = Pt(18)  
+                        p.paragraph_format.space_after = Pt(0)
+                        p = document.add_paragraph(f"Trademark Owner : {conflict.get('Trademark owner', 'N/A')}")  
+                        p.paragraph_format.line_spacing = Pt(18)  
+                        p.paragraph_format.space_after = Pt(0)
+                        p = document.add_paragraph(f"Trademark Class Number : {conflict.get('Trademark class Number', 'N/A')}")  
+                        p.paragraph_format.line_spacing = Pt(18)
+                        p.paragraph_format.space_after = Pt(0)  
+                        p = document.add_paragraph(f"Trademark serial number : {conflict.get('Trademark serial number', 'N/A')}")  
+                        p.paragraph_format.line_spacing = Pt(18)  
+                        p.paragraph_format.space_after = Pt(0)
+                        p = document.add_paragraph(f"Trademark registration number : {conflict.get('Trademark registration number', 'N/A')}")  
+                        p.paragraph_format.line_spacing = Pt(18)  
+                        p.paragraph_format.space_after = Pt(0) 
+                        p = document.add_paragraph(f"Trademark Design phrase : {conflict.get('Trademark design phrase', 'N/A')}")  
+                        p.paragraph_format.line_spacing = Pt(18)  
+                        p.paragraph_format.space_after = Pt(0)
+                        p = document.add_paragraph(" ")  
+                        p.paragraph_format.line_spacing = Pt(18)  
+                        p.paragraph_format.space_after = Pt(0) 
+                        p = document.add_paragraph(f"{conflict.get('reasoning','N/A')}\n")  
+                        p.paragraph_format.line_spacing = Pt(18)  
+                        p = document.add_paragraph(" ")  
+                        p.paragraph_format.line_spacing = Pt(18)  
                                     
-                                    if len(high_conflicts) > 0:  
-                                        document.add_heading('Trademarks with High Conflicts Reasoning:', level=2)  
-                                        p = document.add_paragraph(" ")  
-                                        p.paragraph_format.line_spacing = Pt(18)  
-                                        for conflict in high_conflicts:  
-                                            add_conflict_paragraph(document, conflict)  
+                    if len(high_conflicts) > 0:  
+                        document.add_heading('Trademarks with High Conflicts Reasoning:', level=2)  
+                        p = document.add_paragraph(" ")  
+                        p.paragraph_format.line_spacing = Pt(18)  
+                        for conflict in high_conflicts:  
+                            add_conflict_paragraph(document, conflict)  
                                     
-                                    if len(moderate_conflicts) > 0:  
-                                        document.add_heading('Trademarks with Moderate Conflicts Reasoning:', level=2)  
-                                        p = document.add_paragraph(" ")  
-                                        p.paragraph_format.line_spacing = Pt(18)  
-                                        for conflict in moderate_conflicts:  
-                                            add_conflict_paragraph(document, conflict)  
+                    if len(moderate_conflicts) > 0:  
+                        document.add_heading('Trademarks with Moderate Conflicts Reasoning:', level=2)  
+                        p = document.add_paragraph(" ")  
+                        p.paragraph_format.line_spacing = Pt(18)  
+                        for conflict in moderate_conflicts:  
+                            add_conflict_paragraph(document, conflict)  
                                             
-                                    if len(Name_Matchs) > 0:  
-                                        document.add_heading("Trademarks with Name Match's Conflicts Reasoning:", level=2)  
-                                        p = document.add_paragraph(" ")  
-                                        p.paragraph_format.line_spacing = Pt(18)  
-                                        for conflict in Name_Matchs:  
-                                            add_conflict_paragraph(document, conflict)  
+                    if len(Name_Matchs) > 0:  
+                        document.add_heading("Trademarks with Name Match's Conflicts Reasoning:", level=2)  
+                        p = document.add_paragraph(" ")  
+                        p.paragraph_format.line_spacing = Pt(18)  
+                        for conflict in Name_Matchs:  
+                            add_conflict_paragraph(document, conflict)  
                                     
-                                    if len(low_conflicts) > 0:  
-                                        document.add_heading('Trademarks with Low Conflicts Reasoning:', level=2)  
-                                        p = document.add_paragraph(" ")  
-                                        p.paragraph_format.line_spacing = Pt(18)  
-                                        for conflict in low_conflicts:  
-                                            add_conflict_paragraph(document, conflict)  
+                    if len(low_conflicts) > 0:  
+                        document.add_heading('Trademarks with Low Conflicts Reasoning:', level=2)  
+                        p = document.add_paragraph(" ")  
+                        p.paragraph_format.line_spacing = Pt(18)  
+                        for conflict in low_conflicts:  
+                            add_conflict_paragraph(document, conflict)  
                                             
-                                    for i in range(70,96):
-                                        progress_bar.progress(i)  
+                    if dead_letters:
+                        document.add_heading('Items That Could Not Be Processed:', level=2)
+                        p = document.add_paragraph("These items failed every retry and are not graded above. Generating the report again retries only these items.")
+                        for entry in dead_letters:
+                            document.add_paragraph(f"{entry['kind']} - {entry['label']}: {entry['error']}", style='List Bullet')
+
+                    # Grading tasks still running in Celery workers are not in these totals yet
+                    usage = usage_ledger.report(report_id)
+                    add_usage_appendix(document, usage)
+                    document.add_paragraph(f"LLM calls avoided: the name pre-screen graded {fanout.screened} of {fanout.cross_class_marks} cross-class marks Low without an LLM call.")
+                    if GOODS_SIMILARITY_PRUNE:
+                        document.add_paragraph(f"The goods/services pre-screen graded {fanout.pruned} same-class marks Low without an LLM call.")
+
+                    for i in range(70,96):
+                        progress_bar.progress(i)  
                                         
-                                    progress_bar.progress(100)
+                    progress_bar.progress(100)
                         
-                                    filename = proposed_name
-                                    doc_stream = BytesIO()  
-                                    document.save(doc_stream)  
-                                    doc_stream.seek(0)  
-                                    download_table = f'<a href="data:application/octet-stream;base64,{base64.b64encode(doc_stream.read()).decode()}" download="{filename + " Trademark Conflict Report"}.docx">Download: {filename}</a>'  
-                                    st.sidebar.markdown(download_table, unsafe_allow_html=True)  
-                                    st.success(f"{proposed_name} Document conflict report successfully completed!")
+                    filename = proposed_name
+                    doc_stream = BytesIO()  
+                    document.save(doc_stream)  
+                    doc_stream.seek(0)  
+                    download_table = f'<a href="data:application/octet-stream;base64,{base64.b64encode(doc_stream.read()).decode()}" download="{filename + " Trademark Conflict Report"}.docx">Download: {filename}</a>'  
+                    st.sidebar.markdown(download_table, unsafe_allow_html=True)  
+                    st.success(f"{proposed_name} Document conflict report successfully completed!")
                                     
-                                    end_time = time.time()
-                                    elapsed_time = end_time - start_time
-                                    elapsed_time = elapsed_time // 60 
-                                    st.write(f"Time taken: {elapsed_time} mins")
-
-                                    st.write("______________________________________________________________________________________________________________________________")
-                            
-                                except ValidationError as e:
-                                    print(f"Validation error for trademark {i}: {e}")
-                                                
-                        else :
-                            if not is_correct_format_code2(page_text):
-                                continue
-
-                            extracted_data = extract_trademark_details_code2(page_text)
-                            if extracted_data:
-                                extracted_data["page_number"] = page_num + 1
-                                all_extracted_data.append(extracted_data)
-
-                            trademark_list = []
-                            for i, data in enumerate(all_extracted_data, start=1):
-                                try:
-                                    trademark_details = TrademarkDetails(
-                                        trademark_name=data.get("trademark_name", ""),
-                                        owner=data.get("owner", ""),
-                                        status=data.get("status", ""),
-                                        serial_number=data.get("serial_number", ""),
-                                        international_class_number=data.get("international_class_number", []),
-                                        goods_services=data.get("goods_services", ""),
-                                        page_number=data.get("page_number", 0),
-                                        registration_number=data.get("registration_number", ""),
-                                        design_phrase=data.get("design_phrase", "")
-                                    )
-                                    if (trademark_details.trademark_name != "" and trademark_details.owner != "" and trademark_details.status != "" and trademark_details.goods_services != ""):
-                                            trademark_info = {
-                                                "trademark_name": trademark_details.trademark_name,
-                                                "owner": trademark_details.owner,
-                                                "status": trademark_details.status,
-                                                "serial_number": trademark_details.serial_number,
-                                                "international_class_number": trademark_details.international_class_number,
-                                                "goods_services": trademark_details.goods_services,
-                                                "page_number": trademark_details.page_number,
-                                                "registration_number":trademark_details.registration_number,
-                                                "design_phrase":trademark_details.design_phrase,
-                                            }
-                                            
-                                            trademark_list.append(trademark_info)
-                                            nfiltered_list = []
-                                            unsame_class_list = []
-                                            json_element = trademark_info
-                                            class_numbers = json_element["international_class_number"]  
-                                        # Check if any of the class numbers are in class_list  
-                                            if any(number in class_list for number in class_numbers):  
-                                                nfiltered_list.append(json_element)
-                                            else:
-                                                unsame_class_list.append(json_element)
-                                            existing_trademarks = nfiltered_list  
-                                            existing_trademarks_unsame =  unsame_class_list
-                                                
-                                            high_conflicts = []
-                                            moderate_conflicts = []
-                                            low_conflicts = []
-                                            Name_Matchs = []
-                                            
-                                            lt = len(existing_trademarks)
-                                            
-                                            for existing_trademark in existing_trademarks:  
-                                                conflict = compare_trademarks.delay(existing_trademarks, proposed_name, proposed_class, proposed_goods_services)
-                                                if conflict is not None:
-                                                    if conflict['conflict_grade'] == "High":  
-                                                        high_conflicts.append(conflict)  
-                                                    elif conflict['conflict_grade'] == "Moderate":  
-                                                        moderate_conflicts.append(conflict)  
-                                                    else:  
-                                                        low_conflicts.append(conflict)  
-                                                    
-                                            for existing_trademarks in existing_trademarks_unsame:
-                                                conflict =compare_trademarks2.delay(existing_trademarks, proposed_name, proposed_class, proposed_goods_services)  
-
-                                                if conflict['conflict_grade'] == "Name-Match":  
-                                                    Name_Matchs.append(conflict)  
-                                                else:  
-                                                    print("Low")
-                                                    # low_conflicts.append(conflict) 
-                                                    
-                                            st.sidebar.write("_________________________________________________")
-                                            st.sidebar.subheader("\n\nConflict Grades : \n")  
-                                            st.sidebar.markdown(f"File: {proposed_name}")  
-                                            st.sidebar.markdown(f"Total number of conflicts: {len(high_conflicts) + len(moderate_conflicts) + len(Name_Matchs) + len(low_conflicts)}")
-                                            st.sidebar.markdown(f"High Conflicts: {len(high_conflicts)}")  
-                                            st.sidebar.markdown(f"Moderate Conflicts: {len(moderate_conflicts)}")  
-                                            st.sidebar.markdown(f"Name Match's Conflicts: {len(Name_Matchs)}")  
-                                            st.sidebar.markdown(f"Low Conflicts: {len(low_conflicts)}")  
-                                            st.sidebar.write("_________________________________________________")
-                                
-                                            document = Document()  
-                                            
-                                            document.add_heading(f'Trademark Conflict List for {proposed_name} (VERSION - 6.2) :')            
-                                            document.add_paragraph(f"\n\nTotal number of conflicts: {len(high_conflicts) + len(moderate_conflicts) + len(Name_Matchs) + len(low_conflicts)}\n- High Conflicts: {len(high_conflicts)}\n- Moderate Conflicts: {len(moderate_conflicts)}\n- Name Match's Conflicts: {len(Name_Matchs)}\n- Low Conflicts: {len(low_conflicts)}\n")  
-                                            
-                                            if len(high_conflicts) > 0:  
-                                                        document.add_heading('Trademarks with High Conflicts:', level=2)  
-                                                        # Create a pandas DataFrame from the JSON list    
-                                                        df_high = pd.DataFrame(high_conflicts) 
-                                                        df_high = df_high.drop(columns=['Trademark serial number','Trademark registration number','Trademark design phrase','reasoning'])  
-                                                        # Create a table in the Word document    
-                                                        table_high = document.add_table(df_high.shape[0] + 1, df_high.shape[1])
-                                                        # Set a predefined table style (with borders)  
-                                                        table_high.style = 'TableGrid'  # This is a built-in style that includes borders  
-                                                        # Add the column names to the table    
-                                                        for i, column_name in enumerate(df_high.columns):  
-                                                            table_high.cell(0, i).text = column_name  
-                                                        # Add the data to the table    
-                                                        for i, row in df_high.iterrows():  
-                                                            for j, value in enumerate(row):  
-                                                                table_high.cell(i + 1, j).text = str(value)
-
-                                            if len(moderate_conflicts) > 0:  
-                                                        document.add_heading('Trademarks with Moderate Conflicts:', level=2)  
-                                                        # Create a pandas DataFrame from the JSON list    
-                                                        df_moderate = pd.DataFrame(moderate_conflicts)
-                                                        df_moderate = df_moderate.drop(columns=['Trademark serial number','Trademark registration number','Trademark design phrase','reasoning'])  
-                                                        # Create a table in the Word document    
-                                                        table_moderate = document.add_table(df_moderate.shape[0] + 1, df_moderate.shape[1])
-                                                        # Set a predefined table style (with borders)  
-                                                        table_moderate.style = 'TableGrid'  # This is a built-in style that includes borders  
-                                                        # Add the column names to the table    
-                                                        for i, column_name in enumerate(df_moderate.columns):  
-                                                            table_moderate.cell(0, i).text = column_name  
-                                                        # Add the data to the table    
-                                                        for i, row in df_moderate.iterrows():  
-                                                            for j, value in enumerate(row):  
-                                                                table_moderate.cell(i + 1, j).text = str(value)
-                                                                
-                                            if len(Name_Matchs) > 0:  
-                                                        document.add_heading("Trademarks with Name Match's Conflicts:", level=2)  
-                                                        # Create a pandas DataFrame from the JSON list    
-                                                        df_Name_Matchs = pd.DataFrame(Name_Matchs)
-                                                        df_Name_Matchs = df_Name_Matchs.drop(columns=['Trademark serial number','Trademark registration number','Trademark design phrase','reasoning'])  
-                                                        # Create a table in the Word document    
-                                                        table_Name_Matchs = document.add_table(df_Name_Matchs.shape[0] + 1, df_Name_Matchs.shape[1])
-                                                        # Set a predefined table style (with borders)  
-                                                        table_Name_Matchs.style = 'TableGrid'  # This is a built-in style that includes borders  
-                                                        # Add the column names to the table    
-                                                        for i, column_name in enumerate(df_Name_Matchs.columns):  
-                                                            table_Name_Matchs.cell(0, i).text = column_name  
-                                                        # Add the data to the table    
-                                                        for i, row in df_Name_Matchs.iterrows():  
-                                                            for j, value in enumerate(row):  
-                                                                table_Name_Matchs.cell(i + 1, j).text = str(value)
-
-                                            if len(low_conflicts) > 0:  
-                                                        document.add_heading('Trademarks with Low Conflicts:', level=2)  
-                                                        # Create a pandas DataFrame from the JSON list    
-                                                        df_low = pd.DataFrame(low_conflicts)  
-                                                        df_low = df_low.drop(columns=['Trademark serial number','Trademark registration number','Trademark design phrase','reasoning'])
-                                                        # Create a table in the Word document    
-                                                        table_low = document.add_table(df_low.shape[0] + 1, df_low.shape[1])
-                                                        # Set a predefined table style (with borders)  
-                                                        table_low.style = 'TableGrid'  # This is a built-in style that includes borders  
-                                                        # Add the column names to the table    
-                                                        for i, column_name in enumerate(df_low.columns):  
-                                                            table_low.cell(0, i).text = column_name  
-                                                        # Add the data to the table    
-                                                        for i, row in df_low.iterrows():  
-                                                            for j, value in enumerate(row):  
-                                                                table_low.cell(i + 1, j).text = str(value)
-                                                        
-                                            def add_conflict_paragraph(document, conflict):  
-                                                p = document.add_paragraph(f"Trademark Name : {conflict.get('Trademark name', 'N/A')}")  
-                                                p.paragraph_format.line_spacing = Pt(18)  
-                                                p.paragraph_format.space_after = Pt(0)
-                                                p = document.add_paragraph(f"Trademark Status : {conflict.get('Trademark status', 'N/A')}")  
-                                                p.paragraph_format.line_spacing = Pt(18)  
-                                                p.paragraph_format.space_after = Pt(0)
-                                                p = document.add_paragraph(f"Trademark Owner : {conflict.get('Trademark owner', 'N/A')}")  
-                                                p.paragraph_format.line_spacing = Pt(18)  
-                                                p.paragraph_format.space_after = Pt(0)
-                                                p = document.add_paragraph(f"Trademark Class Number : {conflict.get('Trademark class Number', 'N/A')}")  
-                                                p.paragraph_format.line_spacing = Pt(18)
-                                                p.paragraph_format.space_after = Pt(0)  
-                                                p = document.add_paragraph(f"Trademark serial number : {conflict.get('Trademark serial number', 'N/A')}")  
-                                                p.paragraph_format.line_spacing = Pt(18)  
-                                                p.paragraph_format.space_after = Pt(0)
-                                                p = document.add_paragraph(f"Trademark registration number : {conflict.get('Trademark registration number', 'N/A')}")  
-                                                p.paragraph_format.line_spacing = Pt(18)  
-                                                p.paragraph_format.space_after = Pt(0) 
-                                                p = document.add_paragraph(f"Trademark Design phrase : {conflict.get('Trademark design phrase', 'N/A')}")  
-                                                p.paragraph_format.line_spacing = Pt(18)  
-                                                p.paragraph_format.space_after = Pt(0)
-                                                p = document.add_paragraph(" ")  
-                                                p.paragraph_format.line_spacing = Pt(18)  
-                                                p.paragraph_format.space_after = Pt(0) 
-                                                p = document.add_paragraph(f"{conflict.get('reasoning','N/A')}\n")  
-                                                p.paragraph_format.line_spacing = Pt(18)  
-                                                p = document.add_paragraph(" ")  
-                                                p.paragraph_format.line_spacing = Pt(18)  
-                                            
-                                            if len(high_conflicts) > 0:  
-                                                document.add_heading('Trademarks with High Conflicts Reasoning:', level=2)  
-                                                p = document.add_paragraph(" ")  
-                                                p.paragraph_format.line_spacing = Pt(18)  
-                                                for conflict in high_conflicts:  
-                                                    add_conflict_paragraph(document, conflict)  
-                                            
-                                            if len(moderate_conflicts) > 0:  
-                                                document.add_heading('Trademarks with Moderate Conflicts Reasoning:', level=2)  
-                                                p = document.add_paragraph(" ")  
-                                                p.paragraph_format.line_spacing = Pt(18)  
-                                                for conflict in moderate_conflicts:  
-                                                    add_conflict_paragraph(document, conflict)  
-                                                    
-                                            if len(Name_Matchs) > 0:  
-                                                document.add_heading("Trademarks with Name Match's Conflicts Reasoning:", level=2)  
-                                                p = document.add_paragraph(" ")  
-                                                p.paragraph_format.line_spacing = Pt(18)  
-                                                for conflict in Name_Matchs:  
-                                                    add_conflict_paragraph(document, conflict)  
-                                            
-                                            if len(low_conflicts) > 0:  
-                                                document.add_heading('Trademarks with Low Conflicts Reasoning:', level=2)  
-                                                p = document.add_paragraph(" ")  
-                                                p.paragraph_format.line_spacing = Pt(18)  
-                                                for conflict in low_conflicts:  
-                                                    add_conflict_paragraph(document, conflict)  
-                                                    
-                                            for i in range(70,96):
-                                                progress_bar.progress(i)  
-                                                
-                                            progress_bar.progress(100)
-                                
-                                            filename = proposed_name
-                                            doc_stream = BytesIO()  
-                                            document.save(doc_stream)  
-                                            doc_stream.seek(0)  
-                                            download_table = f'<a href="data:application/octet-stream;base64,{base64.b64encode(doc_stream.read()).decode()}" download="{filename + " Trademark Conflict Report"}.docx">Download: {filename}</a>'  
-                                            st.sidebar.markdown(download_table, unsafe_allow_html=True)  
-                                            st.success(f"{proposed_name} Document conflict report successfully completed!")
-                                            
-                                            end_time = time.time()
-                                            elapsed_time = end_time - start_time
-                                            elapsed_time = elapsed_time // 60 
-                                            st.write(f"Time taken: {elapsed_time} mins")
+                    end_time = time.time()
+                    elapsed_time = end_time - start_time
+                    st.write(f"Time taken: {elapsed_time / 60:.1f} mins ({elapsed_time:.0f} s)")
+                    st.sidebar.write("LLM usage by stage:")
+                    for stage, totals in usage.items():
+                        st.sidebar.write(f"{stage}: {totals['calls']:.0f} calls, {totals['prompt_tokens']:,.0f} prompt ({totals['cached_tokens']:,.0f} cached) + {totals['completion_tokens']:,.0f} completion tokens, ${totals['cost']:.4f}")
+                    usage_ledger.log_report(report_id, uploaded_file.name, elapsed_time)
+                    peak_rss = peak_rss_mb()
+                    if peak_rss is not None:
+                        print(f"Peak RSS after {uploaded_file.name}: {peak_rss:.0f} MB")
+                        st.write(f"Peak memory: {peak_rss:.0f} MB")
+                    cache_stats = llm_cache.stats()
+                    print(f"LLM cache after {uploaded_file.name}: {cache_stats}")
+                    st.sidebar.write(f"LLM cache: {cache_stats['memory_hits'] + cache_stats['redis_hits']} hits, {cache_stats['misses']} misses")
+                    # Calls made in this process; grading tasks record theirs in the Celery worker's log
+                    for prompt, prompt_stats in prompt_cache_stats.stats().items():
+                        print(f"Prompt cache for {prompt} after {uploaded_file.name}: {prompt_stats}")
+                        st.sidebar.write(f"Prompt cache {prompt}: {prompt_stats['cached_ratio']:.0%} of {prompt_stats['prompt_tokens']} prompt tokens cached")
+                    parse_stats = code1_parse_stats.stats(report_id)
+                    print(f"Code1 parser after {uploaded_file.name}: {parse_stats}")
+                    st.sidebar.write(f"Code1 pages without LLM: {parse_stats['pages_without_llm']}/{parse_stats['pages']} ({parse_stats['llm_avoidance_rate']:.0%})")
+                    print(f"Name pre-screen after {uploaded_file.name}: {name_screen_stats.stats(report_id)}")
+                    print(f"Goods/services embedding cache after {uploaded_file.name}: {embedding_cache.stats()}")
 
-                                            st.write("______________________________________________________________________________________________________________________________")
-                                    
-                                            
-                                except ValidationError as e:
-                                    print(f"Validation error for trademark {i}: {e}")
+                    st.write("______________________________________________________________________________________________________________________________")
 
         #         for i in range(25,46):
         #             progress_bar.progress(i)  
@@ -0,0 +1,106 @@
+import os
+from functools import lru_cache
+from typing import Callable, Dict, List, Tuple
+
+import tiktoken
+
+LLM_TOKEN_MODEL = os.getenv("LLM_TOKEN_MODEL", "gpt-4o-mini")
+
+# Prompt tokens of document text per extraction request
+CHUNK_TOKEN_BUDGET = int(os.getenv("CHUNK_TOKEN_BUDGET", 4000))
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = LLM_TOKEN_MODEL) -> tiktoken.Encoding:
+    """ Tokenizer of a model, loaded once per process """
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # Deployment names are not always model names; the GPT-4o family uses o200k_base
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, model: str = LLM_TOKEN_MODEL) -> int:
+    return len(get_encoding(model).encode(text, disallowed_special=()))
+
+
+class Chunk:
+    """ Whole records packed into one request, with the token count of the packed text """
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.page_ranges: List[Tuple[int, int]] = []
+        self.parts: List[str] = []
+        self.tokens = 0
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.parts)
+
+    @property
+    def fill(self) -> float:
+        return self.tokens / self.budget
+
+    def to_dict(self) -> Dict:
+        return {"page_ranges": self.page_ranges, "tokens": self.tokens, "budget": self.budget, "fill": round(self.fill, 3)}
+
+
+def page_ranges_from_summary(summary_map: List[Dict[str, str]], page_count: int) -> List[Tuple[int, int]]:
+    """ 0-based [start, end) page range of every record in a USPTO summary page map ("page-start" / "page-end", 1-based)
+
+    A record ends where the next one starts; the last one ends at its own "page-end".
+    """
+    starts = [int(entry["page-start"]) - 1 for entry in summary_map]
+    ranges = []
+    for i, start in enumerate(starts):
+        if i + 1 < len(starts):
+            end = starts[i + 1]
+        else:
+            end = int(summary_map[i].get("page-end") or page_count)
+        ranges.append((start, max(start + 1, min(end, page_count))))
+    return ranges
+
+
+def pack_records(page_ranges: List[Tuple[int, int]], page_text: Callable[[int], str], budget: int = CHUNK_TOKEN_BUDGET, model: str = LLM_TOKEN_MODEL) -> List[Chunk]:
+    """ Greedily pack whole records, in order, into chunks of at most `budget` tokens
+
+    Each record is encoded once and chunk sizes are summed incrementally; a record larger than the
+    budget gets a chunk of its own rather than being split. The token count of every finished chunk
+    is then taken from one encode of its final text.
+    """
+    separator_tokens = count_tokens("\n", model)
+    chunks = []
+    chunk = Chunk(budget)
+    for start, end in page_ranges:
+        record_text = "\n".join(page_text(page_num) for page_num in range(start, end))
+        record_tokens = count_tokens(record_text, model)
+        added_tokens = record_tokens + (separator_tokens if chunk.parts else 0)
+        if chunk.parts and chunk.tokens + added_tokens > budget:
+            chunks.append(chunk)
+            chunk = Chunk(budget)
+            added_tokens = record_tokens
+        chunk.page_ranges.append((start, end))
+        chunk.parts.append(record_text)
+        chunk.tokens += added_tokens
+    if chunk.parts:
+        chunks.append(chunk)
+
+    for chunk in chunks:
+        chunk.tokens = count_tokens(chunk.text, model)
+    return chunks
+
+
+def fill_report(chunks: List[Chunk]) -> Dict[str, float]:
+    """ How well the chunks use their budget """
+    if not chunks:
+        return {"chunks": 0, "records": 0, "tokens": 0, "mean_fill": 0.0, "min_fill": 0.0, "over_budget": 0}
+    fills = [chunk.fill for chunk in chunks]
+    return {
+        "chunks": len(chunks),
+        "records": sum(len(chunk.page_ranges) for chunk in chunks),
+        "tokens": sum(chunk.tokens for chunk in chunks),
+        "mean_fill": round(sum(fills) / len(fills), 3),
+        # The last chunk holds the remainder, so its fill says nothing about the packing
+        "min_fill": round(min(fills[:-1] or fills), 3),
+        "over_budget": sum(chunk.tokens > chunk.budget for chunk in chunks),
+    }
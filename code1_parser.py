@@ -0,0 +1,108 @@
+import os
+import re
+import threading
+from typing import Dict, List, Tuple
+
+# A field parsed with at least this confidence is used as-is; anything lower is asked of the LLM
+CODE1_FIELD_MIN_CONFIDENCE = float(os.getenv("CODE1_FIELD_MIN_CONFIDENCE", 0.8))
+
+CODE1_FIELDS = ["trademark_name", "status", "serial_number", "owner"]
+
+# USPTO serial numbers: two-digit series code, then six digits, e.g. 87-693,628 (often with a Unicode minus)
+SERIAL_NUMBER = r"\d{2}\s*[-−–]\s*\d{3},\d{3}"
+
+
+def _parse_trademark_name(page_text: str) -> Tuple[str, float]:
+    """ The mark heads the record, on the last non-empty line above "Status:" """
+    head = page_text.split("Status:", 1)
+    lines = [line.strip() for line in head[0].splitlines() if line.strip()] if len(head) == 2 else []
+    if not lines:
+        return "", 0.0
+    name = re.sub(r"^\d+\.\s*", "", lines[-1])
+    if not name:
+        return "", 0.0
+    if ":" in name or len(name) > 120:
+        # A label or a wrapped paragraph rather than a mark
+        return name, 0.3
+    return name, 0.9 if name.upper() == name else 0.7
+
+
+def _parse_status(page_text: str) -> Tuple[str, float]:
+    match = re.search(r"Status:[ \t]*([^\n]*)", page_text)
+    if not match or not match.group(1).strip():
+        return "", 0.0
+    status = match.group(1).strip()
+    return status, 0.95 if re.fullmatch(r"[A-Z][A-Z ,/\-()]*", status) else 0.6
+
+
+def _parse_serial_number(page_text: str) -> Tuple[str, float]:
+    match = re.search(rf"Serial (?:Number|No\.?):?\s*({SERIAL_NUMBER})", page_text)
+    if match:
+        return match.group(1), 0.95
+    match = re.search(rf"Chronology:.*?({SERIAL_NUMBER})", page_text, re.DOTALL)
+    if match:
+        return match.group(1), 0.85
+    match = re.search(SERIAL_NUMBER, page_text)
+    return (match.group(0), 0.5) if match else ("", 0.0)
+
+
+def _parse_owner(page_text: str) -> Tuple[str, float]:
+    match = re.search(r"Last Reported Owner:[ \t]*\n?[ \t]*([^\n]*)", page_text)
+    if not match or not match.group(1).strip():
+        return "", 0.0
+    owner = match.group(1).strip()
+    if owner.endswith(":"):
+        # The owner block is empty and the next section label was picked up
+        return "", 0.0
+    return owner, 0.9 if re.search(r"[A-Za-z]", owner) else 0.4
+
+
+_PARSERS = {
+    "trademark_name": _parse_trademark_name,
+    "status": _parse_status,
+    "serial_number": _parse_serial_number,
+    "owner": _parse_owner,
+}
+
+
+def parse_code1_fields(page_text: str) -> Dict[str, Tuple[str, float]]:
+    """ (value, confidence) of the name, status, serial number and owner of a code1 record page """
+    return {field: parser(page_text) for field, parser in _PARSERS.items()}
+
+
+def confident_fields(parsed: Dict[str, Tuple[str, float]], min_confidence: float = CODE1_FIELD_MIN_CONFIDENCE) -> Tuple[Dict[str, str], List[str]]:
+    """ Split parsed fields into values good enough to keep and the names of fields still missing """
+    values = {field: value for field, (value, confidence) in parsed.items() if confidence >= min_confidence}
+    return values, [field for field in CODE1_FIELDS if field not in values]
+
+
+class Code1ParseStats:
+    """ How many code1 pages and fields were filled without the LLM, per report """
+
+    COUNTERS = ["pages", "pages_without_llm", "fields_from_parser", "fields_from_llm"]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reports: Dict[str, Dict[str, int]] = {}
+
+    def begin_report(self, report_id: str):
+        """ Count report_id from zero, for a rerun of the same report """
+        with self._lock:
+            self._reports.pop(report_id, None)
+
+    def record(self, missing_fields: List[str], report_id: str = ""):
+        with self._lock:
+            counts = self._reports.setdefault(report_id, dict.fromkeys(self.COUNTERS, 0))
+            counts["pages"] += 1
+            counts["pages_without_llm"] += not missing_fields
+            counts["fields_from_parser"] += len(CODE1_FIELDS) - len(missing_fields)
+            counts["fields_from_llm"] += len(missing_fields)
+
+    def stats(self, report_id: str = "") -> Dict[str, float]:
+        with self._lock:
+            counts = dict(self._reports.get(report_id) or dict.fromkeys(self.COUNTERS, 0))
+        counts["llm_avoidance_rate"] = counts["pages_without_llm"] / counts["pages"] if counts["pages"] else 0.0
+        return counts
+
+
+code1_parse_stats = Code1ParseStats()
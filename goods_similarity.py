@@ -0,0 +1,178 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Union
+
+import numpy as np
+import redis
+
+# Same-class marks whose goods/services are less similar than this to the proposed ones are graded Low without
+# the LLM; 0 keeps every mark
+GOODS_SIMILARITY_PRUNE = float(os.getenv("GOODS_SIMILARITY_PRUNE", 0))
+# Score every existing mark's goods/services against the proposed ones before grading; off by default unless
+# pruning is on, since only then does the score change the report
+GOODS_SIMILARITY = os.getenv("GOODS_SIMILARITY", "1" if GOODS_SIMILARITY_PRUNE else "0") == "1"
+# Grade the most related marks of each scored batch first
+GOODS_SIMILARITY_RANK = os.getenv("GOODS_SIMILARITY_RANK", "1") == "1"
+GOODS_EMBEDDING_MODEL = os.getenv("GOODS_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# Texts per encode call, and records scored together as they stream out of the parser
+GOODS_EMBEDDING_BATCH = int(os.getenv("GOODS_EMBEDDING_BATCH", 64))
+GOODS_EMBEDDING_TTL = int(os.getenv("GOODS_EMBEDDING_TTL", 30 * 24 * 3600))
+GOODS_EMBEDDING_MAX_ENTRIES = int(os.getenv("GOODS_EMBEDDING_MAX_ENTRIES", 8192))
+REDIS_URL = os.getenv("REDIS_URL", "")
+
+# Rationale of a same-class mark pruned for unrelated goods/services
+PRUNED_REASONING = """Reasoning for Conflict:
+- Graded by the goods/services pre-screen, without an LLM review.
+- The goods/services of the existing trademark are {similarity:.0%} similar to those of the proposed trademark, below the {threshold:.0%} pruning threshold, so they are not related.
+- Conflict Grade: Low"""
+
+
+@lru_cache(maxsize=None)
+def get_model(name: str = GOODS_EMBEDDING_MODEL):
+    """ Sentence-transformer on the CPU, loaded once per process; None when it cannot be loaded, so marks go unscored """
+    try:
+        # Imported here: torch takes seconds to load, and only processes that embed should pay for it
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(name, device="cpu")
+    except Exception as e:
+        print(f"Goods/services embedding model {name} unavailable, marks are graded unscored: {e!r}")
+        return None
+
+
+def embedding_key(text: str, model: str = GOODS_EMBEDDING_MODEL) -> str:
+    return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """ Unit-length float32 embeddings by text hash, in an in-process LRU backed by Redis with a TTL """
+
+    def __init__(self, max_entries: int = GOODS_EMBEDDING_MAX_ENTRIES, ttl: int = GOODS_EMBEDDING_TTL, redis_url: str = REDIS_URL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.redis_client = redis.Redis.from_url(redis_url) if redis_url else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, key: str, vector: np.ndarray):
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = vector
+        missing = [key for key in keys if key not in found]
+        if missing and self.redis_client is not None:
+            try:
+                stored = self.redis_client.mget([f"goods_embedding:{key}" for key in missing])
+            except redis.RedisError as e:
+                print(f"Embedding cache Redis read failed: {e}")
+                stored = [None] * len(missing)
+            for key, payload in zip(missing, stored):
+                if payload is not None:
+                    found[key] = np.frombuffer(payload, dtype=np.float32)
+                    self._remember(key, found[key])
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, vectors: Dict[str, np.ndarray]):
+        for key, vector in vectors.items():
+            self._remember(key, vector)
+        if self.redis_client is not None and vectors:
+            try:
+                pipeline = self.redis_client.pipeline()
+                for key, vector in vectors.items():
+                    pipeline.set(f"goods_embedding:{key}", vector.tobytes(), ex=self.ttl)
+                pipeline.execute()
+            except redis.RedisError as e:
+                print(f"Embedding cache Redis write failed: {e}")
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+embedding_cache = EmbeddingCache()
+
+
+def embed_texts(texts: List[str], model: str = GOODS_EMBEDDING_MODEL) -> Union[np.ndarray, None]:
+    """ Unit-length embedding of each text, one row per text; only texts missing from the cache are encoded, in batches
+
+    None when some texts are not cached and the model cannot be loaded.
+    """
+    keys = [embedding_key(text, model) for text in texts]
+    vectors = embedding_cache.get_many(list(dict.fromkeys(keys)))
+    missing = list(dict.fromkeys(text for key, text in zip(keys, texts) if key not in vectors))
+    if missing:
+        encoder = get_model(model)
+        if encoder is None:
+            return None
+        encoded = encoder.encode(missing, batch_size=GOODS_EMBEDDING_BATCH, convert_to_numpy=True, normalize_embeddings=True)
+        fresh = {embedding_key(text, model): vector.astype(np.float32) for text, vector in zip(missing, encoded)}
+        embedding_cache.set_many(fresh)
+        vectors.update(fresh)
+    return np.stack([vectors[key] for key in keys])
+
+
+def goods_similarity(proposed_goods_services: str, goods_services: List[str], model: str = GOODS_EMBEDDING_MODEL) -> Union[np.ndarray, None]:
+    """ Cosine similarity of the proposed goods/services to each of goods_services, from one matrix-vector product
+
+    The embeddings are unit length, so the product is the cosine; empty texts score 0. None when the model is unavailable.
+    """
+    if not goods_services or not proposed_goods_services.strip():
+        return np.zeros(len(goods_services), dtype=np.float32)
+    vectors = embed_texts([proposed_goods_services, *goods_services], model)
+    if vectors is None:
+        return None
+    scores = vectors[1:] @ vectors[0]
+    scores[[not text.strip() for text in goods_services]] = 0.0
+    return scores
+
+
+def score_goods_services(records: Iterable[Dict[str, Union[str, List[int]]]], proposed_goods_services: str, batch_size: int = GOODS_EMBEDDING_BATCH, rank: bool = GOODS_SIMILARITY_RANK) -> Iterator[Dict[str, Union[str, List[int], float]]]:
+    """ Copies of records with "goods_services_similarity" to the proposed goods/services
+
+    Records are scored batch_size at a time as they arrive, and with rank each batch comes out most similar first;
+    records are only ranked within their batch, so grading still starts before parsing ends. The copies leave the
+    parser's records untouched, since the score belongs to this comparison and not to the parsed report. When the
+    model is unavailable the records come out unscored, in order.
+    """
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield from _scored(batch, proposed_goods_services, rank)
+            batch = []
+    if batch:
+        yield from _scored(batch, proposed_goods_services, rank)
+
+
+def _scored(batch: List[Dict[str, Union[str, List[int]]]], proposed_goods_services: str, rank: bool) -> List[Dict[str, Union[str, List[int], float]]]:
+    scores = goods_similarity(proposed_goods_services, [record.get("goods_services", "") for record in batch])
+    if scores is None:
+        return batch
+    scored = [dict(record, goods_services_similarity=round(float(score), 4)) for record, score in zip(batch, scores)]
+    return rank_by_goods_similarity(scored) if rank else scored
+
+
+def rank_by_goods_similarity(records: List[Dict[str, Union[str, List[int], float]]]) -> List[Dict[str, Union[str, List[int], float]]]:
+    """ Records most similar first; unscored records keep their order after the scored ones """
+    return sorted(records, key=lambda record: -record.get("goods_services_similarity", float("-inf")))
+
+
+def pruned_reasoning(similarity: float, threshold: float = GOODS_SIMILARITY_PRUNE) -> str:
+    return PRUNED_REASONING.format(similarity=similarity, threshold=threshold)
@@ -0,0 +1,182 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Union
+
+import redis
+from openai import AsyncAzureOpenAI, AzureOpenAI
+from openai.types.chat import ChatCompletion
+
+from llm_usage import usage_ledger
+from prompt_templates import prompt_cache_stats
+from rate_limiter import estimate_tokens, llm_scheduler
+
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 30 * 24 * 3600))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 4096))
+# "on" reads and writes the cache, "off" bypasses it, "replay" answers only from the cache and never calls the API
+LLM_CACHE_MODE = os.getenv("LLM_CACHE_MODE", "on")
+REDIS_URL = os.getenv("REDIS_URL", "")
+
+# Set while a work item is retried: its response is fetched again and overwrites the cached one instead of being replayed
+cache_refresh = contextvars.ContextVar("llm_cache_refresh", default=False)
+
+
+class LLMCacheMiss(Exception):
+    """ Raised in replay mode for a request that has no cached response """
+
+
+def cache_key(params: Dict) -> str:
+    """ Hash of everything that determines the response: model, messages and sampling parameters """
+    return hashlib.sha256(json.dumps(params, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """ Chat-completion responses in an in-process LRU, backed by Redis with a TTL """
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES, ttl: int = LLM_CACHE_TTL, redis_url: str = REDIS_URL, mode: str = LLM_CACHE_MODE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.mode = mode
+        self.redis_client = redis.Redis.from_url(redis_url) if redis_url else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def _remember(self, key: str, payload: str):
+        with self._lock:
+            self._entries[key] = payload
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def memory_get(self, key: str) -> Union[str, None]:
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+            return payload
+
+    def get(self, key: str) -> Union[str, None]:
+        payload = self.memory_get(key)
+        if payload is not None:
+            return payload
+        if self.redis_client is not None:
+            try:
+                cached = self.redis_client.get(f"llm_cache:{key}")
+            except redis.RedisError as e:
+                print(f"LLM cache Redis read failed: {e}")
+                cached = None
+            if cached is not None:
+                payload = cached.decode("utf-8")
+                self._remember(key, payload)
+                with self._lock:
+                    self.redis_hits += 1
+                return payload
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, payload: str):
+        self._remember(key, payload)
+        if self.redis_client is not None:
+            try:
+                self.redis_client.set(f"llm_cache:{key}", payload, ex=self.ttl)
+            except redis.RedisError as e:
+                print(f"LLM cache Redis write failed: {e}")
+
+    def bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        lookups = self.memory_hits + self.redis_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": (self.memory_hits + self.redis_hits) / lookups if lookups else 0.0,
+        }
+
+
+llm_cache = LLMCache()
+
+
+def _record(response: ChatCompletion, stage: str, site: str, prompt: str, seconds: float):
+    prompt_cache_stats.record(prompt, response.usage, seconds)
+    usage_ledger.record(stage, site, response.model, response.usage, seconds)
+
+
+def _create(client: AzureOpenAI, stage: str, site: str, prompt: str, params: Dict) -> ChatCompletion:
+    start = time.perf_counter()
+    response = client.chat.completions.create(**params)
+    _record(response, stage, site, prompt, time.perf_counter() - start)
+    return response
+
+
+async def _acreate(client: AsyncAzureOpenAI, stage: str, site: str, prompt: str, params: Dict) -> ChatCompletion:
+    start = time.perf_counter()
+    response = await client.chat.completions.create(**params)
+    # The ledger may write to Redis and the log file, so it is kept off the event loop
+    await asyncio.to_thread(_record, response, stage, site, prompt, time.perf_counter() - start)
+    return response
+
+
+def chat_completion(client: AzureOpenAI, cache: bool = True, stage: str = "unstaged", prompt: str = "", **params) -> ChatCompletion:
+    """ client.chat.completions.create(**params) through the response cache and the rate-limit scheduler
+
+    cache=False opts a call site out of the cache; cache misses and uncached calls always go through the scheduler.
+    stage is the pipeline stage the usage of the call is charged to (llm_usage.STAGES), and prompt is the key of
+    the prompt template the messages come from, for the provider prompt-cache stats.
+    """
+    # The calling function is the call site in the usage log
+    site = prompt or sys._getframe(1).f_code.co_name
+    if llm_cache.mode == "replay" and not cache:
+        raise LLMCacheMiss("Uncached call sites cannot run in replay mode")
+    if not cache or llm_cache.mode == "off":
+        llm_cache.bypass()
+        return llm_scheduler.call(lambda: _create(client, stage, site, prompt, params), estimate_tokens(params))
+    key = cache_key(params)
+    payload = llm_cache.get(key) if not cache_refresh.get() or llm_cache.mode == "replay" else None
+    if payload is not None:
+        usage_ledger.record_cached(stage)
+        return ChatCompletion.model_validate_json(payload)
+    if llm_cache.mode == "replay":
+        raise LLMCacheMiss(f"No cached response for request {key}")
+    response = llm_scheduler.call(lambda: _create(client, stage, site, prompt, params), estimate_tokens(params))
+    llm_cache.set(key, response.model_dump_json())
+    return response
+
+
+async def achat_completion(client: AsyncAzureOpenAI, cache: bool = True, stage: str = "unstaged", prompt: str = "", **params) -> ChatCompletion:
+    """ Async chat_completion; the Redis tier is consulted off the event loop """
+    site = prompt or sys._getframe(1).f_code.co_name
+    if llm_cache.mode == "replay" and not cache:
+        raise LLMCacheMiss("Uncached call sites cannot run in replay mode")
+    if not cache or llm_cache.mode == "off":
+        llm_cache.bypass()
+        return await llm_scheduler.acall(lambda: _acreate(client, stage, site, prompt, params), estimate_tokens(params))
+    key = cache_key(params)
+    payload = None
+    if not cache_refresh.get() or llm_cache.mode == "replay":
+        payload = llm_cache.memory_get(key)
+        if payload is None:
+            payload = await asyncio.to_thread(llm_cache.get, key)
+    if payload is not None:
+        await asyncio.to_thread(usage_ledger.record_cached, stage)
+        return ChatCompletion.model_validate_json(payload)
+    if llm_cache.mode == "replay":
+        raise LLMCacheMiss(f"No cached response for request {key}")
+    response = await llm_scheduler.acall(lambda: _acreate(client, stage, site, prompt, params), estimate_tokens(params))
+    await asyncio.to_thread(llm_cache.set, key, response.model_dump_json())
+    return response
@@ -0,0 +1,63 @@
+import asyncio
+import os
+import threading
+from typing import Awaitable, Callable, Coroutine, Iterable, List, TypeVar, Union
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# Requests in flight at once, and seconds allowed for each item before it fails with a TimeoutError
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", 8))
+LLM_ITEM_TIMEOUT = float(os.getenv("LLM_ITEM_TIMEOUT", 120))
+
+_lock = threading.Lock()
+# One long-lived event loop per process, so the async client's connection pool survives between batches
+_loops = {}
+
+
+def _engine_loop() -> asyncio.AbstractEventLoop:
+    pid = os.getpid()
+    loop = _loops.get(pid)
+    if loop is None:
+        with _lock:
+            loop = _loops.get(pid)
+            if loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-engine", daemon=True).start()
+                _loops.clear()
+                _loops[pid] = loop
+    return loop
+
+
+async def map_bounded(worker: Callable[[T], Awaitable[R]], items: Iterable[T], concurrency: int = None, timeout: float = None) -> List[Union[R, Exception]]:
+    """ Run worker over items with at most `concurrency` in flight; results keep the item order
+
+    A failing or timed-out item leaves its exception in its slot instead of cancelling the rest.
+    """
+    items = list(items)
+    concurrency = concurrency or LLM_CONCURRENCY
+    timeout = LLM_ITEM_TIMEOUT if timeout is None else timeout
+    results: List[Union[R, Exception]] = [None] * len(items)
+    queue = asyncio.Queue()
+    for index, item in enumerate(items):
+        queue.put_nowait((index, item))
+
+    async def run_worker():
+        while not queue.empty():
+            index, item = queue.get_nowait()
+            try:
+                results[index] = await asyncio.wait_for(worker(item), timeout)
+            except Exception as e:
+                results[index] = e
+
+    await asyncio.gather(*(run_worker() for _ in range(min(concurrency, len(items)))))
+    return results
+
+
+def run_sync(coroutine: Coroutine) -> R:
+    """ Run a coroutine on the engine loop and wait for it; safe to call from Streamlit and Celery code """
+    return asyncio.run_coroutine_threadsafe(coroutine, _engine_loop()).result()
+
+
+def map_bounded_sync(worker: Callable[[T], Awaitable[R]], items: Iterable[T], concurrency: int = None, timeout: float = None) -> List[Union[R, Exception]]:
+    return run_sync(map_bounded(worker, items, concurrency=concurrency, timeout=timeout))
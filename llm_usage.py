@@ -0,0 +1,138 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Union
+
+import redis
+
+# Per-call usage log, one JSON object per line; empty disables it
+LLM_USAGE_LOG = os.getenv("LLM_USAGE_LOG", "llm_usage.jsonl")
+LLM_USAGE_TTL = int(os.getenv("LLM_USAGE_TTL", 7 * 24 * 3600))
+REDIS_URL = os.getenv("REDIS_URL", "")
+
+# USD per million tokens; the defaults are gpt-4o-mini list prices, where cached prompt tokens cost half
+LLM_PRICE_INPUT = float(os.getenv("LLM_PRICE_INPUT", 0.15))
+LLM_PRICE_CACHED_INPUT = float(os.getenv("LLM_PRICE_CACHED_INPUT", 0.075))
+LLM_PRICE_OUTPUT = float(os.getenv("LLM_PRICE_OUTPUT", 0.60))
+
+STAGES = ["extraction", "class_inference", "same_class_grading", "cross_class_grading"]
+METRICS = ["calls", "cached_responses", "prompt_tokens", "cached_tokens", "completion_tokens", "seconds", "cost"]
+
+# Report that calls made in this context are charged to; begin_report sets it for the calling thread, so concurrent
+# Streamlit sessions keep their own, and Celery tasks set it from their report_id argument
+usage_report = contextvars.ContextVar("llm_usage_report", default="")
+
+
+def call_cost(prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> float:
+    return ((prompt_tokens - cached_tokens) * LLM_PRICE_INPUT + cached_tokens * LLM_PRICE_CACHED_INPUT + completion_tokens * LLM_PRICE_OUTPUT) / 1e6
+
+
+@contextmanager
+def charged_to(report_id: str) -> Iterator[None]:
+    token = usage_report.set(report_id)
+    try:
+        yield
+    finally:
+        usage_report.reset(token)
+
+
+class UsageLedger:
+    """ Token usage, latency and cost of every LLM call, totalled per report and stage, in memory and in Redis
+
+    Calls made by Celery workers reach the app's totals through Redis; every process appends its own calls to the JSONL log.
+    """
+
+    def __init__(self, log_path: str = LLM_USAGE_LOG, ttl: int = LLM_USAGE_TTL, redis_url: str = REDIS_URL):
+        self.log_path = log_path
+        self.ttl = ttl
+        self.redis_client = redis.Redis.from_url(redis_url) if redis_url else None
+        self._totals: Dict[str, Dict[str, Dict[str, float]]] = {}
+        self._lock = threading.Lock()
+
+    def begin_report(self, report_id: str):
+        """ Charge calls made in this context outside any charged_to() block to report_id, starting from zero """
+        usage_report.set(report_id)
+        with self._lock:
+            self._totals.pop(report_id, None)
+        if self.redis_client is not None:
+            try:
+                self.redis_client.delete(f"llm_usage:{report_id}")
+            except redis.RedisError as e:
+                print(f"LLM usage Redis delete failed: {e}")
+
+    def _add(self, report_id: str, stage: str, values: Dict[str, float]):
+        with self._lock:
+            totals = self._totals.setdefault(report_id, {}).setdefault(stage, dict.fromkeys(METRICS, 0))
+            for metric, value in values.items():
+                totals[metric] += value
+        if self.redis_client is not None:
+            try:
+                pipeline = self.redis_client.pipeline()
+                for metric, value in values.items():
+                    pipeline.hincrbyfloat(f"llm_usage:{report_id}", f"{stage}:{metric}", value)
+                pipeline.expire(f"llm_usage:{report_id}", self.ttl)
+                pipeline.execute()
+            except redis.RedisError as e:
+                print(f"LLM usage Redis write failed: {e}")
+
+    def _log(self, entry: Dict[str, Union[str, int, float]]):
+        if not self.log_path:
+            return
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def record(self, stage: str, site: str, model: str, usage, seconds: float):
+        """ One API response; usage is its CompletionUsage """
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+        cost = call_cost(prompt_tokens, cached_tokens, completion_tokens)
+        report_id = usage_report.get()
+        self._add(report_id, stage, {
+            "calls": 1, "prompt_tokens": prompt_tokens, "cached_tokens": cached_tokens,
+            "completion_tokens": completion_tokens, "seconds": seconds, "cost": cost,
+        })
+        self._log({
+            "type": "call", "time": time.time(), "report_id": report_id, "stage": stage, "site": site, "model": model,
+            "prompt_tokens": prompt_tokens, "cached_tokens": cached_tokens, "completion_tokens": completion_tokens,
+            "seconds": round(seconds, 3), "cost": round(cost, 6),
+        })
+
+    def record_cached(self, stage: str):
+        """ A call answered from the LLM response cache: no tokens, but counted so hit rates per stage show up """
+        self._add(usage_report.get(), stage, {"cached_responses": 1})
+
+    def report(self, report_id: str = None) -> Dict[str, Dict[str, float]]:
+        """ Totals of a report (the current one by default) per stage, known stages first, plus a "total" row """
+        report_id = usage_report.get() if report_id is None else report_id
+        with self._lock:
+            stages = {stage: dict(totals) for stage, totals in self._totals.get(report_id, {}).items()}
+        if self.redis_client is not None:
+            try:
+                # Redis also has the calls made by Celery workers, so it replaces the local totals when it is there
+                stored = self.redis_client.hgetall(f"llm_usage:{report_id}")
+            except redis.RedisError as e:
+                print(f"LLM usage Redis read failed: {e}")
+                stored = {}
+            if stored:
+                stages = {}
+                for field, value in stored.items():
+                    stage, metric = field.decode("utf-8").rsplit(":", 1)
+                    stages.setdefault(stage, dict.fromkeys(METRICS, 0))[metric] = float(value)
+        ordered = {stage: stages[stage] for stage in STAGES if stage in stages}
+        ordered.update({stage: totals for stage, totals in stages.items() if stage not in ordered})
+        ordered["total"] = {metric: sum(totals[metric] for totals in ordered.values()) for metric in METRICS}
+        return ordered
+
+    def log_report(self, report_id: str, name: str, seconds: float):
+        """ Append the per-stage totals of a finished report to the JSONL log, for watching regressions across runs """
+        self._log({"type": "report", "time": time.time(), "report_id": report_id, "name": name, "seconds": round(seconds, 3), "stages": self.report(report_id)})
+
+
+usage_ledger = UsageLedger()
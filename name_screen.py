@@ -0,0 +1,152 @@
+import os
+import re
+import threading
+from typing import Dict, List, Set, Union
+
+import numpy as np
+import phonetics
+from fuzzywuzzy import fuzz
+
+# Pairs scoring below this, with no phonetic or primary-position match, are graded Low without the LLM; 0 turns the screen off
+NAME_SCREEN_THRESHOLD = float(os.getenv("NAME_SCREEN_THRESHOLD", 0.6))
+
+# Shortest word counted as the dominant word of a name in a prefix match (SCOOP / SCOOPT'D)
+NAME_SCREEN_MIN_PREFIX = int(os.getenv("NAME_SCREEN_MIN_PREFIX", 3))
+
+# Rationale of a cross-class mark the screen grades Low
+SCREENED_REASONING = """Reasoning for Conflict:
+- Graded by the name pre-screen, without an LLM review.
+- The existing trademark is not in the same class as the proposed trademark.
+- The names do not share their first word or its stem, so the proposed name is not in the primary position of the existing trademark.
+- The names do not sound alike (Double Metaphone and Soundex codes differ).
+- The names are {similarity:.0%} similar at most (token-set ratio {token_set:.0%}, edit similarity {edit_similarity:.0%}), below the {threshold:.0%} screening threshold.
+- Conflict Grade: Low"""
+
+
+def normalize_name(name: str) -> str:
+    """ Upper-case words of a mark, without punctuation: SCOOPT'D -> SCOOPTD, SCOOP-A-PALOOZA -> SCOOP A PALOOZA """
+    name = re.sub(r"['’`]", "", name.upper())
+    return " ".join(re.sub(r"[^A-Z0-9]+", " ", name).split())
+
+
+def edit_similarity(name: str, names: List[str]) -> np.ndarray:
+    """ 1 - Levenshtein distance / longer length, from name to each of names, as one batched dynamic program
+
+    Every name is a row of a padded code-point matrix, so each step of the recurrence runs over all names at once,
+    and the insertion chain along a row is a running minimum instead of a loop over its columns.
+    """
+    if not names:
+        return np.zeros(0)
+    width = max(1, max(len(other) for other in names))
+    codes = np.full((len(names), width), -1, dtype=np.int64)
+    for i, other in enumerate(names):
+        codes[i, :len(other)] = [ord(char) for char in other]
+    lengths = np.array([len(other) for other in names])
+    columns = np.arange(1, width + 1)
+
+    distances = np.tile(np.arange(width + 1), (len(names), 1))
+    for i, char in enumerate(name, start=1):
+        substituted = distances[:, :-1] + (codes != ord(char))
+        deleted = distances[:, 1:] + 1
+        best = np.minimum(substituted, deleted)
+        # Insertions: distances[:, j] = min over k <= j of best[:, k - 1] + j - k, or i + j from the empty prefix
+        inserted = np.minimum.accumulate(best - columns, axis=1)
+        distances = np.concatenate([np.full((len(names), 1), i), columns + np.minimum(i, inserted)], axis=1)
+
+    distance = distances[np.arange(len(names)), lengths]
+    longest = np.maximum(len(name), lengths)
+    return np.where(longest > 0, 1 - distance / np.maximum(longest, 1), 1.0)
+
+
+def _phonetic_codes(word: str) -> Set[str]:
+    """ Double Metaphone codes and Soundex of a word; the library only handles lower-case letters """
+    letters = re.sub(r"[^a-z]", "", word.lower())
+    if not letters:
+        return set()
+    try:
+        codes = {code for code in phonetics.dmetaphone(letters) if code}
+    except IndexError:
+        codes = set()
+    codes.add("S:" + phonetics.soundex(letters).upper())
+    return codes
+
+
+def _primary_position(proposed_words: List[str], existing_words: List[str]) -> bool:
+    """ The prompt's primary-position rule: the first words match, one is the stem of the other, or one name opens the other """
+    if not proposed_words or not existing_words:
+        return False
+    proposed_first, existing_first = proposed_words[0], existing_words[0]
+    if proposed_first == existing_first:
+        return True
+    shorter, longer = sorted([proposed_first, existing_first], key=len)
+    if len(shorter) >= NAME_SCREEN_MIN_PREFIX and longer.startswith(shorter):
+        return True
+    proposed, existing = " ".join(proposed_words), " ".join(existing_words)
+    return existing.startswith(proposed + " ") or proposed.startswith(existing + " ")
+
+
+def screen_names(proposed_name: str, existing_names: List[str], threshold: float = NAME_SCREEN_THRESHOLD) -> List[Dict[str, Union[float, bool]]]:
+    """ Similarity of the proposed name to each existing name, and whether the pair is clear enough to grade Low unread
+
+    similarity is the larger of the token-set ratio and the edit similarity; a pair is "clear" when it is below
+    threshold, neither sounds alike nor shares the primary position, and the existing name is not empty.
+    """
+    proposed = normalize_name(proposed_name)
+    existing = [normalize_name(name) for name in existing_names]
+    proposed_words = proposed.split()
+    proposed_codes = _phonetic_codes(proposed)
+    proposed_first_codes = _phonetic_codes(proposed_words[0]) if proposed_words else set()
+    edit = edit_similarity(proposed, existing)
+
+    scores = []
+    for name, edit_score in zip(existing, edit):
+        words = name.split()
+        token_set = fuzz.token_set_ratio(proposed, name) / 100 if proposed and name else 0.0
+        phonetic_match = bool(proposed_codes & _phonetic_codes(name)) or bool(words and proposed_first_codes & _phonetic_codes(words[0]))
+        primary_position = _primary_position(proposed_words, words)
+        similarity = max(token_set, float(edit_score))
+        scores.append({
+            "token_set": token_set,
+            "edit_similarity": float(edit_score),
+            "phonetic_match": phonetic_match,
+            "primary_position": primary_position,
+            "similarity": similarity,
+            # A mark whose name did not parse is left to the LLM
+            "clear": bool(name) and similarity < threshold and not phonetic_match and not primary_position,
+        })
+    return scores
+
+
+def screened_reasoning(score: Dict[str, Union[float, bool]], threshold: float = NAME_SCREEN_THRESHOLD) -> str:
+    return SCREENED_REASONING.format(threshold=threshold, **score)
+
+
+class NameScreenStats:
+    """ How many cross-class marks the name pre-screen graded without an LLM call, per report """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reports: Dict[str, Dict[str, int]] = {}
+
+    def begin_report(self, report_id: str):
+        """ Count report_id from zero, for a rerun of the same report """
+        with self._lock:
+            self._reports.pop(report_id, None)
+
+    def record(self, marks: int, screened: int, report_id: str = ""):
+        with self._lock:
+            counts = self._reports.setdefault(report_id, {"marks": 0, "screened": 0})
+            counts["marks"] += marks
+            counts["screened"] += screened
+
+    def stats(self, report_id: str = "") -> Dict[str, float]:
+        with self._lock:
+            counts = dict(self._reports.get(report_id) or {"marks": 0, "screened": 0})
+        return {
+            "marks": counts["marks"],
+            "llm_calls_avoided": counts["screened"],
+            "llm_avoidance_rate": counts["screened"] / counts["marks"] if counts["marks"] else 0.0,
+        }
+
+
+name_screen_stats = NameScreenStats()
@@ -0,0 +1,205 @@
+import os
+import re
+import sys
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Set, Tuple, Union
+
+import fitz  # PyMuPDF
+
+from text_extractor import DEFAULT_EXTRACTOR, PageBlocks, TextExtractor
+
+
+# Large enough to keep a full 400-page search report resident, so every page is decoded once
+DEFAULT_MAX_PAGES = 512
+
+# Bounded-memory mode: keep at most this many pages resident (0 disables the window)
+PDF_WINDOW_PAGES = int(os.getenv("PDF_WINDOW_PAGES", 0))
+
+# The furthest any extractor reads past a record's first page (extract_design_phrase), plus the page itself
+LOOKAHEAD_PAGES = 8
+MIN_WINDOW_PAGES = LOOKAHEAD_PAGES + 1
+
+# Top / bottom share of the page height in which repeated blocks count as header or footer
+HEADER_FOOTER_BAND = 0.15
+
+# A block is a header / footer when its text (digits ignored) repeats in the band on this share of pages
+HEADER_FOOTER_MIN_SHARE = 0.5
+
+# Worker count for parallel extraction, and the page count below which extraction stays single-process
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", os.cpu_count() or 1))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 300))
+
+
+def peak_rss_mb() -> Union[float, None]:
+    """ Peak resident set size of this process so far, in MB (None where the resource module is unavailable) """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes everywhere else
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _open_pdf(source: Union[str, bytes]) -> fitz.Document:
+    if isinstance(source, (bytes, bytearray)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+
+def page_blocks(page: fitz.Page, extractor: TextExtractor = None) -> PageBlocks:
+    """ Decode a page once into its text blocks; both text views are derived from these """
+    return (extractor or DEFAULT_EXTRACTOR).page_blocks(page)
+
+
+def _block_signature(block_text: str) -> str:
+    # Page numbers and dates change from page to page, the rest of a running header does not
+    return re.sub(r"\d+", "#", " ".join(block_text.split()))
+
+
+def _in_band(height: float, top: float, bottom: float) -> bool:
+    return bottom <= height * HEADER_FOOTER_BAND or top >= height * (1 - HEADER_FOOTER_BAND)
+
+
+def detect_header_footer(pages: Iterable[PageBlocks]) -> Set[str]:
+    """ Signatures of blocks repeated near the top or bottom edge of at least HEADER_FOOTER_MIN_SHARE of the pages """
+    counts = Counter()
+    page_count = 0
+    for height, blocks in pages:
+        page_count += 1
+        counts.update({_block_signature(text) for top, bottom, text in blocks if _in_band(height, top, bottom)})
+    threshold = max(2, page_count * HEADER_FOOTER_MIN_SHARE)
+    return {signature for signature, count in counts.items() if count >= threshold}
+
+
+def full_text(blocks: PageBlocks) -> str:
+    """ Same text as page.get_text() with the default "blocks" backend """
+    return "".join(text for top, bottom, text in blocks[1])
+
+
+def body_text(blocks: PageBlocks, header_footer: Set[str]) -> str:
+    height, text_blocks = blocks
+    return "".join(text for top, bottom, text in text_blocks if not (_in_band(height, top, bottom) and _block_signature(text) in header_footer))
+
+
+def _extract_page_range(source: Union[str, bytes], start_page: int, stop_page: int, extractor: TextExtractor = None) -> List[PageBlocks]:
+    """ Worker: open a private copy of the document and decode the blocks of pages [start_page, stop_page) """
+    with _open_pdf(source) as pdf_document:
+        return [page_blocks(pdf_document.load_page(page_num), extractor) for page_num in range(start_page, stop_page)]
+
+
+def extract_page_blocks(source: Union[str, bytes], workers: int = None, min_pages: int = None, extractor: TextExtractor = None) -> List[PageBlocks]:
+    """ Decode the blocks of every page in page order, splitting large documents across a process pool """
+    workers = workers or PDF_EXTRACT_WORKERS
+    min_pages = PDF_PARALLEL_MIN_PAGES if min_pages is None else min_pages
+
+    with _open_pdf(source) as pdf_document:
+        page_count = pdf_document.page_count
+    if workers <= 1 or page_count < min_pages:
+        return _extract_page_range(source, 0, page_count, extractor)
+
+    # One contiguous page range per worker keeps the number of document opens equal to the worker count
+    step = -(-page_count // workers)
+    ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+    with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [executor.submit(_extract_page_range, source, start, stop, extractor) for start, stop in ranges]
+        pages = []
+        for future in futures:
+            pages.extend(future.result())
+    return pages
+
+
+def extract_dual_views(source: Union[str, bytes], workers: int = None, min_pages: int = None, extractor: TextExtractor = None) -> Tuple[List[str], List[str]]:
+    """ Full text and header/footer-excluded text of every page, from a single decode per page """
+    pages = extract_page_blocks(source, workers=workers, min_pages=min_pages, extractor=extractor)
+    header_footer = detect_header_footer(pages)
+    return [full_text(blocks) for blocks in pages], [body_text(blocks, header_footer) for blocks in pages]
+
+
+def extract_page_texts(source: Union[str, bytes], exclude_header_footer: bool = False, workers: int = None, min_pages: int = None, extractor: TextExtractor = None) -> List[str]:
+    """ Text of every page in page order, optionally with repeated headers and footers removed """
+    full_texts, body_texts = extract_dual_views(source, workers=workers, min_pages=min_pages, extractor=extractor)
+    return body_texts if exclude_header_footer else full_texts
+
+
+class PageTextStore:
+    """ Per-document cache of page text, so each page is decoded once and shared by every extractor """
+
+    def __init__(self, pdf_document: fitz.Document, max_pages: int = None, extractor: TextExtractor = None):
+        self.pdf_document = pdf_document
+        self.extractor = extractor or DEFAULT_EXTRACTOR
+        self.page_count = pdf_document.page_count
+        if max_pages is None:
+            max_pages = max(PDF_WINDOW_PAGES, MIN_WINDOW_PAGES) if PDF_WINDOW_PAGES else DEFAULT_MAX_PAGES
+        self.max_pages = max_pages
+        # With fewer slots than pages, pages behind the parser are released as soon as their records are emitted
+        self.bounded = max_pages < self.page_count
+        self._pages = OrderedDict()
+        self._header_footer = None
+
+    def _entry(self, page_num: int) -> dict:
+        entry = self._pages.get(page_num)
+        if entry is None:
+            entry = {}
+            self._pages[page_num] = entry
+            if len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+        else:
+            self._pages.move_to_end(page_num)
+        return entry
+
+    def blocks(self, page_num: int) -> PageBlocks:
+        entry = self._entry(page_num)
+        if "blocks" not in entry:
+            entry["blocks"] = page_blocks(self.pdf_document.load_page(page_num), self.extractor)
+        return entry["blocks"]
+
+    def text(self, page_num: int) -> str:
+        """ Plain text of a page, identical to page.get_text() with the default backend """
+        entry = self._entry(page_num)
+        if "text" not in entry:
+            entry["text"] = full_text(self.blocks(page_num))
+        return entry["text"]
+
+    def header_footer(self) -> Set[str]:
+        """ Header / footer block signatures of the document, detected once across all pages """
+        if self._header_footer is None:
+            self._header_footer = detect_header_footer(self.blocks(page_num) for page_num in range(self.page_count))
+        return self._header_footer
+
+    def clipped_text(self, page_num: int) -> str:
+        """ Text of a page with the repeated header and footer blocks excluded """
+        header_footer = self.header_footer()
+        entry = self._entry(page_num)
+        if "clipped" not in entry:
+            entry["clipped"] = body_text(self.blocks(page_num), header_footer)
+        return entry["clipped"]
+
+    def release_before(self, page_num: int):
+        """ Drop every cached page before page_num """
+        for cached_page in [cached_page for cached_page in self._pages if cached_page < page_num]:
+            del self._pages[cached_page]
+
+    def preload(self, source: Union[str, bytes] = None, workers: int = None, min_pages: int = None):
+        """ Decode the whole document up front, in parallel for large reports """
+        workers = workers or PDF_EXTRACT_WORKERS
+        min_pages = PDF_PARALLEL_MIN_PAGES if min_pages is None else min_pages
+        if workers <= 1 or self.page_count < min_pages or self.bounded:
+            # Small reports are cheaper to decode lazily, and a bounded store could not hold the result
+            return
+        if source is None:
+            # Workers need something picklable to reopen: the file path, or the in-memory bytes
+            source = self.pdf_document.name or self.pdf_document.tobytes()
+        for page_num, blocks in enumerate(extract_page_blocks(source, workers=workers, min_pages=min_pages, extractor=self.extractor)):
+            self._entry(page_num)["blocks"] = blocks
+
+    def text_range(self, start_page: int, max_pages: int, stop_marker: str = None) -> str:
+        """ Concatenated text of up to max_pages pages from start_page, stopping after the page containing stop_marker """
+        combined_text = ""
+        for i in range(start_page, min(start_page + max_pages, self.page_count)):
+            page_text = self.text(i)
+            combined_text += page_text
+            if stop_marker and stop_marker in page_text:
+                break
+        return combined_text
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import time
+import zlib
+from typing import Dict, List, Union
+
+import redis
+
+
+# Bump whenever the parser output for the same PDF can change, so stale entries are never served
+PARSER_VERSION = "6.2-1"
+
+PARSE_CACHE_DIR = os.getenv("PARSE_CACHE_DIR", ".parse_cache")
+PARSE_CACHE_TTL = int(os.getenv("PARSE_CACHE_TTL", 7 * 24 * 3600))
+PARSE_CACHE_MAX_ENTRIES = int(os.getenv("PARSE_CACHE_MAX_ENTRIES", 500))
+REDIS_URL = os.getenv("REDIS_URL", "")
+
+
+def cache_key(pdf_bytes: bytes) -> str:
+    """ Content address of a report: SHA-256 of the PDF bytes plus the parser version """
+    return f"{hashlib.sha256(pdf_bytes).hexdigest()}-{PARSER_VERSION}"
+
+
+def _dumps(trademarks: List[Dict[str, Union[str, List[int]]]]) -> bytes:
+    return zlib.compress(json.dumps(trademarks, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+
+
+def _loads(payload: bytes) -> List[Dict[str, Union[str, List[int]]]]:
+    return json.loads(zlib.decompress(payload).decode("utf-8"))
+
+
+class ParseCache:
+    """ Two-tier (local disk, then Redis) cache of parsed existing trademarks, keyed by report content """
+
+    def __init__(self, cache_dir: str = PARSE_CACHE_DIR, ttl: int = PARSE_CACHE_TTL, max_entries: int = PARSE_CACHE_MAX_ENTRIES, redis_url: str = REDIS_URL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.redis_client = redis.Redis.from_url(redis_url) if redis_url else None
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json.z")
+
+    def _disk_get(self, key: str) -> Union[bytes, None]:
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, "rb") as f:
+                payload = f.read()
+            # Access time drives LRU eviction; mtime keeps the TTL anchored to the write
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+            return payload
+        except OSError:
+            return None
+
+    def _disk_set(self, key: str, payload: bytes):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self._path(key) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, self._path(key))
+
+        entries = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith(".json.z")]
+        if len(entries) > self.max_entries:
+            entries.sort(key=os.path.getatime)
+            for path in entries[:len(entries) - self.max_entries]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _redis_get(self, key: str) -> Union[bytes, None]:
+        if self.redis_client is None:
+            return None
+        try:
+            return self.redis_client.get(f"parse_cache:{key}")
+        except redis.RedisError as e:
+            print(f"Parse cache Redis read failed: {e}")
+            return None
+
+    def _redis_set(self, key: str, payload: bytes):
+        if self.redis_client is None:
+            return
+        try:
+            self.redis_client.set(f"parse_cache:{key}", payload, ex=self.ttl)
+        except redis.RedisError as e:
+            print(f"Parse cache Redis write failed: {e}")
+
+    def get(self, pdf_bytes: bytes) -> Union[List[Dict[str, Union[str, List[int]]]], None]:
+        key = cache_key(pdf_bytes)
+        payload = self._disk_get(key)
+        if payload is None:
+            payload = self._redis_get(key)
+            if payload is None:
+                return None
+            # Promote Redis hits to the local tier so the next run skips the network too
+            self._disk_set(key, payload)
+        return _loads(payload)
+
+    def set(self, pdf_bytes: bytes, trademarks: List[Dict[str, Union[str, List[int]]]]):
+        key = cache_key(pdf_bytes)
+        payload = _dumps(trademarks)
+        self._disk_set(key, payload)
+        self._redis_set(key, payload)
@@ -0,0 +1,208 @@
+import threading
+from typing import Dict, List, Sequence, Union
+
+SAME_CLASS_ROLE = """You are an experienced Trademark Attorney specializing in trademark law and intellectual property rights. You hold a Juris Doctor (J.D.) degree and have over 10 years of experience in conducting comprehensive trademark searches, analyzing potential conflicts, and advising clients on trademark strategies. Your expertise includes assessing the likelihood of confusion between trademarks, understanding trademark classifications, and providing detailed legal opinions.
+Role: As a Trademark Attorney, your task is to analyze existing trademark and proposed trademark.
+"""
+
+CROSS_CLASS_ROLE = """You are a trademark attorney tasked with determining a conflict grade based on the given conditions. You should assign a conflict grade of "Name-Match" or "Low" to the existing trademark and respond with only "Name-Match", or "Low".
+Conditions for Determining Conflict Grades:
+"""
+
+GRADING_INSTRUCTIONS = """Condition 1: Trademark Name Comparison
+- Condition 1A: Are the existing trademark name and the proposed trademark name in conflict with respect to Distinctiveness, Strength of the Marks, and Similarity in Appearance, Sound, and Meaning?
+
+If the existing trademark in the user-provided input satisfies:
+- Special Case: If the existing trademark status is "Cancelled" or "Abandoned," it will automatically be considered a conflict grade of "Low," but you should still provide reasoning for any potential conflicts.
+- If the existing trademark satisfies Condition 1A, then the conflict grade should be "Name-Match."
+- If the existing trademark does not satisfy Condition 1A, then the conflict grade should be "Low."
+
+Format of the Response:
+Reasoning for Conflict: Provide reasoning for the conflict in bullet points. In your reasoning, if the goods, services, and industries are exactly the same, list the overlaps. You should determine whether the goods/services overlap, including classes (whether they are the same as the proposed trademark or not). Consider whether the trademark names are identical (character-for-character matches), phonetic equivalents, if the name is in the primary position (first word in the phrase), or if it is not in the primary position of the existing trademark. If it is not in the primary position, it is not conflicting. Also, consider standard plural forms for subject goods and whether the goods may be related or not. Reasoning should be based on the provided information. Do not provide any hypothetical reasoning.
+Note: Also mention if the existing trademark and the proposed trademark are not in the same Class number in the Reasoning for Conflict.
+
+Step 0: Identifying Potential Conflicts
+- What is the existing trademark?
+- What is the status of the existing trademark?
+- What is the proposed trademark?
+
+Step 1: Check the Status of the Existing Trademark:
+- If the existing trademark is "Cancelled" or "Expired" or "Abandoned," assign the conflict grade as "Low." And skip other conditions.
+
+Step 2: **Trademark Name Comparison:**
+- Evaluate if there is a conflict between the existing trademark name and the proposed trademark name based on the following:
+    - **Distinctiveness and Strength of the Marks:** Are the trademarks distinctive or similar in strength?
+    - **Similarity in Appearance, Sound, and Meaning:** Do the names look, sound, or mean the same?
+
+Step 3: **Consider Special Cases and Additional Factors:**
+- Consider standard plural forms for the subject goods and whether goods may be related or not.
+- If there is no similarity in name, class, or overlapping goods/services, assign the conflict grade "Low."
+
+Format of the Response:
+- **Reasoning for Conflict:** Provide reasoning in bullet points. Base your reasoning only on the provided information. Clearly mention if the existing and proposed trademarks are not in the same Class number.
+
+Note:
+- Do not provide any hypothetical reasoning. The conflict grade should be based solely on the facts given.
+
+Example Analysis Using the Steps :
+- Trademark Name: Unlock Brisk's Bold Flavors
+- Trademark Status: REGISTERED
+- Proposed Trademark: Unlock Hidden Flavors
+
+Reasoning for Conflict:
+Step 1: Status Check:
+- The existing trademark status is not "Cancelled" or "Expired" or "Abandoned,". Proceeding to name comparison.
+
+Step 2: Trademark Name Comparison:
+- Both trademarks share the distinctive word "Unlock" in the primary position, which creates a similarity in appearance, sound, and meaning.
+- The phrase "Unlock Flavors" forms the core part of both trademarks, creating a strong conceptual similarity.
+- While the words "Brisk's Bold" and "Hidden" differ, they serve as modifiers to the common term "Flavors." The similarity is substantial because the focus of both trademarks is on the concept of "Unlocking Flavors," which could confuse consumers regarding the source or affiliation of the products/services.
+
+Step 3: No special cases apply (such as status being "Cancelled" or "Abandoned").
+
+Conflict Reason:
+Reasoning for Conflict:
+The shared use of the distinctive phrase "Unlock Flavors" as the primary conceptual focus in both trademarks creates a strong similarity in appearance, sound, and meaning. This overlap is significant enough to potentially confuse consumers about the source or affiliation of the goods or services, thereby assigning the conflict grade as "Name-Match."
+
+- Conflict Grade: Name-Match
+"""
+
+GRADING_EXAMPLE_ANSWER = """Reasoning for Conflict:
+Step 1: Status Check:
+- The existing trademark status is not "Cancelled," "Expired," or "Abandoned." Proceeding to name comparison.
+
+Step 2: Trademark Name Comparison:
+- Both trademarks share the distinctive word "SCOOP," which creates a similarity in appearance, sound, and meaning.
+- The word "SCOOP" is the dominant and distinctive part of both trademarks, leading to a conceptual similarity.
+- The existing trademark "SCOOPT'D" and the proposed trademark "SCOOP-A-PALOOZA" both emphasize the idea of "Scoop," likely related to ice cream or a similar product, which could confuse consumers regarding the source or affiliation.
+- The additional elements ("T'D" and "A-PALOOZA") differ but serve as suffixes or modifiers to the common term "SCOOP."
+
+Step 3: No special cases apply (such as status being "Cancelled" or "Abandoned").
+
+Conflict Reason:
+Reasoning for Conflict:
+The shared use of the distinctive word "SCOOP" as the core focus in both trademarks creates a strong similarity in appearance, sound, and meaning. This overlap is significant enough to potentially confuse consumers about the source or affiliation of the goods or services, thereby assigning the conflict grade as "Name-Match."
+
+- Conflict Grade: Name-Match
+"""
+
+COMPARISON_REQUEST = """Compare the following existing and proposed trademarks and determine the conflict grade.
+
+Existing Trademark:
+Name: {existing_name}
+Status: {existing_status}
+
+Proposed Trademark:
+Name: {proposed_name}
+"""
+
+BATCH_COMPARISON_REQUEST = """Compare each of the following existing trademarks with the proposed trademark and determine the conflict grade of each one on its own, following the same steps.
+
+Existing Trademarks:
+{existing_trademarks}
+
+Proposed Trademark:
+Name: {proposed_name}
+
+Respond with one entry per existing trademark, in the order listed, each with the serial number exactly as listed, its conflict grade, and its reasoning for conflict in bullet points.
+"""
+
+# One existing trademark in BATCH_COMPARISON_REQUEST
+BATCH_TRADEMARK_ENTRY = """- Serial Number: {serial_number}
+  Name: {existing_name}
+  Status: {existing_status}"""
+
+
+class PromptTemplate:
+    """ Chat messages whose prefix is fixed byte for byte and whose last user message carries all per-call data
+
+    Azure OpenAI reuses the longest prompt prefix it has already seen (from 1024 tokens, in 128-token steps), so
+    nothing that varies between calls may come before the last message. Any change to the text of a template
+    goes with a new version.
+    """
+
+    def __init__(self, name: str, version: int, prefix: Sequence[Dict[str, str]], request: str):
+        self.name = name
+        self.version = version
+        self.prefix = tuple(dict(message) for message in prefix)
+        self.request = request
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}@{self.version}"
+
+    def messages(self, **fields: str) -> List[Dict[str, str]]:
+        # Copies of the prefix, so no caller can change it for the next one
+        return [dict(message) for message in self.prefix] + [{"role": "user", "content": self.request.format(**fields)}]
+
+
+_TEMPLATES: Dict[str, Dict[int, PromptTemplate]] = {}
+
+
+def register(template: PromptTemplate) -> PromptTemplate:
+    versions = _TEMPLATES.setdefault(template.name, {})
+    if template.version in versions:
+        raise ValueError(f"Prompt template {template.key} is already registered")
+    versions[template.version] = template
+    return template
+
+
+def get_prompt(name: str, version: int = None) -> PromptTemplate:
+    """ A registered template, the latest version unless one is asked for """
+    versions = _TEMPLATES[name]
+    return versions[max(versions) if version is None else version]
+
+
+def grading_prefix(role: str) -> List[Dict[str, str]]:
+    """ System instructions and the SCOOPT'D / SCOOP-A-PALOOZA worked example shared by the grading prompts """
+    return [
+        {"role": "system", "content": f"{role}\n{GRADING_INSTRUCTIONS}"},
+        {"role": "user", "content": COMPARISON_REQUEST.format(existing_name="SCOOPT'D", existing_status="Registered", proposed_name="SCOOP-A-PALOOZA")},
+        {"role": "assistant", "content": GRADING_EXAMPLE_ANSWER},
+    ]
+
+
+register(PromptTemplate("same_class_grade", 1, grading_prefix(SAME_CLASS_ROLE), COMPARISON_REQUEST))
+register(PromptTemplate("cross_class_grade", 1, grading_prefix(CROSS_CLASS_ROLE), COMPARISON_REQUEST))
+# Same prefix as same_class_grade, so single and batched requests share Azure's cached prefix
+register(PromptTemplate("same_class_grade_batch", 1, grading_prefix(SAME_CLASS_ROLE), BATCH_COMPARISON_REQUEST))
+
+
+class PromptCacheStats:
+    """ Per template: prompt tokens sent, how many of them Azure served from its prompt cache, and request latency
+    with and without a cache hit
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._prompts: Dict[str, Dict[str, Union[int, float]]] = {}
+
+    def record(self, prompt: str, usage, seconds: float):
+        """ Record one API response; usage is its CompletionUsage, whose cached_tokens is absent on older API versions """
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+        with self._lock:
+            entry = self._prompts.setdefault(prompt or "untemplated", {
+                "calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "cache_hits": 0, "hit_seconds": 0.0, "miss_seconds": 0.0,
+            })
+            entry["calls"] += 1
+            entry["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+            entry["cached_tokens"] += cached_tokens
+            if cached_tokens:
+                entry["cache_hits"] += 1
+                entry["hit_seconds"] += seconds
+            else:
+                entry["miss_seconds"] += seconds
+
+    def stats(self) -> Dict[str, Dict[str, Union[int, float]]]:
+        with self._lock:
+            prompts = {prompt: dict(entry) for prompt, entry in self._prompts.items()}
+        for entry in prompts.values():
+            misses = entry["calls"] - entry["cache_hits"]
+            entry["cached_ratio"] = entry["cached_tokens"] / entry["prompt_tokens"] if entry["prompt_tokens"] else 0.0
+            entry["mean_hit_seconds"] = entry.pop("hit_seconds") / entry["cache_hits"] if entry["cache_hits"] else 0.0
+            entry["mean_miss_seconds"] = entry.pop("miss_seconds") / misses if misses else 0.0
+        return prompts
+
+
+prompt_cache_stats = PromptCacheStats()
@@ -0,0 +1,189 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Dict, TypeVar, Union
+
+import openai
+
+from chunk_packer import count_tokens
+
+R = TypeVar("R")
+
+# Quota of the deployment as seen by this process (divide it between processes sharing one deployment)
+AZURE_TPM_LIMIT = int(os.getenv("AZURE_TPM_LIMIT", 200000))
+AZURE_RPM_LIMIT = int(os.getenv("AZURE_RPM_LIMIT", 1200))
+
+# Azure enforces the per-minute quota over short windows, so a full minute's quota must not go out in one burst
+LLM_BURST_SECONDS = float(os.getenv("LLM_BURST_SECONDS", 10))
+
+# AIMD bounds on requests in flight: +1 per window of successes, halved on a throttle
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", 1))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 32))
+LLM_AIMD_DECREASE = float(os.getenv("LLM_AIMD_DECREASE", 0.5))
+
+# Attempts per request for throttles and transient errors, and the wait used when no Retry-After is sent
+LLM_SCHEDULER_ATTEMPTS = int(os.getenv("LLM_SCHEDULER_ATTEMPTS", 6))
+LLM_DEFAULT_RETRY_AFTER = float(os.getenv("LLM_DEFAULT_RETRY_AFTER", 2))
+
+# Azure reserves max_tokens against the TPM quota when a request is admitted; this stands in when none is set
+DEFAULT_MAX_TOKENS_ESTIMATE = 1000
+
+_TRANSIENT_ERRORS = (openai.APIConnectionError, openai.InternalServerError)
+_encoder_available = True
+
+
+def text_tokens(text: str) -> int:
+    """ Token count of text, or an estimate of it when the tokenizer cannot be loaded """
+    global _encoder_available
+    if _encoder_available:
+        try:
+            return count_tokens(text)
+        except Exception:
+            # No tokenizer files offline; fall back to the usual four characters per token
+            _encoder_available = False
+    return len(text) // 4
+
+
+def estimate_tokens(params: Dict) -> int:
+    """ Tokens Azure counts against the TPM quota for a chat request: the prompt plus max_tokens """
+    text = "".join(str(message.get("content", "")) for message in params.get("messages", []))
+    return text_tokens(text) + 4 * len(params.get("messages", [])) + (params.get("max_tokens") or DEFAULT_MAX_TOKENS_ESTIMATE)
+
+
+def retry_after_seconds(error: openai.APIStatusError) -> float:
+    headers = error.response.headers if error.response is not None else {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return LLM_DEFAULT_RETRY_AFTER
+
+
+class TokenBucket:
+    """ Refills continuously at per_minute / 60 per second, holding at most burst_seconds worth """
+
+    def __init__(self, per_minute: int, burst_seconds: float = LLM_BURST_SECONDS):
+        self.rate = per_minute / 60
+        self.capacity = self.rate * burst_seconds
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount: int, now: float) -> float:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        # A request larger than the whole bucket only waits for a full bucket
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: int):
+        self.level -= amount
+
+
+class RateLimitScheduler:
+    """ Admits LLM requests within TPM / RPM token buckets and an AIMD concurrency limit, retrying throttles """
+
+    def __init__(self, tpm: int = AZURE_TPM_LIMIT, rpm: int = AZURE_RPM_LIMIT, min_concurrency: int = LLM_MIN_CONCURRENCY, max_concurrency: int = LLM_MAX_CONCURRENCY, burst_seconds: float = LLM_BURST_SECONDS):
+        self._lock = threading.Lock()
+        self.tokens = TokenBucket(tpm, burst_seconds)
+        self.requests = TokenBucket(rpm, burst_seconds)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.limit = float(min(max_concurrency, max(min_concurrency, 8)))
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self._last_decrease = 0.0
+        self.completed = 0
+        self.throttled = 0
+        self.retried = 0
+
+    def _admit(self, estimate: int) -> float:
+        """ Reserve capacity for one request and return 0, or return how long to wait before trying again """
+        with self._lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.in_flight >= int(self.limit):
+                return 0.05
+            wait = max(self.tokens.wait_time(estimate, now), self.requests.wait_time(1, now))
+            if wait > 0:
+                return wait
+            self.tokens.take(estimate)
+            self.requests.take(1)
+            self.in_flight += 1
+            return 0.0
+
+    def _release(self, outcome: str, retry_after: float = 0.0):
+        with self._lock:
+            now = time.monotonic()
+            self.in_flight -= 1
+            if outcome == "ok":
+                self.completed += 1
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            elif outcome == "throttled":
+                self.throttled += 1
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+                # Requests already in flight when the quota ran out all come back throttled; that is one decrease, not many
+                if now - self._last_decrease > retry_after:
+                    self.limit = max(self.min_concurrency, self.limit * LLM_AIMD_DECREASE)
+                    self._last_decrease = now
+
+    def _outcome(self, error: Exception, attempt: int):
+        """ Release a failed attempt and return the seconds to wait before retrying it, or raise it when it is final """
+        if isinstance(error, openai.RateLimitError):
+            retry_after = retry_after_seconds(error)
+            self._release("throttled", retry_after)
+        elif isinstance(error, _TRANSIENT_ERRORS):
+            self._release("failed")
+            retry_after = min(30.0, 2 ** attempt) * random.uniform(0.5, 1.0)
+        else:
+            self._release("failed")
+            raise error
+        if attempt + 1 >= LLM_SCHEDULER_ATTEMPTS:
+            raise error
+        with self._lock:
+            self.retried += 1
+        return retry_after
+
+    def call(self, request: Callable[[], R], estimate: int) -> R:
+        for attempt in range(LLM_SCHEDULER_ATTEMPTS):
+            wait = self._admit(estimate)
+            while wait:
+                time.sleep(wait)
+                wait = self._admit(estimate)
+            try:
+                response = request()
+            except Exception as e:
+                time.sleep(self._outcome(e, attempt))
+                continue
+            self._release("ok")
+            return response
+
+    async def acall(self, request: Callable[[], Awaitable[R]], estimate: int) -> R:
+        for attempt in range(LLM_SCHEDULER_ATTEMPTS):
+            wait = self._admit(estimate)
+            while wait:
+                await asyncio.sleep(wait)
+                wait = self._admit(estimate)
+            try:
+                response = await request()
+            except Exception as e:
+                await asyncio.sleep(self._outcome(e, attempt))
+                continue
+            self._release("ok")
+            return response
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        return {
+            "completed": self.completed,
+            "throttled": self.throttled,
+            "retried": self.retried,
+            "concurrency_limit": round(self.limit, 2),
+        }
+
+
+llm_scheduler = RateLimitScheduler()
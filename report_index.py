@@ -0,0 +1,120 @@
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, FrozenSet, List, Tuple, Union
+
+from page_store import PageTextStore
+
+
+# Section markers looked up once per page while the index is built
+SECTION_MARKERS = {
+    "status": "Status:",
+    "goods_services": "Goods/Services:",
+    "last_reported_owner": "Last Reported Owner:",
+    "filing_correspondent": "Filing Correspondent:",
+    "chronology": "Chronology:",
+    "uspto_summary": "USPTO Summary Page",
+    "analyst_review": "ANALYST REVIEW −USPTO REPORT",
+    "register": "Register",
+    "nice_classes": "Nice Classes",
+    "goods_and_services": "Goods & Services",
+}
+
+CODE1 = "code1"  # USPTO search report record page
+CODE2 = "code2"  # Global "Nice Classes" record page
+
+CODE1_SECTIONS = frozenset(["status", "goods_services"])  # same fields as is_correct_format_code1
+CODE2_SECTIONS = frozenset(["register", "nice_classes", "goods_and_services"])  # same fields as is_correct_format_code2
+
+
+def page_sections(page_text: str) -> FrozenSet[str]:
+    return frozenset(name for name, marker in SECTION_MARKERS.items() if marker in page_text)
+
+
+def sections_format(sections: FrozenSet[str]) -> Union[str, None]:
+    if CODE1_SECTIONS <= sections:
+        return CODE1
+    if CODE2_SECTIONS <= sections:
+        return CODE2
+    return None
+
+
+class ReportIndex:
+    """ One-pass index of a search report: per-page format and sections, and the page range of every record
+
+    A lazy index reads pages through the page store only as far as extend() or a lookahead query asks, so in a
+    bounded page store each page is indexed from the same decoded text the extractors then read.
+    """
+
+    def __init__(self, page_store: PageTextStore, lazy: bool = False):
+        self.page_store = page_store
+        self.page_count = page_store.page_count
+        self.sections: List[FrozenSet[str]] = []
+        self.formats: List[Union[str, None]] = []
+        self.record_starts: List[int] = []
+        self._section_pages: Dict[str, List[int]] = defaultdict(list)
+        if not lazy:
+            self.extend(self.page_count)
+
+    @property
+    def indexed_pages(self) -> int:
+        return len(self.formats)
+
+    def extend(self, stop_page: int):
+        """ Index every page before stop_page that is not indexed yet """
+        for page_num in range(self.indexed_pages, min(stop_page, self.page_count)):
+            sections = page_sections(self.page_store.text(page_num))
+            page_format = sections_format(sections)
+            self.sections.append(sections)
+            self.formats.append(page_format)
+            for name in sections:
+                self._section_pages[name].append(page_num)
+            if page_format:
+                self.record_starts.append(page_num)
+
+    def page_format(self, page_num: int) -> Union[str, None]:
+        self.extend(page_num + 1)
+        return self.formats[page_num]
+
+    def has_section(self, page_num: int, name: str) -> bool:
+        self.extend(page_num + 1)
+        return name in self.sections[page_num]
+
+    def next_section_page(self, name: str, start_page: int) -> Union[int, None]:
+        """ First page at or after start_page containing the section, or None """
+        self.extend(self.page_count)
+        pages = self._section_pages.get(name, [])
+        i = bisect_left(pages, start_page)
+        return pages[i] if i < len(pages) else None
+
+    def window_end(self, start_page: int, max_pages: int, stop_section: str) -> int:
+        """ Exclusive end of a lookahead window: up to max_pages pages, ending after the first page with stop_section """
+        stop_page = min(start_page + max_pages, self.page_count)
+        # Indexed a page at a time, so a lazy index reads no further than the page with the section
+        for page_num in range(start_page, stop_page):
+            if self.has_section(page_num, stop_section):
+                return page_num + 1
+        return stop_page
+
+    def records_between(self, start_page: int, stop_page: int) -> List[int]:
+        """ Record start pages in [start_page, stop_page) """
+        self.extend(stop_page)
+        return self.record_starts[bisect_left(self.record_starts, start_page):bisect_left(self.record_starts, stop_page)]
+
+    def record_range(self, page_num: int) -> Tuple[int, int]:
+        """ Page range [start, end) of the record starting on page_num: up to the next record page """
+        self.extend(self.page_count)
+        i = bisect_left(self.record_starts, page_num + 1)
+        end_page = self.record_starts[i] if i < len(self.record_starts) else self.page_count
+        return page_num, end_page
+
+    def record_ranges(self) -> List[Tuple[int, int]]:
+        self.extend(self.page_count)
+        return [self.record_range(page_num) for page_num in self.record_starts]
+
+    def summary_pages(self) -> List[int]:
+        """ Pages of the USPTO Summary, from the first summary page up to the analyst review """
+        start_page = self.next_section_page("uspto_summary", 0)
+        if start_page is None:
+            return []
+        end_page = self.next_section_page("analyst_review", start_page + 1)
+        return list(range(start_page, self.page_count if end_page is None else end_page))
@@ -14,6 +14,8 @@ from docx.shared import Pt
 from io import BytesIO
 import re, ast
 from dotenv import load_dotenv
+from llm_client import get_client
+from llm_cache import chat_completion
 load_dotenv()  
 
 class TrademarkDetails(BaseModel):
@@ -43,15 +45,7 @@ def is_correct_format_code2(page_text: str) -> bool:
 
 def extract_trademark_details_code1(document_chunk: str) -> Dict[str, Union[str, List[int]]]:
     try:
-        from openai import AzureOpenAI
-        azure_endpoint = os.getenv("AZURE_ENDPOINT")  
-        api_key = os.getenv("AZURE_API_KEY")  
-          
-        client = AzureOpenAI(  
-            azure_endpoint=azure_endpoint,  
-            api_key=api_key,   
-            api_version="2024-10-01-preview",
-        )  
+        client = get_client()
          
         # messages = [  
         #     {  
@@ -116,7 +110,8 @@ def extract_trademark_details_code1(document_chunk: str) -> Dict[str, Union[str,
                         """}  
                         ]  
         
-        response = client.chat.completions.create(  
+        response = chat_completion(client,
+                stage="extraction",
                 model="gpt-4o-mini",  
                 messages=messages,  
                 temperature=0,  
@@ -297,123 +292,122 @@ def extract_design_phrase(document: str, start_page: int, pdf_document: fitz.Doc
     return "No Design phrase presented in document"
 
     
-def parse_trademark_details(document_path: str) -> List[Dict[str, Union[str, List[int]]]]:
-    with fitz.open(document_path) as pdf_document:
-        all_extracted_data = []
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document.load_page(page_num)
-            page_text = page.get_text()
+def parse_trademark_details(pdf_document: fitz.Document) -> List[Dict[str, Union[str, List[int]]]]:
+    all_extracted_data = []
+    for page_num in range(pdf_document.page_count):
+        page = pdf_document.load_page(page_num)
+        page_text = page.get_text()
+        
+        if is_correct_format_code1(page_text):
+            preprocessed_chunk = preprocess_text(page_text)
+            extracted_data = extract_trademark_details_code1(preprocessed_chunk)
+            additional_data = extract_international_class_numbers_and_goods_services(page_text, page_num, pdf_document)
+            registration_number = extract_registration_number(page_text)
+            design_phrase = extract_design_phrase(page_text, page_num, pdf_document)
             
-            if is_correct_format_code1(page_text):
-                preprocessed_chunk = preprocess_text(page_text)
-                extracted_data = extract_trademark_details_code1(preprocessed_chunk)
-                additional_data = extract_international_class_numbers_and_goods_services(page_text, page_num, pdf_document)
-                registration_number = extract_registration_number(page_text)
-                design_phrase = extract_design_phrase(page_text, page_num, pdf_document)
+            if extracted_data:
+                extracted_data["page_number"] = page_num + 1
+                extracted_data.update(additional_data)
+                extracted_data["design_phrase"] = design_phrase
+                all_extracted_data.append(extracted_data)
+                extracted_data["registration_number"] = registration_number
                 
-                if extracted_data:
-                    extracted_data["page_number"] = page_num + 1
-                    extracted_data.update(additional_data)
-                    extracted_data["design_phrase"] = design_phrase
-                    all_extracted_data.append(extracted_data)
-                    extracted_data["registration_number"] = registration_number
-                    
-                trademark_list = []
-                for i, data in enumerate(all_extracted_data, start=1):
-                    try:
-                        trademark_name = data.get("trademark_name", "").split(',')[0].strip()
+            trademark_list = []
+            for i, data in enumerate(all_extracted_data, start=1):
+                try:
+                    trademark_name = data.get("trademark_name", "").split(',')[0].strip()
+                    if "Global Filings" in trademark_name:
+                        trademark_name = trademark_name.split("Global Filings")[0].strip()
+                    owner = data.get("owner", "").split(',')[0].strip()
+                    status = data.get("status", "").split(',')[0].strip()
+                    serial_number = data.get("serial_number", "")
+                    international_class_number = data.get("international_class_numbers", [])
+                    goods_services = data.get("goods_services", "")
+                    page_number = data.get("page_number", "")
+                    registration_number = data.get("registration_number", "No registration number presented in document")
+                    design_phrase = data.get("design_phrase", "No Design phrase presented in document")
+
+                    # If crucial fields are missing, attempt to re-extract the values
+                    if not trademark_name or not owner or not status or not international_class_number:
+                        preprocessed_chunk = preprocess_text(data.get("raw_text", ""))
+                        extracted_data = extract_trademark_details_code1(preprocessed_chunk)
+                        trademark_name = extracted_data.get("trademark_name", trademark_name).split(',')[0].strip()
                         if "Global Filings" in trademark_name:
                             trademark_name = trademark_name.split("Global Filings")[0].strip()
-                        owner = data.get("owner", "").split(',')[0].strip()
-                        status = data.get("status", "").split(',')[0].strip()
-                        serial_number = data.get("serial_number", "")
-                        international_class_number = data.get("international_class_numbers", [])
-                        goods_services = data.get("goods_services", "")
-                        page_number = data.get("page_number", "")
-                        registration_number = data.get("registration_number", "No registration number presented in document")
-                        design_phrase = data.get("design_phrase", "No Design phrase presented in document")
-
-                        # If crucial fields are missing, attempt to re-extract the values
-                        if not trademark_name or not owner or not status or not international_class_number:
-                            preprocessed_chunk = preprocess_text(data.get("raw_text", ""))
-                            extracted_data = extract_trademark_details_code1(preprocessed_chunk)
-                            trademark_name = extracted_data.get("trademark_name", trademark_name).split(',')[0].strip()
-                            if "Global Filings" in trademark_name:
-                                trademark_name = trademark_name.split("Global Filings")[0].strip()
-                            owner = extracted_data.get("owner", owner).split(',')[0].strip()
-                            status = extracted_data.get("status", status).split(',')[0].strip()
-                            international_class_number = parse_international_class_numbers(extracted_data.get("international_class_number", "")) or international_class_number
-                            registration_number = extracted_data.get("registration_number", registration_number).split(',')[0].strip()
-
-                        trademark_details = TrademarkDetails(
-                            trademark_name=trademark_name,
-                            owner=owner,
-                            status=status,
-                            serial_number=serial_number,
-                            international_class_number=international_class_number,
-                            goods_services=goods_services,
-                            page_number=page_number,
-                            registration_number=registration_number,
-                            design_phrase=design_phrase
-                        )                        
-                        trademark_info = {
-                            "trademark_name": trademark_details.trademark_name,
-                            "owner": trademark_details.owner,
-                            "status": trademark_details.status,
-                            "serial_number": trademark_details.serial_number,
-                            "international_class_number": trademark_details.international_class_number,
-                            "goods_services": trademark_details.goods_services,
-                            "page_number": trademark_details.page_number,
-                            "registration_number":trademark_details.registration_number,
-                            "design_phrase": trademark_details.design_phrase
-                        }
-                        print(trademark_info)
-                        print("_____________________________________________________________________________________________________________________________")
-                        trademark_list.append(trademark_info)
-                    except ValidationError as e:
-                        print(f"Validation error for trademark {i}: {e}")
-                                    
-            else :
-                if not is_correct_format_code2(page_text):
-                    continue
-
-                extracted_data = extract_trademark_details_code2(page_text)
-                if extracted_data:
-                    extracted_data["page_number"] = page_num + 1
-                    all_extracted_data.append(extracted_data)
-
-                trademark_list = []
-                for i, data in enumerate(all_extracted_data, start=1):
-                    try:
-                        trademark_details = TrademarkDetails(
-                            trademark_name=data.get("trademark_name", ""),
-                            owner=data.get("owner", ""),
-                            status=data.get("status", ""),
-                            serial_number=data.get("serial_number", ""),
-                            international_class_number=data.get("international_class_number", []),
-                            goods_services=data.get("goods_services", ""),
-                            page_number=data.get("page_number", 0),
-                            registration_number=data.get("registration_number", ""),
-                            design_phrase=data.get("design_phrase", "")
-                        )
-                        if (trademark_details.trademark_name != "" and trademark_details.owner != "" and trademark_details.status != "" and trademark_details.goods_services != ""):
-                                trademark_info = {
-                                    "trademark_name": trademark_details.trademark_name,
-                                    "owner": trademark_details.owner,
-                                    "status": trademark_details.status,
-                                    "serial_number": trademark_details.serial_number,
-                                    "international_class_number": trademark_details.international_class_number,
-                                    "goods_services": trademark_details.goods_services,
-                                    "page_number": trademark_details.page_number,
-                                    "registration_number":trademark_details.registration_number,
-                                    "design_phrase":trademark_details.design_phrase,
-                                }
+                        owner = extracted_data.get("owner", owner).split(',')[0].strip()
+                        status = extracted_data.get("status", status).split(',')[0].strip()
+                        international_class_number = parse_international_class_numbers(extracted_data.get("international_class_number", "")) or international_class_number
+                        registration_number = extracted_data.get("registration_number", registration_number).split(',')[0].strip()
+
+                    trademark_details = TrademarkDetails(
+                        trademark_name=trademark_name,
+                        owner=owner,
+                        status=status,
+                        serial_number=serial_number,
+                        international_class_number=international_class_number,
+                        goods_services=goods_services,
+                        page_number=page_number,
+                        registration_number=registration_number,
+                        design_phrase=design_phrase
+                    )                        
+                    trademark_info = {
+                        "trademark_name": trademark_details.trademark_name,
+                        "owner": trademark_details.owner,
+                        "status": trademark_details.status,
+                        "serial_number": trademark_details.serial_number,
+                        "international_class_number": trademark_details.international_class_number,
+                        "goods_services": trademark_details.goods_services,
+                        "page_number": trademark_details.page_number,
+                        "registration_number":trademark_details.registration_number,
+                        "design_phrase": trademark_details.design_phrase
+                    }
+                    print(trademark_info)
+                    print("_____________________________________________________________________________________________________________________________")
+                    trademark_list.append(trademark_info)
+                except ValidationError as e:
+                    print(f"Validation error for trademark {i}: {e}")
                                 
-                                trademark_list.append(trademark_info)
-                    except ValidationError as e:
-                        print(f"Validation error for trademark {i}: {e}")
+        else :
+            if not is_correct_format_code2(page_text):
+                continue
+
+            extracted_data = extract_trademark_details_code2(page_text)
+            if extracted_data:
+                extracted_data["page_number"] = page_num + 1
+                all_extracted_data.append(extracted_data)
+
+            trademark_list = []
+            for i, data in enumerate(all_extracted_data, start=1):
+                try:
+                    trademark_details = TrademarkDetails(
+                        trademark_name=data.get("trademark_name", ""),
+                        owner=data.get("owner", ""),
+                        status=data.get("status", ""),
+                        serial_number=data.get("serial_number", ""),
+                        international_class_number=data.get("international_class_number", []),
+                        goods_services=data.get("goods_services", ""),
+                        page_number=data.get("page_number", 0),
+                        registration_number=data.get("registration_number", ""),
+                        design_phrase=data.get("design_phrase", "")
+                    )
+                    if (trademark_details.trademark_name != "" and trademark_details.owner != "" and trademark_details.status != "" and trademark_details.goods_services != ""):
+                            trademark_info = {
+                                "trademark_name": trademark_details.trademark_name,
+                                "owner": trademark_details.owner,
+                                "status": trademark_details.status,
+                                "serial_number": trademark_details.serial_number,
+                                "international_class_number": trademark_details.international_class_number,
+                                "goods_services": trademark_details.goods_services,
+                                "page_number": trademark_details.page_number,
+                                "registration_number":trademark_details.registration_number,
+                                "design_phrase":trademark_details.design_phrase,
+                            }
+                            
+                            trademark_list.append(trademark_info)
+                except ValidationError as e:
+                    print(f"Validation error for trademark {i}: {e}")
 
-        return trademark_list
+    return trademark_list
 
 from azure.core.exceptions import HttpResponseError 
 
@@ -762,13 +756,12 @@ from azure.core.exceptions import HttpResponseError
 #     }
     
 
-def extract_proposed_trademark_details(file_path: str) -> Dict[str, Union[str, List[int]]]:
+def extract_proposed_trademark_details(pdf_document: fitz.Document) -> Dict[str, Union[str, List[int]]]:
     """ Extract proposed trademark details from the given input format """
     proposed_details = {}
-    with fitz.open(file_path) as pdf_document:
-        if pdf_document.page_count > 0:
-            page = pdf_document.load_page(0)
-            page_text = preprocess_text(page.get_text())
+    if pdf_document.page_count > 0:
+        page = pdf_document.load_page(0)
+        page_text = preprocess_text(page.get_text())
             
     name_match = re.search(r'Mark Searched:\s*(.*?)(?=\s*Client Name:)', page_text, re.IGNORECASE | re.DOTALL)
     if name_match:
@@ -790,15 +783,7 @@ def find_class_numbers(goods_services: str) -> List[int]:
     """ Use LLM to find the international class numbers based on goods & services """
         # Initialize AzureChatOpenAI
     
-    from openai import AzureOpenAI
-    azure_endpoint = os.getenv("AZURE_ENDPOINT")  
-    api_key = os.getenv("AZURE_API_KEY")  
-          
-    client = AzureOpenAI(  
-        azure_endpoint=azure_endpoint,  
-        api_key=api_key,   
-        api_version="2024-10-01-preview",
-    )
+    client = get_client()
 
     # messages = [  
     # {  
@@ -866,39 +851,30 @@ def find_class_numbers(goods_services: str) -> List[int]:
     
     # return class_numbers
 
-def extract_proposed_trademark_details2(file_path: str) -> Dict[str, Union[str, List[int]]]:
+def extract_proposed_trademark_details2(pdf_document: fitz.Document) -> Dict[str, Union[str, List[int]]]:
     """ Extract proposed trademark details from the first page of the document """
     proposed_details = {}
-    with fitz.open(file_path) as pdf_document:
-        if pdf_document.page_count > 0:
-            page = pdf_document.load_page(0)
-            page_text = preprocess_text(page.get_text())
-            
-            name_match = re.search(r'Name:\s*(.*?)(?=\s*Nice Classes:)', page_text)
-            if name_match:
-                proposed_details["proposed_trademark_name"] = name_match.group(1).strip()
-                
-            nice_classes_match = re.search(r'Nice Classes:\s*(\d+(?:,\s*\d+)*)', page_text)
-            if nice_classes_match:
-                proposed_details["proposed_nice_classes_number"] = nice_classes_match.group(1).strip()
+    if pdf_document.page_count > 0:
+        page = pdf_document.load_page(0)
+        page_text = preprocess_text(page.get_text())
+        
+        name_match = re.search(r'Name:\s*(.*?)(?=\s*Nice Classes:)', page_text)
+        if name_match:
+            proposed_details["proposed_trademark_name"] = name_match.group(1).strip()
             
-            goods_services_match = re.search(r'Goods & Services:\s*(.*?)(?=\s*Registers|$)', page_text, re.IGNORECASE | re.DOTALL)
-            if goods_services_match:
-                proposed_details["proposed_goods_services"] = goods_services_match.group(1).strip()
+        nice_classes_match = re.search(r'Nice Classes:\s*(\d+(?:,\s*\d+)*)', page_text)
+        if nice_classes_match:
+            proposed_details["proposed_nice_classes_number"] = nice_classes_match.group(1).strip()
+        
+        goods_services_match = re.search(r'Goods & Services:\s*(.*?)(?=\s*Registers|$)', page_text, re.IGNORECASE | re.DOTALL)
+        if goods_services_match:
+            proposed_details["proposed_goods_services"] = goods_services_match.group(1).strip()
     
     return proposed_details
 
 def list_conversion(proposed_class: str) -> List[int]:
     
-    from openai import AzureOpenAI
-    azure_endpoint = os.getenv("AZURE_ENDPOINT")  
-    api_key = os.getenv("AZURE_API_KEY")  
-        
-    client = AzureOpenAI(  
-        azure_endpoint=azure_endpoint,  
-        api_key=api_key,   
-        api_version="2024-10-01-preview",
-    )
+    client = get_client()
 
     messages = [  
                 {  
@@ -923,7 +899,10 @@ def list_conversion(proposed_class: str) -> List[int]:
                 }  
             ]  
     
-    response = client.chat.completions.create(  
+    # Sampled at temperature 0.2, so the answer is not a deterministic function of the prompt
+    response = chat_completion(client,
+                        stage="class_inference",
+                        cache=False,
                         model="gpt-4o-mini",  
                         messages=messages,  
                         temperature=0.2,  
@@ -948,15 +927,13 @@ if uploaded_files:
         # progress_label.text(f"Progress: 0%")  --- Needed to set
 
         for i, uploaded_file in enumerate(uploaded_files):  
-            # Save uploaded file to a temporary file path  
-            temp_file_path = f"temp_{uploaded_file.name}"  
-            with open(temp_file_path, "wb") as f:  
-                f.write(uploaded_file.read())  
+            # Open the upload in memory once; every stage shares this document handle  
+            pdf_document = fitz.open(stream=uploaded_file.read(), filetype="pdf")  
                 
             start_time = time.time()
             
             sp = True
-            proposed_trademark_details = extract_proposed_trademark_details(temp_file_path)  
+            proposed_trademark_details = extract_proposed_trademark_details(pdf_document)  
                             
             if proposed_trademark_details:  
                 proposed_name = proposed_trademark_details.get('proposed_trademark_name', 'N')  
@@ -975,7 +952,7 @@ if uploaded_files:
                     sp = False
             else:  
                 
-                proposed_trademark_details = extract_proposed_trademark_details2(temp_file_path)  
+                proposed_trademark_details = extract_proposed_trademark_details2(pdf_document)  
                 
                 if proposed_trademark_details:  
                     proposed_name = proposed_trademark_details.get('proposed_trademark_name', 'N')  
@@ -1006,7 +983,7 @@ if uploaded_files:
                 
                 # s_time = time.time()
                 
-                existing_trademarks = parse_trademark_details(temp_file_path)
+                existing_trademarks = parse_trademark_details(pdf_document)
                 for i in range(25,46):
                     progress_bar.progress(i)  
                     
@@ -1221,8 +1198,7 @@ if uploaded_files:
                 
                 end_time = time.time()
                 elapsed_time = end_time - start_time
-                elapsed_time = elapsed_time // 60 
-                st.write(f"Time taken: {elapsed_time} mins")
+                st.write(f"Time taken: {elapsed_time / 60:.1f} mins ({elapsed_time:.0f} s)")
 
                 st.write("______________________________________________________________________________________________________________________________")
         
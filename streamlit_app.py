@@ -16,6 +16,8 @@ from docx.shared import Pt
 from io import BytesIO
 import re, ast
 from dotenv import load_dotenv
+from llm_client import get_client
+from llm_cache import chat_completion
 load_dotenv()  
 
 def is_correct_format_code1(page_text: str) -> bool:
@@ -37,15 +39,7 @@ def parse_international_class_numbers(class_numbers: str) -> List[int]:
 
 def extract_trademark_details_code1(document_chunk: str) -> Dict[str, Union[str, List[int]]]:
     try:
-        from openai import AzureOpenAI
-        azure_endpoint = os.getenv("AZURE_ENDPOINT")  
-        api_key = os.getenv("AZURE_API_KEY")  
-          
-        client = AzureOpenAI(  
-            azure_endpoint=azure_endpoint,  
-            api_key=api_key,   
-            api_version="2024-10-01-preview",
-        )  
+        client = get_client()
         
         messages=[  
                     {"role": "system", "content": "You are a data extraction specialist proficient in parsing trademark documents."},  
@@ -71,7 +65,8 @@ def extract_trademark_details_code1(document_chunk: str) -> Dict[str, Union[str,
                         """}  
                         ]  
         
-        response = client.chat.completions.create(  
+        response = chat_completion(client,
+                stage="extraction",
                 model="gpt-4o-mini",  
                 messages=messages,  
                 temperature=0,  
@@ -194,204 +189,133 @@ def extract_design_phrase(document: str, start_page: int, pdf_document: fitz.Doc
         if "Filing Correspondent:" in page_text:
             break
 
-def parse_trademark_details(document_path: str) -> List[Dict[str, Union[str, List[int]]]]:
-    with fitz.open(document_path) as pdf_document:
-        trademark_list = []
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document.load_page(page_num)
-            page_text = page.get_text()
-            
-            if is_correct_format_code1(page_text):
-                preprocessed_chunk = preprocess_text(page_text)
-                extracted_data = extract_trademark_details_code1(preprocessed_chunk)
-                additional_data = extract_international_class_numbers_and_goods_services(page_text, page_num, pdf_document)
-                registration_number = extract_registration_number(page_text)
-                design_phrase = extract_design_phrase(page_text, page_num, pdf_document)
-                
-                if extracted_data:
-                    extracted_data["page_number"] = page_num + 1
-                    extracted_data.update(additional_data)
-                    extracted_data["design_phrase"] = design_phrase
-                    trademark_list.append(extracted_data)
-                    extracted_data["registration_number"] = registration_number
-                    
-                trademark_list = []
-                for i, data in enumerate(trademark_list, start=1):
-                    try:
-                        trademark_name = data.get("trademark_name", "").split(',')[0].strip()
-                        if "Global Filings" in trademark_name:
-                            trademark_name = trademark_name.split("Global Filings")[0].strip()
-                        owner = data.get("owner", "").split(',')[0].strip()
-                        status = data.get("status", "").split(',')[0].strip()
-                        serial_number = data.get("serial_number", "")
-                        international_class_number = data.get("international_class_numbers", [])
-                        goods_services = data.get("goods_services", "")
-                        page_number = data.get("page_number", "")
-                        registration_number = data.get("registration_number", "No registration number presented in document")
-                        design_phrase = data.get("design_phrase", "No Design phrase presented in document")
-
-                        # If crucial fields are missing, attempt to re-extract the values
-                        if not trademark_name or not owner or not status or not international_class_number:
-                            preprocessed_chunk = preprocess_text(data.get("raw_text", ""))
-                            extracted_data = extract_trademark_details_code1(preprocessed_chunk)
-                            trademark_name = extracted_data.get("trademark_name", trademark_name).split(',')[0].strip()
-                            if "Global Filings" in trademark_name:
-                                trademark_name = trademark_name.split("Global Filings")[0].strip()
-                            owner = extracted_data.get("owner", owner).split(',')[0].strip()
-                            status = extracted_data.get("status", status).split(',')[0].strip()
-                            international_class_number = parse_international_class_numbers(extracted_data.get("international_class_number", "")) or international_class_number
-                            registration_number = extracted_data.get("registration_number", registration_number).split(',')[0].strip()
-
-                        trademark_details = TrademarkDetails(
-                            trademark_name=trademark_name,
-                            owner=owner,
-                            status=status,
-                            serial_number=serial_number,
-                            international_class_number=international_class_number,
-                            goods_services=goods_services,
-                            page_number=page_number,
-                            registration_number=registration_number,
-                            design_phrase=design_phrase
-                        )                        
-                        trademark_info = {
-                            "trademark_name": trademark_details.trademark_name,
-                            "owner": trademark_details.owner,
-                            "status": trademark_details.status,
-                            "serial_number": trademark_details.serial_number,
-                            "international_class_number": trademark_details.international_class_number,
-                            "goods_services": trademark_details.goods_services,
-                            "page_number": trademark_details.page_number,
-                            "registration_number":trademark_details.registration_number,
-                            "design_phrase": trademark_details.design_phrase
-                        }
-                        print(trademark_info)
-                        print("_____________________________________________________________________________________________________________________________")
-                        trademark_list.append(trademark_info)
-                    except ValidationError as e:
-                        print(f"Validation error for trademark {i}: {e}")
-                                    
-            else :
-                if not is_correct_format_code2(page_text):
-                    continue
-
-                extracted_data = extract_trademark_details_code2(page_text)
-                if extracted_data:
-                    extracted_data["page_number"] = page_num + 1
-                    trademark_list.append(extracted_data)
-
-                trademark_list = []
-                for i, data in enumerate(trademark_list, start=1):
-                    try:
-                        trademark_details = TrademarkDetails(
-                            trademark_name=data.get("trademark_name", ""),
-                            owner=data.get("owner", ""),
-                            status=data.get("status", ""),
-                            serial_number=data.get("serial_number", ""),
-                            international_class_number=data.get("international_class_number", []),
-                            goods_services=data.get("goods_services", ""),
-                            page_number=data.get("page_number", 0),
-                            registration_number=data.get("registration_number", ""),
-                            design_phrase=data.get("design_phrase", "")
-                        )
-                        if (trademark_details.trademark_name != "" and trademark_details.owner != "" and trademark_details.status != "" and trademark_details.goods_services != ""):
-                                trademark_info = {
-                                    "trademark_name": trademark_details.trademark_name,
-                                    "owner": trademark_details.owner,
-                                    "status": trademark_details.status,
-                                    "serial_number": trademark_details.serial_number,
-                                    "international_class_number": trademark_details.international_class_number,
-                                    "goods_services": trademark_details.goods_services,
-                                    "page_number": trademark_details.page_number,
-                                    "registration_number":trademark_details.registration_number,
-                                    "design_phrase":trademark_details.design_phrase,
-                                }
-                                
-                                trademark_list.append(trademark_info)
-                    except ValidationError as e:
-                        print(f"Validation error for trademark {i}: {e}")
-
-        return trademark_list
-
+    match = re.search(r'Design Phrase:\s*(.*?)(?=Other U\.S\. Registrations:|Filing Correspondent:|Group:|USPTO Page:|$)', combined_texts, re.DOTALL)
+    if match:
+        # Remove any newline characters within the design phrase
+        return ' '.join(match.group(1).split())
+    return "No Design phrase presented in document"
 
-def parse_trademark_details_from_stream(pdf_document) -> List[Dict[str, Union[str, List[int]]]]:
+def parse_trademark_details(pdf_document: fitz.Document) -> List[Dict[str, Union[str, List[int]]]]:
     trademark_list = []
-    return "Hello"
     for page_num in range(pdf_document.page_count):
-        st.write("hi")
         page = pdf_document.load_page(page_num)
         page_text = page.get_text()
-        st.write(page_text)
+        # Raw details found on this page; each is validated into trademark_list
+        page_records = []
         
-    #     if is_correct_format_code1(page_text):
-    #         preprocessed_chunk = preprocess_text(page_text)
-    #         extracted_data = extract_trademark_details_code1(preprocessed_chunk)
-    #         additional_data = extract_international_class_numbers_and_goods_services(page_text, page_num, pdf_document)
-    #         registration_number = extract_registration_number(page_text)
-    #         design_phrase = extract_design_phrase(page_text, page_num, pdf_document)
+        if is_correct_format_code1(page_text):
+            preprocessed_chunk = preprocess_text(page_text)
+            extracted_data = extract_trademark_details_code1(preprocessed_chunk)
+            additional_data = extract_international_class_numbers_and_goods_services(page_text, page_num, pdf_document)
+            registration_number = extract_registration_number(page_text)
+            design_phrase = extract_design_phrase(page_text, page_num, pdf_document)
             
-    #         if extracted_data:
-    #             extracted_data["page_number"] = page_num + 1
-    #             extracted_data.update(additional_data)
-    #             extracted_data["design_phrase"] = design_phrase
-    #             trademark_list.append(extracted_data)
-    #             extracted_data["registration_number"] = registration_number
+            if extracted_data:
+                extracted_data["page_number"] = page_num + 1
+                extracted_data.update(additional_data)
+                extracted_data["design_phrase"] = design_phrase
+                extracted_data["registration_number"] = registration_number
+                page_records.append(extracted_data)
                 
-    #         trademark_list = []
-    #         for i, data in enumerate(trademark_list, start=1):
-    #             try:
-    #                 trademark_name = data.get("trademark_name", "").split(',')[0].strip()
-    #                 if "Global Filings" in trademark_name:
-    #                     trademark_name = trademark_name.split("Global Filings")[0].strip()
-    #                 owner = data.get("owner", "").split(',')[0].strip()
-    #                 status = data.get("status", "").split(',')[0].strip()
-    #                 serial_number = data.get("serial_number", "")
-    #                 international_class_number = data.get("international_class_numbers", [])
-    #                 goods_services = data.get("goods_services", "")
-    #                 page_number = data.get("page_number", "")
-    #                 registration_number = data.get("registration_number", "No registration number presented in document")
-    #                 design_phrase = data.get("design_phrase", "No Design phrase presented in document")
-
-    #                 # If crucial fields are missing, attempt to re-extract the values
-    #                 if not trademark_name or not owner or not status or not international_class_number:
-    #                     preprocessed_chunk = preprocess_text(data.get("raw_text", ""))
-    #                     extracted_data = extract_trademark_details_code1(preprocessed_chunk)
-    #                     trademark_name = extracted_data.get("trademark_name", trademark_name).split(',')[0].strip()
-    #                     if "Global Filings" in trademark_name:
-    #                         trademark_name = trademark_name.split("Global Filings")[0].strip()
-    #                     owner = extracted_data.get("owner", owner).split(',')[0].strip()
-    #                     status = extracted_data.get("status", status).split(',')[0].strip()
-    #                     international_class_number = parse_international_class_numbers(extracted_data.get("international_class_number", "")) or international_class_number
-    #                     registration_number = extracted_data.get("registration_number", registration_number).split(',')[0].strip()
-
-    #                 trademark_details = TrademarkDetails(
-    #                     trademark_name=trademark_name,
-    #                     owner=owner,
-    #                     status=status,
-    #                     serial_number=serial_number,
-    #                     international_class_number=international_class_number,
-    #                     goods_services=goods_services,
-    #                     page_number=page_number,
-    #                     registration_number=registration_number,
-    #                     design_phrase=design_phrase
-    #                 )                        
-    #                 trademark_info = {
-    #                     "trademark_name": trademark_details.trademark_name,
-    #                     "owner": trademark_details.owner,
-    #                     "status": trademark_details.status,
-    #                     "serial_number": trademark_details.serial_number,
-    #                     "international_class_number": trademark_details.international_class_number,
-    #                     "goods_services": trademark_details.goods_services,
-    #                     "page_number": trademark_details.page_number,
-    #                     "registration_number":trademark_details.registration_number,
-    #                     "design_phrase": trademark_details.design_phrase
-    #                 }
-    #                 st.write(trademark_info)
-    #                 st.markdown("---")
-    #                 trademark_list.append(trademark_info)
-    #             except ValidationError as e:
-    #                 print(f"Validation error for trademark {i}: {e}")
-        
-    # return trademark_list
+            for i, data in enumerate(page_records, start=1):
+                try:
+                    trademark_name = data.get("trademark_name", "").split(',')[0].strip()
+                    if "Global Filings" in trademark_name:
+                        trademark_name = trademark_name.split("Global Filings")[0].strip()
+                    owner = data.get("owner", "").split(',')[0].strip()
+                    status = data.get("status", "").split(',')[0].strip()
+                    serial_number = data.get("serial_number", "")
+                    international_class_number = data.get("international_class_numbers", [])
+                    goods_services = data.get("goods_services", "")
+                    page_number = data.get("page_number", "")
+                    registration_number = data.get("registration_number", "No registration number presented in document")
+                    design_phrase = data.get("design_phrase", "No Design phrase presented in document")
+
+                    # If crucial fields are missing, attempt to re-extract the values
+                    if not trademark_name or not owner or not status or not international_class_number:
+                        preprocessed_chunk = preprocess_text(data.get("raw_text", ""))
+                        extracted_data = extract_trademark_details_code1(preprocessed_chunk)
+                        trademark_name = extracted_data.get("trademark_name", trademark_name).split(',')[0].strip()
+                        if "Global Filings" in trademark_name:
+                            trademark_name = trademark_name.split("Global Filings")[0].strip()
+                        owner = extracted_data.get("owner", owner).split(',')[0].strip()
+                        status = extracted_data.get("status", status).split(',')[0].strip()
+                        international_class_number = parse_international_class_numbers(extracted_data.get("international_class_number", "")) or international_class_number
+                        registration_number = extracted_data.get("registration_number", registration_number).split(',')[0].strip()
+
+                    trademark_details = TrademarkDetails(
+                        trademark_name=trademark_name,
+                        owner=owner,
+                        status=status,
+                        serial_number=serial_number,
+                        international_class_number=international_class_number,
+                        goods_services=goods_services,
+                        page_number=page_number,
+                        registration_number=registration_number,
+                        design_phrase=design_phrase
+                    )                        
+                    trademark_info = {
+                        "trademark_name": trademark_details.trademark_name,
+                        "owner": trademark_details.owner,
+                        "status": trademark_details.status,
+                        "serial_number": trademark_details.serial_number,
+                        "international_class_number": trademark_details.international_class_number,
+                        "goods_services": trademark_details.goods_services,
+                        "page_number": trademark_details.page_number,
+                        "registration_number":trademark_details.registration_number,
+                        "design_phrase": trademark_details.design_phrase
+                    }
+                    print(trademark_info)
+                    print("_____________________________________________________________________________________________________________________________")
+                    trademark_list.append(trademark_info)
+                except ValidationError as e:
+                    print(f"Validation error for trademark {i}: {e}")
+                                
+        else :
+            if not is_correct_format_code2(page_text):
+                continue
+
+            extracted_data = extract_trademark_details_code2(page_text)
+            if extracted_data:
+                extracted_data["page_number"] = page_num + 1
+                page_records.append(extracted_data)
+
+            for i, data in enumerate(page_records, start=1):
+                try:
+                    trademark_details = TrademarkDetails(
+                        trademark_name=data.get("trademark_name", ""),
+                        owner=data.get("owner", ""),
+                        status=data.get("status", ""),
+                        serial_number=data.get("serial_number", ""),
+                        international_class_number=data.get("international_class_number", []),
+                        goods_services=data.get("goods_services", ""),
+                        page_number=data.get("page_number", 0),
+                        registration_number=data.get("registration_number", ""),
+                        design_phrase=data.get("design_phrase", "")
+                    )
+                    if (trademark_details.trademark_name != "" and trademark_details.owner != "" and trademark_details.status != "" and trademark_details.goods_services != ""):
+                            trademark_info = {
+                                "trademark_name": trademark_details.trademark_name,
+                                "owner": trademark_details.owner,
+                                "status": trademark_details.status,
+                                "serial_number": trademark_details.serial_number,
+                                "international_class_number": trademark_details.international_class_number,
+                                "goods_services": trademark_details.goods_services,
+                                "page_number": trademark_details.page_number,
+                                "registration_number":trademark_details.registration_number,
+                                "design_phrase":trademark_details.design_phrase,
+                            }
+                            
+                            trademark_list.append(trademark_info)
+                except ValidationError as e:
+                    print(f"Validation error for trademark {i}: {e}")
+
+    return trademark_list
+
+
+def parse_trademark_details_from_stream(pdf_document: fitz.Document) -> List[Dict[str, Union[str, List[int]]]]:
+    """ Parse an upload opened in memory with fitz.open(stream=...), without writing it to disk """
+    return parse_trademark_details(pdf_document)
 
 # Streamlit app
 st.title("Trademark Details Extractor")
@@ -408,17 +332,10 @@ if st.session_state['document']:
     # Read PDF directly from stream
     document_bytes = st.session_state['document'].getvalue()
     pdf_document = fitz.open(stream=document_bytes, filetype="pdf")
-    for page_num in range(pdf_document.page_count):
-        st.write("hi")
-        page = pdf_document.load_page(page_num)
-        page_text = page.get_text()
-        st.write(page_text)
-    # Extract text from the PDF
-    # document_text = "".join([page.get_text() for page in pdf_document])
     
-    # # Process and extract trademark details
-    # extracted_data = parse_trademark_details_from_stream(pdf_document)
-    # st.write(extracted_data)
+    # Process and extract trademark details
+    extracted_data = parse_trademark_details_from_stream(pdf_document)
+    st.write(extracted_data)
     # # Display extracted data
     # if extracted_data:
     #     st.write("## Extracted Trademark Details")
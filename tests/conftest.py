@@ -0,0 +1,40 @@
+import os
+import sys
+import time
+
+import pytest
+
+# The app modules live at the repository root, next to this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openai.types.chat import ChatCompletion  # noqa: E402
+
+from llm_usage import usage_ledger  # noqa: E402
+
+
+def completion(content: str, model: str = "gpt-4o-mini", prompt_tokens: int = 100, completion_tokens: int = 10) -> ChatCompletion:
+    return ChatCompletion.model_validate({
+        "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+    })
+
+
+class FakeClient:
+    """ Stands in for AzureOpenAI: answers every chat request with the next of contents, and records the requests """
+
+    def __init__(self, *contents: str):
+        self.contents = list(contents)
+        self.requests = []
+        self.chat = self
+        self.completions = self
+
+    def create(self, **params) -> ChatCompletion:
+        self.requests.append(params)
+        return completion(self.contents[min(len(self.requests), len(self.contents)) - 1], params.get("model", "gpt-4o-mini"))
+
+
+@pytest.fixture(autouse=True)
+def no_usage_log(monkeypatch):
+    """ Keep the tests from appending to the JSONL usage log of the working directory """
+    monkeypatch.setattr(usage_ledger, "log_path", "")
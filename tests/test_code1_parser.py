@@ -0,0 +1,53 @@
+from code1_parser import Code1ParseStats, confident_fields, parse_code1_fields
+
+PAGE = """12. SCOOPY DOO
+Status: REGISTERED
+Goods/Services:
+International Class 30: ICE CREAM
+Last Reported Owner:
+ACME FROZEN TREATS INC
+Chronology:
+Serial Number: 87−693,628
+Registration Number: 5,809,957
+"""
+
+
+def test_parses_every_field_of_a_clean_page():
+    values, missing = confident_fields(parse_code1_fields(PAGE))
+
+    assert values == {"trademark_name": "SCOOPY DOO", "status": "REGISTERED", "serial_number": "87−693,628", "owner": "ACME FROZEN TREATS INC"}
+    assert missing == []
+
+
+def test_low_confidence_fields_are_left_to_the_llm():
+    page = PAGE.replace("12. SCOOPY DOO", "Scoopy Doo").replace("ACME FROZEN TREATS INC", "Chronology:").replace("Serial Number: ", "Filed as ")
+
+    parsed = parse_code1_fields(page)
+    values, missing = confident_fields(parsed)
+
+    assert parsed["trademark_name"] == ("Scoopy Doo", 0.7)
+    assert parsed["owner"] == ("", 0.0)
+    assert missing == ["trademark_name", "owner"]
+    assert values["serial_number"] == "87−693,628"
+
+
+def test_missing_sections_parse_empty():
+    parsed = parse_code1_fields("Goods/Services: ICE CREAM")
+
+    assert parsed["trademark_name"] == ("", 0.0)
+    assert parsed["status"] == ("", 0.0)
+    assert parsed["serial_number"] == ("", 0.0)
+
+
+def test_stats_are_kept_per_report():
+    stats = Code1ParseStats()
+    stats.record([], "a")
+    stats.record(["owner"], "a")
+    stats.record(["owner", "status"], "b")
+
+    assert stats.stats("a") == {"pages": 2, "pages_without_llm": 1, "fields_from_parser": 7, "fields_from_llm": 1, "llm_avoidance_rate": 0.5}
+    assert stats.stats("b")["fields_from_llm"] == 2
+
+    stats.begin_report("a")
+    assert stats.stats("a")["pages"] == 0
+    assert stats.stats("b")["pages"] == 1
@@ -0,0 +1,83 @@
+import sys
+
+import numpy as np
+import pytest
+
+import goods_similarity
+from goods_similarity import EmbeddingCache, goods_similarity as similarity, rank_by_goods_similarity, score_goods_services
+
+WORDS = ["ice", "cream", "frozen", "dessert", "software", "computer", "shoes"]
+
+
+class StubEncoder:
+    """ Bag-of-words embeddings over WORDS, counting the texts it encodes """
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts, batch_size, convert_to_numpy, normalize_embeddings):
+        self.encoded.extend(texts)
+        vectors = np.array([[text.lower().split().count(word) for word in WORDS] + [0.01] for text in texts], dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def encoder(monkeypatch):
+    encoder = StubEncoder()
+    monkeypatch.setattr(goods_similarity, "embedding_cache", EmbeddingCache(redis_url=""))
+    monkeypatch.setattr(goods_similarity, "get_model", lambda name=None: encoder)
+    return encoder
+
+
+def record(name, goods_services):
+    return {"trademark_name": name, "goods_services": goods_services, "international_class_number": [30]}
+
+
+def test_similarity_is_the_cosine_and_embeddings_are_cached(encoder):
+    scores = similarity("ice cream", ["frozen dessert ice cream", "computer software", ""])
+
+    assert scores[0] > 0.5 and scores[1] < 0.01 and scores[2] == 0
+    similarity("ice cream", ["computer software", "shoes"])
+    assert encoder.encoded == ["ice cream", "frozen dessert ice cream", "computer software", "", "shoes"]
+
+
+def test_scores_are_attached_to_copies_ranked_within_each_batch(encoder):
+    records = [record("A", "computer software"), record("B", "ice cream"), record("C", "shoes"), record("D", "frozen dessert ice cream")]
+
+    scored = list(score_goods_services(records, "ice cream", batch_size=2))
+
+    assert [mark["trademark_name"] for mark in scored] == ["B", "A", "D", "C"]
+    assert all("goods_services_similarity" not in mark for mark in records)
+    assert [mark["trademark_name"] for mark in score_goods_services(records, "ice cream", batch_size=4, rank=False)] == ["A", "B", "C", "D"]
+
+
+def test_unscored_records_rank_last_in_order():
+    records = [{"trademark_name": "A"}, {"trademark_name": "B", "goods_services_similarity": 0.2}, {"trademark_name": "C"}, {"trademark_name": "D", "goods_services_similarity": 0.9}]
+
+    assert [mark["trademark_name"] for mark in rank_by_goods_similarity(records)] == ["D", "B", "A", "C"]
+
+
+def test_marks_go_unscored_when_the_model_cannot_load(monkeypatch):
+    monkeypatch.setattr(goods_similarity, "embedding_cache", EmbeddingCache(redis_url=""))
+    # An entry of None in sys.modules makes the import fail, as when sentence-transformers is not installed
+    monkeypatch.setitem(sys.modules, "sentence_transformers", None)
+    goods_similarity.get_model.cache_clear()
+    records = [record("A", "computer software"), record("B", "ice cream")]
+
+    try:
+        assert list(score_goods_services(records, "ice cream")) == records
+    finally:
+        goods_similarity.get_model.cache_clear()
+
+
+def test_fan_out_prunes_only_scored_marks(monkeypatch):
+    import celery_loaded
+
+    monkeypatch.setattr(celery_loaded, "GOODS_SIMILARITY_PRUNE", 0.3)
+    fanout = celery_loaded.ComparisonFanOut("SCOOP", "30", "ice cream", "report")
+    mark = dict(record("A", "computer software"), owner="", status="REGISTERED", serial_number="", registration_number="", design_phrase="")
+    fanout.add(dict(mark, goods_services_similarity=0.1), same_class=True)
+    fanout.add(dict(mark, trademark_name="B"), same_class=True)
+
+    assert fanout.pruned == 1
+    assert [(sequence, kind, grades[0]["conflict_grade"]) for sequence, kind, grades in fanout._screened] == [(0, "same_class", "Low")]
@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+import celery_loaded
+import llm_cache
+import work_items
+from conftest import FakeClient
+from llm_cache import LLMCache
+from work_items import WorkItemStore
+
+PROPOSED = ("SCOOP-A-PALOOZA", "30, 43", "Ice cream parlour services")
+
+
+def mark(name: str, serial_number: str, classes=(30,)) -> dict:
+    return {
+        "trademark_name": name, "owner": "ACME INC", "status": "REGISTERED", "serial_number": serial_number,
+        "international_class_number": list(classes), "goods_services": "Ice cream", "page_number": 1,
+        "registration_number": "", "design_phrase": "",
+    }
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """ Grading outside Streamlit and Celery, against a fake client, with fresh cache and work-item state """
+    client = FakeClient()
+    monkeypatch.setattr(celery_loaded, "get_client", lambda: client)
+    monkeypatch.setattr(llm_cache, "llm_cache", LLMCache(redis_url=""))
+    monkeypatch.setattr(work_items, "work_item_store", WorkItemStore(redis_url=""))
+    monkeypatch.setattr(work_items, "WORK_ITEM_BACKOFF", 0)
+    return client
+
+
+def test_compare_trademarks_grades_outside_streamlit(llm):
+    llm.contents = ["Reasoning for Conflict:\n- Same first word\nConflict Grade: High"]
+
+    grades = celery_loaded.compare_trademarks.run([mark("SCOOPY", "87-000,001")], *PROPOSED, report_id="report")
+
+    assert len(llm.requests) == 1
+    assert [(grade["Trademark name"], grade["conflict_grade"]) for grade in grades] == [("SCOOPY", "High")]
+
+
+def test_unparseable_same_class_response_is_not_retried(llm):
+    llm.contents = ["I cannot grade this"]
+
+    grades = celery_loaded.compare_trademarks.run([mark("SCOOPY", "87-000,001")], *PROPOSED, report_id="report")
+
+    assert len(llm.requests) == 1
+    assert grades[0]["conflict_grade"] == "Not Defined"
+
+
+def test_compare_trademarks2_grades_outside_streamlit(llm):
+    llm.contents = ["Reasoning for Conflict:\n- Shares SCOOP\nConflict Grade: Name-Match"]
+
+    grade = celery_loaded.compare_trademarks2.run(mark("SCOOPS AHOY", "87-000,002", classes=(9,)), *PROPOSED, report_id="report")
+
+    assert len(llm.requests) == 1
+    assert grade["conflict_grade"] == "Name-Match"
+    assert grade["reasoning"] == "- Shares SCOOP\nConflict Grade: Name-Match"
+
+
+def batch_response(*grades) -> str:
+    return json.dumps({"grades": [{"serial_number": serial_number, "conflict_grade": grade, "reasoning": f"- {serial_number} reasoning"} for serial_number, grade in grades]})
+
+
+def test_batch_grader_parses_mark_grades_outside_streamlit(llm):
+    marks = [mark("SCOOPY", "87-000,001"), mark("SKOOPS", "87-000,002"), mark("SCOOPED", "87-000,003")]
+    llm.contents = [batch_response(("87-000,001", "High"), ("87-000,003", "Moderate"), ("87-000,002", " "))]
+
+    grades = celery_loaded.grade_same_class_batch(marks, *PROPOSED)
+
+    assert llm.requests[0]["response_format"] == celery_loaded.MARK_GRADES_FORMAT
+    assert [grade and grade["conflict_grade"] for grade in grades] == ["High", None, "Moderate"]
+    assert grades[0]["reasoning"] == "- 87-000,001 reasoning"
+
+
+def test_mark_grades_schema_is_strict():
+    schema = celery_loaded.MARK_GRADES_FORMAT["json_schema"]["schema"]
+    grade_schema = schema["$defs"]["MarkGrade"]
+
+    assert schema["required"] == ["grades"] and schema["additionalProperties"] is False
+    assert grade_schema["required"] == ["serial_number", "conflict_grade", "reasoning"]
+    assert grade_schema["additionalProperties"] is False
+    parsed = celery_loaded.MarkGrades.model_validate_json(batch_response(("87-000,001", "Low")))
+    assert parsed.grades[0].conflict_grade == "Low"
+
+
+def test_batched_task_falls_back_per_mark_for_ungraded_marks(llm, monkeypatch):
+    monkeypatch.setattr(celery_loaded, "SAME_CLASS_GRADING_MODE", "batched")
+    marks = [mark("SCOOPY", "87-000,001"), mark("SKOOPS", "87-000,002")]
+    llm.contents = [batch_response(("87-000,001", "High")), "Reasoning for Conflict:\n- Sounds alike\nConflict Grade: Moderate"]
+
+    grades = celery_loaded.compare_trademarks.run(marks, *PROPOSED, report_id="report")
+
+    assert len(llm.requests) == 2
+    assert [(grade["Trademark name"], grade["conflict_grade"]) for grade in grades] == [("SCOOPY", "High"), ("SKOOPS", "Moderate")]
@@ -0,0 +1,85 @@
+import pytest
+
+import llm_cache
+from conftest import FakeClient
+from llm_cache import LLMCache, LLMCacheMiss, cache_key, cache_refresh, chat_completion
+
+MESSAGES = [{"role": "user", "content": "Grade SCOOPY"}]
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = LLMCache(redis_url="")
+    monkeypatch.setattr(llm_cache, "llm_cache", cache)
+    return cache
+
+
+def test_cache_key_covers_sampling_parameters_not_key_order():
+    params = {"model": "gpt-4o-mini", "messages": MESSAGES, "temperature": 0}
+
+    assert cache_key(params) == cache_key(dict(reversed(list(params.items()))))
+    assert cache_key(params) != cache_key(dict(params, temperature=0.2))
+    assert cache_key(params) != cache_key(dict(params, model="gpt-4o"))
+    assert cache_key(params) != cache_key(dict(params, messages=[{"role": "user", "content": "Grade SKOOPY"}]))
+
+
+def test_repeated_request_is_served_from_cache(cache):
+    client = FakeClient("Conflict Grade: High")
+
+    first = chat_completion(client, model="gpt-4o-mini", messages=MESSAGES, temperature=0)
+    second = chat_completion(client, model="gpt-4o-mini", messages=MESSAGES, temperature=0)
+
+    assert len(client.requests) == 1
+    assert second.choices[0].message.content == first.choices[0].message.content == "Conflict Grade: High"
+    assert cache.stats()["memory_hits"] == 1
+
+
+def test_uncached_call_site_always_calls_the_api(cache):
+    client = FakeClient("[3]")
+
+    for _ in range(2):
+        chat_completion(client, cache=False, model="gpt-4o-mini", messages=MESSAGES, temperature=0.2)
+
+    assert len(client.requests) == 2
+    assert cache.stats()["bypassed"] == 2
+
+
+def test_refresh_fetches_again_and_overwrites(cache):
+    client = FakeClient("unparseable", "Conflict Grade: Low")
+    chat_completion(client, model="gpt-4o-mini", messages=MESSAGES)
+
+    token = cache_refresh.set(True)
+    try:
+        refreshed = chat_completion(client, model="gpt-4o-mini", messages=MESSAGES)
+    finally:
+        cache_refresh.reset(token)
+    replayed = chat_completion(client, model="gpt-4o-mini", messages=MESSAGES)
+
+    assert len(client.requests) == 2
+    assert refreshed.choices[0].message.content == replayed.choices[0].message.content == "Conflict Grade: Low"
+
+
+def test_replay_mode_answers_only_from_cache(cache):
+    chat_completion(FakeClient("Conflict Grade: Moderate"), model="gpt-4o-mini", messages=MESSAGES)
+    cache.mode = "replay"
+    client = FakeClient("never sent")
+
+    replayed = chat_completion(client, model="gpt-4o-mini", messages=MESSAGES)
+
+    assert replayed.choices[0].message.content == "Conflict Grade: Moderate"
+    with pytest.raises(LLMCacheMiss):
+        chat_completion(client, model="gpt-4o-mini", messages=[{"role": "user", "content": "Grade SKOOPY"}])
+    with pytest.raises(LLMCacheMiss):
+        chat_completion(client, cache=False, model="gpt-4o-mini", messages=MESSAGES)
+    assert client.requests == []
+
+
+def test_lru_evicts_least_recently_used(cache):
+    cache.max_entries = 2
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1" and cache.get("c") == "3"
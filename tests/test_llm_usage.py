@@ -0,0 +1,55 @@
+import threading
+from types import SimpleNamespace
+
+from llm_usage import UsageLedger, call_cost, charged_to
+
+
+def usage(prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> SimpleNamespace:
+    return SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens))
+
+
+def test_call_cost_prices_cached_tokens_lower():
+    assert call_cost(1000, 1000, 0) < call_cost(1000, 0, 0)
+    assert call_cost(1000, 0, 100) == (1000 * 0.15 + 100 * 0.60) / 1e6
+
+
+def test_report_totals_per_stage_and_overall():
+    ledger = UsageLedger(log_path="", redis_url="")
+    ledger.begin_report("a")
+    ledger.record("extraction", "site", "gpt-4o-mini", usage(1000, 100, cached_tokens=400), 1.5)
+    ledger.record("extraction", "site", "gpt-4o-mini", usage(500, 50), 0.5)
+    ledger.record_cached("same_class_grading")
+
+    report = ledger.report("a")
+
+    assert list(report) == ["extraction", "same_class_grading", "total"]
+    assert report["extraction"]["calls"] == 2 and report["extraction"]["cached_tokens"] == 400
+    assert report["same_class_grading"]["cached_responses"] == 1
+    assert report["total"]["prompt_tokens"] == 1500 and report["total"]["seconds"] == 2.0
+
+
+def test_concurrent_reports_are_charged_separately():
+    """ Each thread, like each Streamlit session, charges its calls to the report it began; charged_to overrides it """
+    ledger = UsageLedger(log_path="", redis_url="")
+    started = threading.Barrier(2)
+    current = {}
+
+    def session(report_id: str, calls: int):
+        ledger.begin_report(report_id)
+        started.wait()
+        for _ in range(calls):
+            ledger.record("extraction", "site", "gpt-4o-mini", usage(100, 10), 0.1)
+        with charged_to("worker"):
+            ledger.record("same_class_grading", "site", "gpt-4o-mini", usage(100, 10), 0.1)
+        current[report_id] = ledger.report()["total"]["calls"]
+
+    threads = [threading.Thread(target=session, args=args) for args in (("a", 3), ("b", 5))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert current == {"a": 3, "b": 5}
+    assert ledger.report("a")["total"]["calls"] == 3
+    assert ledger.report("b")["total"]["calls"] == 5
+    assert ledger.report("worker")["same_class_grading"]["calls"] == 2
@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+import celery_loaded
+from name_screen import NameScreenStats, edit_similarity, normalize_name, screen_names, screened_reasoning
+
+PROPOSED = "SCOOP-A-PALOOZA"
+
+
+def levenshtein(a: str, b: str) -> int:
+    previous = list(range(len(b) + 1))
+    for i, char in enumerate(a, start=1):
+        current = [i]
+        for j, other in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != other)))
+        previous = current
+    return previous[-1]
+
+
+def test_normalize_name():
+    assert normalize_name("Scoopt'd") == "SCOOPTD"
+    assert normalize_name(" scoop-a-palooza! ") == "SCOOP A PALOOZA"
+
+
+def test_edit_similarity_matches_reference_levenshtein():
+    rng = random.Random(0)
+    names = ["".join(rng.choice("ABCS ") for _ in range(rng.randint(0, 12))) for _ in range(200)]
+
+    for name in ["SCOOP", "", "ABBA CAB"]:
+        expected = [1 - levenshtein(name, other) / max(len(name), len(other)) if max(len(name), len(other)) else 1.0 for other in names]
+        assert list(edit_similarity(name, names)) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("name", ["SCOOPT'D", "SKOOP", "SCOOPY", "SCOOP A PALOOZA BAR", "PALOOZA SCOOP"])
+def test_similar_names_go_to_the_llm(name):
+    assert not screen_names(PROPOSED, [name])[0]["clear"]
+
+
+@pytest.mark.parametrize("name", ["MICROSOFT", "TIDE", "BLUE HORIZON LOGISTICS"])
+def test_unrelated_names_are_cleared(name):
+    score = screen_names(PROPOSED, [name])[0]
+
+    assert score["clear"]
+    assert "Conflict Grade: Low" in screened_reasoning(score)
+
+
+def test_unparsed_names_and_disabled_screen_clear_nothing():
+    assert not screen_names(PROPOSED, [""])[0]["clear"]
+    assert not any(score["clear"] for score in screen_names(PROPOSED, ["MICROSOFT", "TIDE"], threshold=0))
+
+
+def test_stats_are_kept_per_report():
+    stats = NameScreenStats()
+    stats.record(10, 4, "a")
+    stats.record(5, 5, "b")
+
+    assert stats.stats("a") == {"marks": 10, "llm_calls_avoided": 4, "llm_avoidance_rate": 0.4}
+    stats.begin_report("a")
+    assert stats.stats("a")["marks"] == 0
+    assert stats.stats("b")["llm_calls_avoided"] == 5
+
+
+def test_fan_out_grades_cleared_cross_class_marks_without_a_task():
+    fanout = celery_loaded.ComparisonFanOut(PROPOSED, "30", "Ice cream", "report")
+    for name in ["MICROSOFT", "TIDE"]:
+        fanout.add({"trademark_name": name, "owner": "", "status": "REGISTERED", "serial_number": "", "international_class_number": [9],
+                    "registration_number": "", "design_phrase": ""}, same_class=False)
+
+    outcomes = list(fanout.drain(poll_seconds=0))
+
+    assert fanout.dispatched == 0 and fanout.screened == 2 and fanout.cross_class_marks == 2
+    assert [(sequence, kind, grades[0]["Trademark name"], grades[0]["conflict_grade"]) for sequence, kind, grades in outcomes] == [
+        (0, "cross_class", "MICROSOFT", "Low"), (1, "cross_class", "TIDE", "Low")]
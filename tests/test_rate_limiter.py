@@ -0,0 +1,80 @@
+import httpx
+import openai
+import pytest
+
+from rate_limiter import RateLimitScheduler, TokenBucket, estimate_tokens, retry_after_seconds
+
+
+def throttle(retry_after_ms: str = "10") -> openai.RateLimitError:
+    response = httpx.Response(429, headers={"retry-after-ms": retry_after_ms}, request=httpx.Request("POST", "https://example.invalid"))
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+def test_bucket_refills_at_rate_up_to_capacity():
+    bucket = TokenBucket(per_minute=600, burst_seconds=10)  # 10 per second, 100 at most
+    start = bucket.updated
+
+    assert bucket.wait_time(100, start) == 0.0
+    bucket.take(100)
+    assert bucket.wait_time(20, start) == pytest.approx(2.0)
+    assert bucket.wait_time(20, start + 2) == 0.0
+    assert bucket.wait_time(1, start + 3600) == 0.0 and bucket.level == 100
+
+
+def test_request_larger_than_bucket_waits_for_full_bucket_only():
+    bucket = TokenBucket(per_minute=600, burst_seconds=10)
+    bucket.take(100)
+
+    assert bucket.wait_time(1000, bucket.updated) == pytest.approx(10.0)
+
+
+def test_estimate_counts_prompt_and_max_tokens():
+    params = {"messages": [{"role": "user", "content": "x" * 400}], "max_tokens": 500}
+
+    assert estimate_tokens(params) >= 500 + 4
+    assert estimate_tokens(dict(params, max_tokens=None)) > estimate_tokens(params)
+
+
+def test_retry_after_headers():
+    assert retry_after_seconds(throttle("1500")) == 1.5
+
+
+def test_additive_increase_and_one_multiplicative_decrease_per_throttle_burst():
+    scheduler = RateLimitScheduler(tpm=10 ** 9, rpm=10 ** 6, min_concurrency=1, max_concurrency=32)
+    assert scheduler.limit == 8
+
+    for _ in range(8):
+        assert scheduler._admit(10) == 0.0
+    assert scheduler._admit(10) > 0
+    for _ in range(8):
+        scheduler._release("ok")
+    assert scheduler.limit == pytest.approx(9, abs=0.1)
+
+    limit = scheduler.limit
+    for _ in range(3):
+        scheduler._admit(10)
+    for _ in range(3):
+        scheduler._release("throttled", retry_after=5)
+    assert scheduler.limit == pytest.approx(limit / 2)
+    assert scheduler._admit(10) == pytest.approx(5, abs=0.1)
+
+
+def test_call_retries_throttles_and_raises_other_errors():
+    scheduler = RateLimitScheduler(tpm=10 ** 9, rpm=10 ** 6)
+    attempts = []
+
+    def request():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise throttle("10")
+        return "ok"
+
+    assert scheduler.call(request, 10) == "ok"
+    assert scheduler.stats()["throttled"] == 2 and scheduler.stats()["retried"] == 2
+
+    def broken():
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        scheduler.call(broken, 10)
+    assert scheduler.in_flight == 0
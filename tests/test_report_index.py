@@ -0,0 +1,107 @@
+from collections import Counter
+
+import fitz
+import pytest
+
+import celery_loaded
+import page_store
+from page_store import PageTextStore
+from report_index import CODE1, ReportIndex
+
+
+def code1_report(mark_count: int) -> fitz.Document:
+    document = fitz.open()
+    for i in range(mark_count):
+        document.new_page().insert_text((72, 72), "\n".join([
+            f"MARK {i}",
+            "Status: REGISTERED",
+            "Goods/Services:",
+            f"International Class {i % 45 + 1}: GOODS FOR MARK {i}",
+            "Last Reported Owner:",
+            f"OWNER {i} INC",
+            "Chronology:",
+            f"Serial Number: 87-000,{i:03d}",
+            "Design Phrase: WORD MARK",
+            "Filing Correspondent:",
+        ]), fontsize=9)
+    return fitz.open(stream=document.tobytes(), filetype="pdf")
+
+
+def fake_details(document_chunk: str) -> dict:
+    return {
+        "trademark_name": document_chunk.split(" Status:", 1)[0].strip(),
+        "status": "REGISTERED",
+        "serial_number": "87-000,000",
+        "owner": document_chunk.split("Last Reported Owner: ", 1)[1].split(" Chronology:", 1)[0],
+    }
+
+
+@pytest.fixture
+def decodes(monkeypatch):
+    """ Pages decoded by every PageTextStore, with the code1 LLM calls stubbed out """
+    async def fake_records(pages):
+        return {page_number: fake_details(document_chunk) for page_number, document_chunk in pages}
+
+    async def fake_fields(item):
+        document_chunk, fields = item
+        return {field: fake_details(document_chunk).get(field, "") for field in fields}
+
+    async def fake_page(document_chunk):
+        return fake_details(document_chunk)
+
+    monkeypatch.setattr(celery_loaded, "aextract_code1_records", fake_records)
+    monkeypatch.setattr(celery_loaded, "aextract_code1_fields", fake_fields)
+    monkeypatch.setattr(celery_loaded, "aextract_trademark_details_code1", fake_page)
+    counts = Counter()
+    page_blocks = page_store.page_blocks
+
+    def counting_page_blocks(page, extractor=None):
+        counts[page.number] += 1
+        return page_blocks(page, extractor)
+
+    monkeypatch.setattr(page_store, "page_blocks", counting_page_blocks)
+    return counts
+
+
+def test_lazy_index_reads_only_requested_pages(decodes):
+    index = ReportIndex(PageTextStore(code1_report(30), max_pages=12), lazy=True)
+
+    assert index.records_between(0, 4) == [0, 1, 2, 3]
+    assert index.window_end(3, 8, "filing_correspondent") == 4
+    assert index.indexed_pages == 4
+    assert index.page_format(20) == CODE1
+    assert index.indexed_pages == 21
+
+
+@pytest.mark.parametrize("max_pages", [9, 12, 100])
+def test_parse_decodes_each_page_once(decodes, max_pages):
+    pdf_document = code1_report(40)
+
+    trademarks = celery_loaded.parse_trademark_details(pdf_document, PageTextStore(pdf_document, max_pages=max_pages))
+
+    assert [trademark["trademark_name"] for trademark in trademarks] == [f"MARK {i}" for i in range(40)]
+    assert set(decodes) == set(range(40))
+    assert max(decodes.values()) == 1
+
+
+def test_design_phrase_is_read_from_the_store_window():
+    document = fitz.open()
+    document.new_page().insert_text((72, 72), "MARK 0\nStatus: REGISTERED\nGoods/Services:\nClass 30: ICE CREAM", fontsize=9)
+    document.new_page().insert_text((72, 72), "Design Phrase: THE STYLIZED WORD\nSCOOPY\nFiling Correspondent:", fontsize=9)
+    store = PageTextStore(fitz.open(stream=document.tobytes(), filetype="pdf"))
+
+    assert celery_loaded.extract_design_phrase(0, store) == "THE STYLIZED WORD SCOOPY"
+    assert celery_loaded.extract_design_phrase(0, store, ReportIndex(store)) == "THE STYLIZED WORD SCOOPY"
+
+
+def test_design_phrase_window_stops_at_the_record_end():
+    document = fitz.open()
+    document.new_page().insert_text((72, 72), "MARK 0\nStatus: REGISTERED\nGoods/Services:\nClass 30: ICE CREAM\nFiling Correspondent:", fontsize=9)
+    document.new_page().insert_text((72, 72), "MARK 1\nStatus: REGISTERED\nGoods/Services:\nClass 30: ICE CREAM\nDesign Phrase: LATER MARK", fontsize=9)
+    document.new_page()
+    store = PageTextStore(fitz.open(stream=document.tobytes(), filetype="pdf"))
+    report_index = ReportIndex(store, lazy=True)
+
+    assert celery_loaded.extract_design_phrase(0, store, report_index) == "No Design phrase presented in document"
+    assert report_index.indexed_pages == 1
+    assert celery_loaded.extract_design_phrase(1, store, report_index) == "LATER MARK"
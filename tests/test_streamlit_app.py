@@ -0,0 +1,29 @@
+import fitz
+
+import streamlit_app
+
+
+def code2_report(names):
+    """ A report with one code2 page per name, parsed by regex only """
+    document = fitz.open()
+    for i, name in enumerate(names):
+        page = document.new_page()
+        page.insert_text((50, 60), f"{i + 1} / {len(names)}\n\n{name}\nStatus: Registered\nOwner: ACME INC\nRegister EUIPO\nNice Classes\n30, 43\n"
+                                   f"Application# 0{i}\nGoods & Services\nIce cream", fontsize=9)
+    return fitz.open(stream=document.tobytes(), filetype="pdf")
+
+
+def test_parse_trademark_details_keeps_every_page():
+    trademarks = streamlit_app.parse_trademark_details(code2_report(["SCOOPY", "SKOOPS"]))
+
+    assert [trademark["trademark_name"] for trademark in trademarks] == ["SCOOPY", "SKOOPS"]
+    assert [trademark["page_number"] for trademark in trademarks] == [1, 2]
+    assert trademarks[0]["international_class_number"] == [30, 43]
+
+
+def test_extract_design_phrase_returns_phrase():
+    document = fitz.open()
+    document.new_page().insert_text((50, 60), "Design Phrase: THE STYLIZED WORD\nSCOOPY\nFiling Correspondent: JANE DOE", fontsize=9)
+
+    assert streamlit_app.extract_design_phrase("", 0, document) == "THE STYLIZED WORD SCOOPY"
+    assert streamlit_app.extract_design_phrase("", 1, document) == "No Design phrase presented in document"
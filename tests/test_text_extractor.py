@@ -0,0 +1,25 @@
+import fitz
+import pytest
+
+from text_extractor import EXTRACTORS, BlocksExtractor, TextExtractor
+
+
+def test_backend_without_page_blocks_fails_when_constructed():
+    class Incomplete(TextExtractor):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_blocks_backend_matches_get_text():
+    document = fitz.open()
+    page = document.new_page()
+    page.insert_text((72, 72), "MARK 0\nStatus: REGISTERED", fontsize=9)
+    page.insert_text((72, 400), "Goods/Services:", fontsize=9)
+
+    height, blocks = BlocksExtractor().page_blocks(page)
+
+    assert height == page.rect.height
+    assert "".join(text for top, bottom, text in blocks) == page.get_text()
+    assert all(isinstance(extractor, TextExtractor) for extractor in EXTRACTORS.values())
@@ -0,0 +1,121 @@
+import threading
+
+import pytest
+
+import work_items
+from llm_cache import cache_refresh
+from llm_engine import map_bounded_sync
+from work_items import WorkItemFailed, WorkItemStore, arun_work_item, run_work_item
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = WorkItemStore(redis_url="")
+    monkeypatch.setattr(work_items, "work_item_store", store)
+    monkeypatch.setattr(work_items, "WORK_ITEM_BACKOFF", 0)
+    return store
+
+
+def flaky(failures: int, result="done"):
+    """ A work item that fails its first `failures` calls; calls records whether each one bypassed the LLM cache """
+    calls = []
+
+    def func():
+        calls.append(cache_refresh.get())
+        if len(calls) <= failures:
+            raise ValueError(f"attempt {len(calls)}")
+        return result
+
+    return func, calls
+
+
+def test_retry_bypasses_cache_and_checkpoints(store):
+    func, calls = flaky(2)
+
+    assert run_work_item("grade", ["SCOOPY"], func, report_id="a") == "done"
+    assert run_work_item("grade", ["SCOOPY"], func, report_id="a") == "done"
+
+    assert calls == [False, True, True]
+    assert store.stats() == {"completed": 1, "resumed": 1, "retried": 2, "dead_letters": 0}
+
+
+def test_exhausted_item_is_dead_lettered_and_retried_on_rerun(store):
+    func, calls = flaky(3)
+
+    with pytest.raises(WorkItemFailed) as failure:
+        run_work_item("grade", ["SCOOPY"], func, label="SCOOPY", report_id="a")
+
+    assert failure.value.kind == "grade" and "attempt 3" in str(failure.value)
+    assert [(entry["label"], entry["attempts"]) for entry in store.dead_letters("a")] == [("SCOOPY", 3)]
+    assert store.dead_letters("b") == []
+
+    assert run_work_item("grade", ["SCOOPY"], func, report_id="a") == "done"
+    assert store.dead_letters("a") == []
+
+
+def test_no_dead_letter_for_items_with_a_fallback(store):
+    func, calls = flaky(3)
+
+    with pytest.raises(WorkItemFailed):
+        run_work_item("grade_batch", ["SCOOPY"], func, report_id="a", dead_letter=False)
+
+    assert store.dead_letters("a") == []
+
+
+def test_abort_on_raises_at_once(store):
+    class TimeLimit(Exception):
+        pass
+
+    def func():
+        calls.append(1)
+        raise TimeLimit()
+
+    calls = []
+    with pytest.raises(TimeLimit):
+        run_work_item("grade", ["SCOOPY"], func, report_id="a", abort_on=(TimeLimit,))
+
+    assert calls == [1]
+    assert store.dead_letters("a") == []
+
+
+def test_async_work_item_retries_and_dead_letters(store):
+    func, calls = flaky(5)
+
+    async def item(name):
+        return await arun_work_item("page", [name], lambda: _async(func), label=name, report_id="a")
+
+    results = map_bounded_sync(item, ["page 1"])
+
+    assert isinstance(results[0], WorkItemFailed)
+    assert len(calls) == 3
+    assert [entry["label"] for entry in store.dead_letters("a")] == ["page 1"]
+
+
+async def _async(func):
+    return func()
+
+
+def test_concurrent_reports_keep_their_own_dead_letters(store):
+    """ Each thread, like each Streamlit session, files its items under the report it began, including async ones """
+    started = threading.Barrier(2)
+
+    def session(report_id: str):
+        store.begin_report(report_id)
+        started.wait()
+        func, calls = flaky(3)
+        with pytest.raises(WorkItemFailed):
+            run_work_item("class_inference", [report_id], func, label=report_id)
+
+        async def item(name):
+            return await arun_work_item("page", [report_id, name], lambda: _async(flaky(3)[0]), label=f"{report_id} {name}")
+
+        map_bounded_sync(item, ["page 1"])
+
+    threads = [threading.Thread(target=session, args=(report_id,)) for report_id in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for report_id in ("a", "b"):
+        assert sorted(entry["label"] for entry in store.dead_letters(report_id)) == [report_id, f"{report_id} page 1"]
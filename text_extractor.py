@@ -0,0 +1,165 @@
+import abc
+import hashlib
+import json
+import os
+import time
+from typing import Callable, Dict, List, Tuple
+
+import fitz  # PyMuPDF
+
+
+# (page height, [(block top, block bottom, block text), ...]) for the text blocks of one page
+PageBlocks = Tuple[float, List[Tuple[float, float, str]]]
+
+# No image decoding and no ligature preservation ("ﬁ" comes out as "fi"); whitespace kept so line breaks survive
+TUNED_FLAGS = fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_MEDIABOX_CLIP
+
+TEXT_EXTRACT_CACHE_DIR = os.getenv("TEXT_EXTRACT_CACHE_DIR", ".text_cache")
+
+# Pages sampled from a report when choosing a backend for it
+SELECT_SAMPLE_PAGES = 12
+
+
+class TextExtractor(abc.ABC):
+    """ Decodes one page into PageBlocks; backends differ in the PyMuPDF text mode and flags they use """
+
+    name = ""
+
+    def __init__(self, flags: int = None):
+        self.flags = flags
+
+    @abc.abstractmethod
+    def page_blocks(self, page: fitz.Page) -> PageBlocks:
+        """ Page height and the text blocks of page, top and bottom measured from the top of the page """
+
+
+class BlocksExtractor(TextExtractor):
+    """ get_text("blocks") with default flags: the joined blocks are exactly page.get_text() """
+
+    name = "blocks"
+
+    def page_blocks(self, page: fitz.Page) -> PageBlocks:
+        rect = page.rect
+        return rect.height, [(block[1] - rect.y0, block[3] - rect.y0, block[4]) for block in page.get_text("blocks", flags=self.flags) if block[6] == 0]
+
+
+class PlainTextExtractor(TextExtractor):
+    """ get_text("text"): the whole page as one block, so no header / footer can be told apart """
+
+    name = "text"
+
+    def page_blocks(self, page: fitz.Page) -> PageBlocks:
+        height = page.rect.height
+        return height, [(0.0, height, page.get_text("text", flags=self.flags))]
+
+
+class WordsExtractor(TextExtractor):
+    """ get_text("words"), with lines and blocks rebuilt from the word block / line numbers """
+
+    name = "words"
+
+    def page_blocks(self, page: fitz.Page) -> PageBlocks:
+        rect = page.rect
+        blocks = {}
+        for x0, y0, x1, y1, word, block_no, line_no, word_no in page.get_text("words", flags=self.flags):
+            block = blocks.setdefault(block_no, [y0, y1, {}])
+            block[0] = min(block[0], y0)
+            block[1] = max(block[1], y1)
+            block[2].setdefault(line_no, []).append(word)
+        return rect.height, [
+            (top - rect.y0, bottom - rect.y0, "".join(" ".join(words) + "\n" for line_no, words in sorted(lines.items())))
+            for block_no, (top, bottom, lines) in sorted(blocks.items())
+        ]
+
+
+class RawDictExtractor(TextExtractor):
+    """ get_text("rawdict"), with block text assembled from the characters of each span """
+
+    name = "rawdict"
+
+    def page_blocks(self, page: fitz.Page) -> PageBlocks:
+        rect = page.rect
+        text_blocks = []
+        for block in page.get_text("rawdict", flags=self.flags)["blocks"]:
+            if block["type"] != 0:
+                continue
+            text = "".join(
+                "".join(char["c"] for span in line["spans"] for char in span["chars"]) + "\n"
+                for line in block["lines"]
+            )
+            text_blocks.append((block["bbox"][1] - rect.y0, block["bbox"][3] - rect.y0, text))
+        return rect.height, text_blocks
+
+
+class DiskCachedExtractor(TextExtractor):
+    """ Wraps another backend and keeps its output on disk, keyed by the page content and fonts """
+
+    def __init__(self, inner: TextExtractor, cache_dir: str = TEXT_EXTRACT_CACHE_DIR):
+        super().__init__(inner.flags)
+        self.inner = inner
+        self.cache_dir = cache_dir
+        self.name = f"disk:{inner.name}"
+
+    def _key(self, page: fitz.Page) -> str:
+        digest = hashlib.sha256(page.read_contents())
+        # Same content stream with different fonts can map glyphs to different text
+        digest.update(repr(page.get_fonts()).encode("utf-8"))
+        digest.update(f"{self.inner.name}:{self.inner.flags}:{page.rect}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def page_blocks(self, page: fitz.Page) -> PageBlocks:
+        path = os.path.join(self.cache_dir, f"{self._key(page)}.json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                height, blocks = json.load(f)
+            return height, [tuple(block) for block in blocks]
+        except (OSError, ValueError):
+            pass
+
+        page_blocks = self.inner.page_blocks(page)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(page_blocks, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return page_blocks
+
+
+EXTRACTORS: Dict[str, TextExtractor] = {
+    "blocks": BlocksExtractor(),
+    "text": PlainTextExtractor(TUNED_FLAGS),
+    "words": WordsExtractor(TUNED_FLAGS),
+    "rawdict": RawDictExtractor(TUNED_FLAGS),
+}
+
+DEFAULT_EXTRACTOR = EXTRACTORS["blocks"]
+
+
+def get_extractor(name: str) -> TextExtractor:
+    """ Backend by name; "disk:<name>" wraps that backend in the on-disk cache """
+    if name.startswith("disk:"):
+        return DiskCachedExtractor(get_extractor(name[len("disk:"):]))
+    return EXTRACTORS[name]
+
+
+def _sample_pages(page_count: int, sample_pages: int) -> List[int]:
+    step = max(1, page_count // sample_pages)
+    return list(range(0, page_count, step))[:sample_pages]
+
+
+def select_extractor(pdf_document: fitz.Document, check: Callable[[str], object], candidates: List[TextExtractor] = None, sample_pages: int = SELECT_SAMPLE_PAGES) -> TextExtractor:
+    """ Fastest backend whose text gives the same check() result as the default backend on a sample of pages """
+    candidates = candidates or list(EXTRACTORS.values())
+    pages = [pdf_document.load_page(page_num) for page_num in _sample_pages(pdf_document.page_count, sample_pages)]
+    expected = [check("".join(text for top, bottom, text in DEFAULT_EXTRACTOR.page_blocks(page)[1])) for page in pages]
+
+    best, best_elapsed = DEFAULT_EXTRACTOR, None
+    for extractor in candidates:
+        start = time.perf_counter()
+        texts = ["".join(text for top, bottom, text in extractor.page_blocks(page)[1]) for page in pages]
+        elapsed = time.perf_counter() - start
+        if [check(text) for text in texts] != expected:
+            continue
+        if best_elapsed is None or elapsed < best_elapsed:
+            best, best_elapsed = extractor, elapsed
+    return best
@@ -0,0 +1,230 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Tuple, Type, TypeVar, Union
+
+import redis
+
+from llm_cache import cache_refresh
+
+R = TypeVar("R")
+
+# Attempts per work item, on top of the throttle and connection retries of the rate-limit scheduler
+WORK_ITEM_ATTEMPTS = int(os.getenv("WORK_ITEM_ATTEMPTS", 3))
+WORK_ITEM_BACKOFF = float(os.getenv("WORK_ITEM_BACKOFF", 1))
+WORK_ITEM_TTL = int(os.getenv("WORK_ITEM_TTL", 7 * 24 * 3600))
+WORK_ITEM_MAX_ENTRIES = int(os.getenv("WORK_ITEM_MAX_ENTRIES", 4096))
+REDIS_URL = os.getenv("REDIS_URL", "")
+
+# Report that work items run in this context are filed under; begin_report sets it for the calling thread, so
+# concurrent Streamlit sessions keep their own, and Celery tasks pass their report_id explicitly
+current_report = contextvars.ContextVar("work_item_report", default="")
+
+
+class WorkItemFailed(Exception):
+    """ Raised when a work item has used all its attempts; it is on the dead-letter list of its report """
+
+    def __init__(self, kind: str, label: str, error: Union[Exception, str]):
+        # Plain-string args, so Celery can serialise the exception of a failed task and rebuild it in the caller
+        super().__init__(kind, label, error if isinstance(error, str) else repr(error))
+        self.kind = kind
+        self.label = label
+        self.error = error
+
+    def __str__(self) -> str:
+        return f"{self.kind} {self.label} failed: {self.args[2]}"
+
+
+def work_item_key(kind: str, payload: Any) -> str:
+    """ Identity of a work item: the same kind and inputs always name the same item, in any run or process """
+    return hashlib.sha256(json.dumps([kind, payload], sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+def report_id_for(pdf_bytes: bytes) -> str:
+    return hashlib.sha256(pdf_bytes).hexdigest()[:16]
+
+
+def _backoff(attempt: int) -> float:
+    return min(30.0, WORK_ITEM_BACKOFF * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+
+
+class WorkItemStore:
+    """ Results of completed work items and the dead-letter list of each report, in memory and in Redis
+
+    A completed item is never run again while its checkpoint lives, so a rerun of a report only redoes
+    the items that failed. Celery workers and the app see the same checkpoints and dead letters through Redis.
+    """
+
+    def __init__(self, ttl: int = WORK_ITEM_TTL, max_entries: int = WORK_ITEM_MAX_ENTRIES, redis_url: str = REDIS_URL):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.redis_client = redis.Redis.from_url(redis_url) if redis_url else None
+        self._checkpoints = OrderedDict()
+        self._dead_letters: Dict[str, Dict[str, Dict[str, Union[str, int, float]]]] = {}
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.resumed = 0
+        self.retried = 0
+
+    def begin_report(self, report_id: str):
+        """ Make report_id the current report of this context and clear its dead letters; they are recorded again if they fail again """
+        current_report.set(report_id)
+        with self._lock:
+            self._dead_letters.pop(report_id, None)
+        if self.redis_client is not None:
+            try:
+                self.redis_client.delete(f"work_items:dead:{report_id}")
+            except redis.RedisError as e:
+                print(f"Work item Redis delete failed: {e}")
+
+    def checkpoint(self, key: str) -> Union[Dict[str, Any], None]:
+        with self._lock:
+            payload = self._checkpoints.get(key)
+            if payload is not None:
+                self._checkpoints.move_to_end(key)
+        if payload is None and self.redis_client is not None:
+            try:
+                cached = self.redis_client.get(f"work_items:done:{key}")
+            except redis.RedisError as e:
+                print(f"Work item Redis read failed: {e}")
+                cached = None
+            if cached is not None:
+                payload = cached.decode("utf-8")
+                self._remember(key, payload)
+        if payload is None:
+            return None
+        with self._lock:
+            self.resumed += 1
+        # Decoded on every read, so a caller mutating its result never changes the checkpoint
+        return json.loads(payload)
+
+    def _remember(self, key: str, payload: str):
+        with self._lock:
+            self._checkpoints[key] = payload
+            self._checkpoints.move_to_end(key)
+            if len(self._checkpoints) > self.max_entries:
+                self._checkpoints.popitem(last=False)
+
+    def complete(self, key: str, result: Any, report_id: str):
+        # Wrapped so that a None result is still a checkpoint
+        payload = json.dumps({"result": result}, ensure_ascii=False, default=str)
+        self._remember(key, payload)
+        with self._lock:
+            self.completed += 1
+            self._dead_letters.get(report_id, {}).pop(key, None)
+        if self.redis_client is not None:
+            try:
+                self.redis_client.set(f"work_items:done:{key}", payload, ex=self.ttl)
+                self.redis_client.hdel(f"work_items:dead:{report_id}", key)
+            except redis.RedisError as e:
+                print(f"Work item Redis write failed: {e}")
+
+    def fail(self, key: str, kind: str, label: str, error: Exception, attempts: int, report_id: str):
+        entry = {"kind": kind, "label": label, "error": repr(error), "attempts": attempts, "failed_at": time.time()}
+        with self._lock:
+            self._dead_letters.setdefault(report_id, {})[key] = entry
+        if self.redis_client is not None:
+            try:
+                self.redis_client.hset(f"work_items:dead:{report_id}", key, json.dumps(entry, ensure_ascii=False))
+                self.redis_client.expire(f"work_items:dead:{report_id}", self.ttl)
+            except redis.RedisError as e:
+                print(f"Work item Redis write failed: {e}")
+
+    def retry(self):
+        with self._lock:
+            self.retried += 1
+
+    def dead_letters(self, report_id: str = None) -> List[Dict[str, Union[str, int, float]]]:
+        """ Items of a report (the current one by default) that failed every attempt, oldest first """
+        report_id = current_report.get() if report_id is None else report_id
+        with self._lock:
+            entries = dict(self._dead_letters.get(report_id, {}))
+        if self.redis_client is not None:
+            try:
+                # Items dead-lettered by Celery workers are only in Redis
+                for key, payload in self.redis_client.hgetall(f"work_items:dead:{report_id}").items():
+                    entries.setdefault(key.decode("utf-8"), json.loads(payload))
+            except redis.RedisError as e:
+                print(f"Work item Redis read failed: {e}")
+        return sorted(entries.values(), key=lambda entry: entry["failed_at"])
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "completed": self.completed,
+            "resumed": self.resumed,
+            "retried": self.retried,
+            "dead_letters": len(self.dead_letters()),
+        }
+
+
+work_item_store = WorkItemStore()
+
+
+def run_work_item(kind: str, payload: Any, func: Callable[[], R], label: str = "", report_id: str = None, dead_letter: bool = True, attempts: int = WORK_ITEM_ATTEMPTS, abort_on: Tuple[Type[BaseException], ...] = ()) -> R:
+    """ func() as an idempotent work item: served from its checkpoint when it completed before, otherwise
+    retried with jittered backoff, checkpointed once it succeeds, and dead-lettered when every attempt fails
+
+    Retries bypass the LLM response cache, so a response that failed to parse is fetched again rather than replayed.
+    Raises WorkItemFailed after the last attempt; dead_letter=False is for items the caller still has a fallback for.
+    Exceptions in abort_on, such as a Celery soft time limit, are raised at once: no retry, checkpoint or dead letter.
+    """
+    report_id = current_report.get() if report_id is None else report_id
+    key = work_item_key(kind, payload)
+    entry = work_item_store.checkpoint(key)
+    if entry is not None:
+        return entry["result"]
+    for attempt in range(attempts):
+        if attempt:
+            work_item_store.retry()
+            time.sleep(_backoff(attempt))
+        token = cache_refresh.set(attempt > 0)
+        try:
+            result = func()
+        except abort_on:
+            raise
+        except Exception as e:
+            print(f"Work item {kind} {label} attempt {attempt + 1}/{attempts} failed: {e!r}")
+            error = e
+            continue
+        finally:
+            cache_refresh.reset(token)
+        work_item_store.complete(key, result, report_id)
+        return result
+    if dead_letter:
+        work_item_store.fail(key, kind, label, error, attempts, report_id)
+    raise WorkItemFailed(kind, label, error) from error
+
+
+async def arun_work_item(kind: str, payload: Any, func: Callable[[], Awaitable[R]], label: str = "", report_id: str = None, dead_letter: bool = True, attempts: int = WORK_ITEM_ATTEMPTS, abort_on: Tuple[Type[BaseException], ...] = ()) -> R:
+    """ Async run_work_item; Redis is consulted off the event loop """
+    report_id = current_report.get() if report_id is None else report_id
+    key = work_item_key(kind, payload)
+    entry = await asyncio.to_thread(work_item_store.checkpoint, key)
+    if entry is not None:
+        return entry["result"]
+    for attempt in range(attempts):
+        if attempt:
+            work_item_store.retry()
+            await asyncio.sleep(_backoff(attempt))
+        token = cache_refresh.set(attempt > 0)
+        try:
+            result = await func()
+        except abort_on:
+            raise
+        except Exception as e:
+            print(f"Work item {kind} {label} attempt {attempt + 1}/{attempts} failed: {e!r}")
+            error = e
+            continue
+        finally:
+            cache_refresh.reset(token)
+        await asyncio.to_thread(work_item_store.complete, key, result, report_id)
+        return result
+    if dead_letter:
+        await asyncio.to_thread(work_item_store.fail, key, kind, label, error, attempts, report_id)
+    raise WorkItemFailed(kind, label, error) from error